@@ -0,0 +1,90 @@
+import asyncio
+import time
+from metrics import Progress, timed
+
+# Operations awaited at once by default
+DEFAULT_CONCURRENCY = 500
+
+# Firestore's "500/50/5" ramp-up guidance: start at 500 operations per second
+# and grow the rate by at most 50% every 5 minutes
+RAMP_START_OPS_PER_SECOND = 500
+RAMP_GROWTH = 1.5
+RAMP_INTERVAL_SECONDS = 5 * 60
+
+class TokenBucket:
+    """
+    Rate limiter allowing `rate` operations per second on average, with bursts
+    of up to one second's worth of tokens. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def current_rate(self, now):
+        return self.rate
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                rate = self.current_rate(now)
+                self.tokens = min(rate, self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / rate)
+
+class RampUpLimiter(TokenBucket):
+    """
+    Token bucket following the 500/50/5 rule: 500 ops/sec at first, 50% more
+    every 5 minutes, never above max_rate when one is given.
+    """
+
+    def __init__(self, start_rate=RAMP_START_OPS_PER_SECOND, growth=RAMP_GROWTH,
+                 interval=RAMP_INTERVAL_SECONDS, max_rate=None):
+        super().__init__(start_rate)
+        self.growth = growth
+        self.interval = interval
+        self.max_rate = max_rate
+        self.started = time.monotonic()
+
+    def current_rate(self, now):
+        rate = self.rate * self.growth ** int((now - self.started) // self.interval)
+        return min(rate, self.max_rate) if self.max_rate else rate
+
+async def run_bounded(items, operation, concurrency=DEFAULT_CONCURRENCY, limiter=None, label="operations", rpc=None):
+    """
+    Await operation(item) for every item with at most `concurrency` in flight,
+    taking a limiter token before each one.
+
+    Items are pulled from the iterable as workers free up, so a generator is
+    never materialized. A failed operation is reported and does not stop the
+    others. Each operation's latency goes to the rpc_seconds histogram under
+    rpc (the label by default). Returns (succeeded, failed) counts.
+    """
+    iterator = iter(items)
+    progress = Progress(label)
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        # Every worker draws from the same iterator, so each item is handled once
+        for item in iterator:
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                with timed("rpc_seconds", rpc=rpc or label):
+                    await operation(item)
+                progress.update()
+            except Exception as e:
+                failed += 1
+                print(f"Operation failed: {e}")
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    progress.finish(f", {failed} failed")
+    return progress.done, failed
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from benchmark_pipeline import (DEFAULT_FIRESTORE_EMULATOR_HOST, PERCENTILES, RESULTS_DIRECTORY,
+                                git_commit, percentile, reset_emulator)
+from connections import DEFAULT_EMULATOR_PROJECT
+
+EVENT_TYPES = ["behavior", "diet", "exercise", "health"]
+
+def seconds_summary(latencies):
+    summary = {f"p{q}": round(percentile(latencies, q), 6) for q in PERCENTILES}
+    summary.update(min=round(min(latencies), 6), max=round(max(latencies), 6))
+    return summary
+
+def benchmark_layout(args, layout):
+    """
+    Seed the emulator in one layout, then append events to a few dogs and time
+    every append, plus a read of each dog afterwards. Growth compares the
+    first and last tenth of each writer's appends, as the arrays get longer.
+    """
+    import mock_data_to_firebase
+    from connections import get_firestore_client
+    from event_links import append_event
+
+    random.seed(args.seed)
+    reset_emulator(args.project)
+    users = mock_data_to_firebase.generate_random_users(args.users)
+    mock_data_to_firebase.write_documents_bulk(mock_data_to_firebase.generate_bulk_documents(users, layout=layout), record_created=False)
+
+    db = get_firestore_client()
+    owners = {doc.reference: doc.get("users")[0] for doc in db.collection("dogs").select(["users"]).limit(args.dogs).stream()}
+
+    def append_events(dog_ref, appends):
+        latencies = []
+        for _ in range(appends):
+            event_type = random.choice(EVENT_TYPES)
+            event = mock_data_to_firebase.generate_random_event(event_type, dog_ref, owners[dog_ref])
+            start = time.perf_counter()
+            append_event(db, layout, dog_ref, event_type, event)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    # Every dog gets --writers threads appending to it at once, as concurrent clients would
+    per_writer = args.appends // args.writers
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(owners) * args.writers) as executor:
+        futures = [executor.submit(append_events, dog_ref, per_writer) for dog_ref in owners for _ in range(args.writers)]
+        writers = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    reads = []
+    for dog_ref in owners:
+        start = time.perf_counter()
+        dog_ref.get()
+        reads.append(time.perf_counter() - start)
+
+    latencies = [latency for writer in writers for latency in writer]
+    tenth = max(1, per_writer // 10)
+    return {
+        "appends": len(latencies),
+        "append_seconds": seconds_summary(latencies),
+        "appends_per_sec": round(len(latencies) / elapsed, 1),
+        "first_tenth_p50": round(percentile([latency for writer in writers for latency in writer[:tenth]], 50), 6),
+        "last_tenth_p50": round(percentile([latency for writer in writers for latency in writer[-tenth:]], 50), 6),
+        "dog_read_seconds": seconds_summary(reads),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare event-append latency of the dog -> event link layouts on the Firestore emulator.")
+    parser.add_argument("--layouts", default="arrays,indexed,subcollection", help="Comma-separated layouts to compare")
+    parser.add_argument("--users", type=int, default=20, help="Users seeded before appending")
+    parser.add_argument("--dogs", type=int, default=4, help="Dogs events are appended to")
+    parser.add_argument("--appends", type=int, default=500, help="Events appended to each dog")
+    parser.add_argument("--writers", type=int, default=1, help="Concurrent writers appending to each dog")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the seeded data and appended events")
+    parser.add_argument("--project", default=os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_EMULATOR_PROJECT), help="Emulator project ID")
+    parser.add_argument("--firestore-emulator", default=os.getenv("FIRESTORE_EMULATOR_HOST", DEFAULT_FIRESTORE_EMULATOR_HOST), help="Firestore emulator host:port")
+    parser.add_argument("--output", help="Where to write the JSON report (default: outputs/benchmarks/event-append-<commit>.json)")
+    args = parser.parse_args()
+
+    # Never let a benchmark touch production: the client is pointed at the emulator
+    os.environ["FIRESTORE_EMULATOR_HOST"] = args.firestore_emulator
+    os.environ["GOOGLE_CLOUD_PROJECT"] = args.project
+
+    layouts = {}
+    for layout in [layout.strip() for layout in args.layouts.split(",") if layout.strip()]:
+        print(f"[{layout}] seeding and appending...", file=sys.stderr)
+        layouts[layout] = benchmark_layout(args, layout)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "seed": args.seed,
+        "users": args.users,
+        "dogs": args.dogs,
+        "appends_per_dog": args.appends,
+        "writers_per_dog": args.writers,
+        "layouts": layouts,
+    }
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"event-append-{(report['commit'] or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {output}", file=sys.stderr)
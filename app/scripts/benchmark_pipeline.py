@@ -0,0 +1,227 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+from connections import DEFAULT_EMULATOR_PROJECT
+
+# Ports configured in firebase.json (Firestore) and fake-gcs-server's default
+DEFAULT_FIRESTORE_EMULATOR_HOST = "localhost:8080"
+DEFAULT_STORAGE_EMULATOR_HOST = "http://localhost:4443"
+
+BENCHMARK_BUCKET = "vai-benchmark"
+WORK_DIRECTORY = "app/scripts/outputs/benchmark_work"
+RESULTS_DIRECTORY = "app/scripts/outputs/benchmarks"
+
+# Stages in the order a full run executes them; each depends on the ones before it
+STAGES = ["seed", "jsonl_export", "csv_export", "join", "upload", "delete"]
+
+def count_lines(path, header=False):
+    with open(path, "r") as file:
+        return sum(1 for _ in file) - (1 if header else 0)
+
+def run_seed(args):
+    import mock_data_to_firebase
+    from dataset_generator import generate_records, write_to_firestore
+
+    mock_data_to_firebase.CREATED_ITEMS_FILE = os.path.join(args.work_dir, "created_items.jsonl")
+    records = generate_records(args.users, events_per_dog=args.events_per_dog, seed=args.seed)
+    return {"documents": write_to_firestore(records)}
+
+def run_jsonl_export(args):
+    import export_firestore_to_jsonl as exporter
+
+    exporter.OUTPUT_DIRECTORY = args.work_dir
+    documents = 0
+    for collection_name in exporter.COLLECTIONS:
+        documents += count_lines(exporter.fetch_and_save_data(collection_name))
+    return {"documents": documents}
+
+def run_csv_export(args):
+    from connections import get_firestore_client
+    from firebase_to_csv_direct import collection_writers
+
+    documents = 0
+    for collection_name, write_csv in collection_writers():
+        path = os.path.join(args.work_dir, f"{collection_name}.csv")
+        write_csv(get_firestore_client().collection(collection_name).stream(), path)
+        documents += count_lines(path, header=True)
+    return {"documents": documents}
+
+def run_join(args):
+    import jsonl_to_csv_to_gcs as join
+
+    def local_path(path):
+        return os.path.join(args.work_dir, os.path.basename(path))
+
+    users = join.build_user_index(local_path(join.USERS_JSONL))
+    dogs = join.build_dog_index(local_path(join.DOGS_JSONL))
+    documents = 0
+    with open(local_path(join.OUTPUT_CSV), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(join.CSV_HEADERS)
+        for event_type, path in join.EVENT_JSONL_FILES.items():
+            for event in join.iter_jsonl(local_path(path)):
+                writer.writerow(join.to_csv_row(event_type, event, *join.join_event(event, users, dogs)))
+                documents += 1
+    return {"documents": documents}
+
+def run_upload(args):
+    from gcs_upload import get_storage_client, upload_files
+
+    bucket = get_storage_client().bucket(BENCHMARK_BUCKET)
+    if not bucket.exists():
+        bucket.create()
+    paths = [os.path.join(args.work_dir, name) for name in sorted(os.listdir(args.work_dir))
+             if name.endswith((".jsonl", ".csv")) and name != "created_items.jsonl"]
+    failed = upload_files([(path, BENCHMARK_BUCKET, f"benchmark/{os.path.basename(path)}") for path in paths])
+    if failed:
+        raise RuntimeError(f"Uploads failed: {', '.join(failed)}")
+    return {"documents": len(paths), "bytes": sum(os.path.getsize(path) for path in paths)}
+
+def run_delete(args):
+    from mock_data_delete import delete_created_items_bulk
+
+    manifest = os.path.join(args.work_dir, "created_items.jsonl")
+    documents = count_lines(manifest)
+    # The teardown reports its own errors and carries on; a stage that deleted less must not pass as timed
+    deleted = delete_created_items_bulk(manifest)
+    if deleted != documents:
+        raise RuntimeError(f"Deleted {deleted} of the {documents} documents listed in {manifest}")
+    return {"documents": documents}
+
+STAGE_RUNNERS = {
+    "seed": run_seed,
+    "jsonl_export": run_jsonl_export,
+    "csv_export": run_csv_export,
+    "join": run_join,
+    "upload": run_upload,
+    "delete": run_delete,
+}
+
+def run_stage_process(stage, args):
+    """
+    Run one stage in a child process and return (seconds, peak RSS in MiB, stage result).
+
+    A fresh interpreter per stage gives every stage its own peak RSS and
+    includes client setup in the stage's time, as in a standalone run.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage,
+               "--work-dir", args.work_dir, "--users", str(args.users),
+               "--events-per-dog", str(args.events_per_dog), "--seed", str(args.seed)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Stage {stage} exited with status {process.returncode}")
+    # The stage result is the last line; everything before it is the scripts' own output
+    result = json.loads(output.strip().splitlines()[-1])
+    # ru_maxrss is reported in KiB on Linux
+    return elapsed, usage.ru_maxrss / 1024, result
+
+def reset_emulator(project):
+    """Drop every document in the Firestore emulator's database."""
+    host = os.environ["FIRESTORE_EMULATOR_HOST"]
+    url = f"http://{host}/emulator/v1/projects/{project}/databases/(default)/documents"
+    urllib.request.urlopen(urllib.request.Request(url, method="DELETE")).close()
+
+def summarize(runs):
+    """
+    Aggregate (seconds, peak RSS, result) tuples of one stage. A handful of
+    whole-stage runs only supports min/median/max, not tail percentiles.
+    """
+    seconds = [elapsed for elapsed, _, _ in runs]
+    median = statistics.median(seconds)
+    documents = runs[-1][2]["documents"]
+    summary = {
+        "runs": len(runs),
+        "documents": documents,
+        "seconds": {"min": round(min(seconds), 4), "median": round(median, 4), "max": round(max(seconds), 4)},
+        "docs_per_sec": round(documents / median, 1),
+        "peak_rss_mb": round(max(rss for _, rss, _ in runs), 1),
+    }
+    if "bytes" in runs[-1][2]:
+        summary["bytes"] = runs[-1][2]["bytes"]
+        summary["mb_per_sec"] = round(runs[-1][2]["bytes"] / 1024 / 1024 / median, 2)
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args):
+    """Seed each dataset size and time every stage over the requested number of repeats."""
+    results = []
+    for users in args.sizes:
+        args.users = users
+        args.work_dir = os.path.join(WORK_DIRECTORY, f"users-{users}")
+        runs = {stage: [] for stage in args.stages}
+        for repeat in range(args.repeat):
+            reset_emulator(args.project)
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+            os.makedirs(args.work_dir)
+            for stage in args.stages:
+                print(f"[users={users} run={repeat + 1}/{args.repeat}] {stage}...", file=sys.stderr)
+                runs[stage].append(run_stage_process(stage, args))
+        results.append({
+            "users": users,
+            "events_per_dog": args.events_per_dog,
+            "stages": {stage: summarize(stage_runs) for stage, stage_runs in runs.items()},
+        })
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "sizes": results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the seed/export/join/upload/delete pipeline against local emulators.")
+    parser.add_argument("--sizes", default="10,100", help="Comma-separated numbers of users to seed")
+    parser.add_argument("--events-per-dog", type=int, default=30, help="Events generated for each dog")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the deterministic dataset generator")
+    parser.add_argument("--repeat", type=int, default=3, help="Full pipeline runs per size")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated stages from: {', '.join(STAGES)}")
+    parser.add_argument("--project", default=os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_EMULATOR_PROJECT), help="Emulator project ID")
+    parser.add_argument("--firestore-emulator", default=os.getenv("FIRESTORE_EMULATOR_HOST", DEFAULT_FIRESTORE_EMULATOR_HOST), help="Firestore emulator host:port")
+    parser.add_argument("--storage-emulator", default=os.getenv("STORAGE_EMULATOR_HOST", DEFAULT_STORAGE_EMULATOR_HOST), help="Fake GCS server URL")
+    parser.add_argument("--output", help="Where to write the JSON report (default: outputs/benchmarks/pipeline-<commit>.json)")
+    # Internal: run a single stage in this process
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Never let a benchmark touch production: every client is pointed at the emulators
+    os.environ["FIRESTORE_EMULATOR_HOST"] = args.firestore_emulator
+    os.environ["STORAGE_EMULATOR_HOST"] = args.storage_emulator
+    os.environ["GOOGLE_CLOUD_PROJECT"] = args.project
+
+    if args.run_stage:
+        print(json.dumps(STAGE_RUNNERS[args.run_stage](args)))
+        sys.exit(0)
+
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    report = run_benchmark(args)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"pipeline-{(report['commit'] or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {output}", file=sys.stderr)
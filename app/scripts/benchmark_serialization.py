@@ -0,0 +1,64 @@
+import argparse
+import datetime
+import json
+import time
+from itertools import cycle, islice
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud import firestore
+from dataset_generator import REFERENCE_FIELDS, generate_records
+from serializers import BACKEND, encode_jsonl_line
+
+def legacy_json_serializer(obj):
+    """The exporter's original json.dumps default hook, kept as the baseline."""
+    if isinstance(obj, DatetimeWithNanoseconds):
+        return obj.isoformat()
+    elif isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    elif isinstance(obj, firestore.DocumentReference):
+        return obj.path
+    return str(obj)
+
+def legacy_encode(collection_name, doc_id, data):
+    record = dict(data)
+    record["id"] = doc_id
+    return json.dumps(record, default=legacy_json_serializer) + "\n"
+
+def to_firestore_types(data):
+    """Turn generated records into the types a Firestore stream returns."""
+    converted = {}
+    for field, value in data.items():
+        if field in REFERENCE_FIELDS:
+            if isinstance(value, list):
+                value = [firestore.DocumentReference(*path.split("/")) for path in value]
+            else:
+                value = firestore.DocumentReference(*value.split("/"))
+        elif isinstance(value, datetime.datetime):
+            value = DatetimeWithNanoseconds.fromisoformat(value.replace(tzinfo=datetime.timezone.utc).isoformat())
+        converted[field] = value
+    return converted
+
+def measure(encode, fixture, total):
+    start = time.perf_counter()
+    size = 0
+    for collection_name, doc_id, data in islice(cycle(fixture), total):
+        size += len(encode(collection_name, doc_id, data))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare JSONL serialization throughput before and after the precompiled encoders.")
+    parser.add_argument("--docs", type=int, default=1_000_000, help="Documents serialized per run")
+    parser.add_argument("--sample-users", type=int, default=500, help="Users in the generated fixture that is cycled through")
+    args = parser.parse_args()
+
+    fixture = [
+        (collection_name, doc_id, to_firestore_types(data))
+        for collection_name, doc_id, data in generate_records(args.sample_users)
+    ]
+    print(f"Fixture: {len(fixture)} distinct documents, serializing {args.docs}")
+
+    before, before_bytes = measure(legacy_encode, fixture, args.docs)
+    print(f"before (json.dumps default=...): {before:,.0f} rows/sec, {before_bytes:,} bytes")
+    after, after_bytes = measure(encode_jsonl_line, fixture, args.docs)
+    print(f"after ({BACKEND} + per-collection encoders): {after:,.0f} rows/sec, {after_bytes:,} bytes")
+    print(f"speedup: {after / before:.2f}x")
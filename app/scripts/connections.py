@@ -0,0 +1,79 @@
+import os
+from functools import lru_cache
+
+# "demo-" projects are only ever served by the emulators
+DEFAULT_EMULATOR_PROJECT = "demo-vai"
+
+# Pooled HTTP connections for Storage; the requests default of 10 is below the upload concurrency
+HTTP_POOL_SIZE = 32
+
+def firestore_emulator_host():
+    return os.getenv("FIRESTORE_EMULATOR_HOST")
+
+@lru_cache(maxsize=None)
+def get_firebase_app():
+    """
+    The default Firebase app, initialized on first use.
+
+    Uses the service-account file in GOOGLE_APPLICATION_CREDENTIALS, falling
+    back to application default credentials. Against the emulator no
+    credentials are loaded.
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if firestore_emulator_host():
+        project = os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_EMULATOR_PROJECT)
+        return firebase_admin.initialize_app(options={"projectId": project})
+    key_file = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    return firebase_admin.initialize_app(credentials.Certificate(key_file) if key_file else None)
+
+@lru_cache(maxsize=None)
+def get_firestore_client():
+    """
+    Shared Firestore client, created on first use.
+
+    Every thread reuses the client and its single gRPC channel, so the
+    handshake happens once per run. The library's channel already sends
+    keepalives and lifts the message size limits. Honors FIRESTORE_EMULATOR_HOST.
+    """
+    from google.cloud import firestore
+
+    if firestore_emulator_host():
+        # The client connects to the emulator over an insecure channel with anonymous credentials
+        return firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_EMULATOR_PROJECT))
+
+    app = get_firebase_app()
+    return firestore.Client(project=app.project_id, credentials=app.credential.get_credential())
+
+@lru_cache(maxsize=None)
+def get_async_firestore_client():
+    """
+    Shared AsyncClient, created on first use.
+
+    Call it from inside a running event loop: the channel belongs to that loop,
+    so a run should do all of its async work inside a single asyncio.run().
+    """
+    from google.cloud import firestore
+
+    if firestore_emulator_host():
+        return firestore.AsyncClient(project=os.getenv("GOOGLE_CLOUD_PROJECT", DEFAULT_EMULATOR_PROJECT))
+
+    app = get_firebase_app()
+    return firestore.AsyncClient(project=app.project_id, credentials=app.credential.get_credential())
+
+@lru_cache(maxsize=None)
+def get_storage_client():
+    """
+    Shared Storage client, created on first use.
+
+    Honors STORAGE_EMULATOR_HOST, so uploads can target a local fake GCS server.
+    """
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    client = storage.Client()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    client._http.mount("https://", adapter)
+    client._http.mount("http://", adapter)
+    return client
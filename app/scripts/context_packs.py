@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from metrics import count, span, write_run_report
+from serializers import to_plain
+
+# Key-value file of packs: one row per dog with its pack JSON and the signature it was built from
+CONTEXT_FILE = "app/scripts/outputs/dog_context.sqlite"
+# Optional Firestore copy, one document per dog, read by the RAG chat flow
+CONTEXT_COLLECTION = "dogContext"
+# Root collection the app writes events to and generateDogResponse queries
+EVENTS_COLLECTION = "events"
+
+# Most recent events kept per prompt section
+DEFAULT_EVENTS_PER_TYPE = 10
+# Dogs (consecutive in ID order) one worker task builds
+PACK_CHUNK_SIZE = 500
+# Dogs of an incremental update queried together with an "in" filter (Firestore allows 30 values)
+IN_QUERY_SIZE = 30
+# Taken off the time a chunk's events were read, so an event committed while this
+# machine's clock ran ahead of the server's still counts as newer than the pack
+CLOCK_SKEW_MARGIN = timedelta(minutes=1)
+
+# Fields of simplifiedDogData in functions/src/genkit-rag-chat-flow.ts
+PROFILE_FIELDS = ["age", "breed", "name", "sex", "weight"]
+# Event fields a pack is built from
+EVENT_FIELDS = ["dogId", "type", "eventDate", "data"]
+
+# dog-vet-prompt input section -> (event type, fields of the event's data map), as generateDogResponse builds them
+PROMPT_SECTIONS = {
+    "dietEvents": ("dietException", ["foodType", "notes", "amount"]),
+    "behaviorEvents": ("behavior", ["behaviorType", "severity", "notes"]),
+    "exerciseEvents": ("exercise", ["activityType", "duration", "distance", "source"]),
+    "healthEvents": ("health", ["eventType", "severity", "notes"]),
+    "wellnessEvents": ("wellness", ["mentalState", "severity", "notes"]),
+    "dietScheduleEvents": ("dietSchedule", ["endDate", "feedingTimes", "brandName", "foodType", "quantity", "dogImageUrl"]),
+    "poopJournalEvents": ("poopJournal", ["notes", "solidScale"]),
+    "vetAppointmentEvents": ("vetAppointment", ["appointmentType", "vetName", "notes", "vetDocuments"]),
+    "vaccinationAppointmentEvents": ("vaccinationAppointment", ["vaccinationsType", "vetName", "notes", "vetDocuments"]),
+    "weightChangeEvents": ("weightChange", ["weight"]),
+}
+SECTION_OF_TYPE = {event_type: section for section, (event_type, _) in PROMPT_SECTIONS.items()}
+
+# Sorts events without an eventDate first
+OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+def summarize_event(event):
+    """The fields generateDogResponse keeps of an event: those of its section under data, and eventDate."""
+    _, fields = PROMPT_SECTIONS[SECTION_OF_TYPE[event.get("type")]]
+    details = event.get("data") if isinstance(event.get("data"), dict) else {}
+    summary = {field: to_plain(details[field]) for field in fields if field in details}
+    summary["eventDate"] = to_plain(event.get("eventDate"))
+    return summary
+
+class NewestEvents:
+    """The newest events_per_type events of each prompt section of one dog, and how many each section had."""
+    def __init__(self, events_per_type):
+        self.events_per_type = events_per_type
+        self.sections = {}
+        self.counts = {}
+        self.seen = 0
+
+    def add(self, event):
+        section = SECTION_OF_TYPE.get(event.get("type"))
+        if section is None:
+            return
+        event_date = event.get("eventDate")
+        key = (event_date if isinstance(event_date, datetime) else OLDEST, self.seen)
+        self.seen += 1
+        self.counts[section] = self.counts.get(section, 0) + 1
+        heap = self.sections.setdefault(section, [])
+        if len(heap) < self.events_per_type:
+            heapq.heappush(heap, (key, event))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, event))
+
+    def oldest_first(self, section):
+        return [event for _, event in sorted(self.sections.get(section, []), key=lambda item: item[0])]
+
+def build_pack(dog_id, profile, newest, events_read_at):
+    """
+    The context pack of a dog: its simplified profile, the newest events of
+    every prompt section (oldest first), summarized, how many events each section
+    has, and when its events were read. Events written after events_read_at are
+    not in the pack.
+    """
+    pack = {"dogId": dog_id, "simplifiedDogData": profile}
+    last_event_date = None
+    for section in PROMPT_SECTIONS:
+        events = newest.oldest_first(section)
+        pack[section] = [summarize_event(event) for event in events]
+        if events and isinstance(events[-1].get("eventDate"), datetime):
+            last_event_date = max(last_event_date or OLDEST, events[-1]["eventDate"])
+    pack["eventCounts"] = newest.counts
+    pack["lastEventDate"] = last_event_date.isoformat() if last_event_date else None
+    pack["eventsReadAt"] = events_read_at.isoformat()
+    return pack
+
+def chunk_queries(db, dog_ids, sparse):
+    """
+    Queries of the events collection covering the dogs: one dogId range for a
+    consecutive run, "in" filters for scattered dogs (incremental updates).
+    """
+    from google.cloud.firestore import FieldFilter
+
+    events = db.collection(EVENTS_COLLECTION)
+    refs = [db.document(f"dogs/{dog_id}") for dog_id in dog_ids]
+    if sparse:
+        return [events.where(filter=FieldFilter("dogId", "in", refs[start:start + IN_QUERY_SIZE])).select(EVENT_FIELDS)
+                for start in range(0, len(refs), IN_QUERY_SIZE)]
+    return [events.where(filter=FieldFilter("dogId", ">=", refs[0]))
+                  .where(filter=FieldFilter("dogId", "<=", refs[-1])).select(EVENT_FIELDS)]
+
+def build_pack_chunk(dog_ids, profiles, events_per_type, sparse):
+    """
+    Packs of a sorted run of dogs as (dog ID, pack JSON) pairs, from their events
+    in the events collection. Only the newest events_per_type events of each
+    section are held while the events stream past.
+    """
+    from connections import get_firestore_client
+
+    db = get_firestore_client()
+    events_read_at = datetime.now(timezone.utc) - CLOCK_SKEW_MARGIN
+    newest = {dog_id: NewestEvents(events_per_type) for dog_id in dog_ids}
+    for query in chunk_queries(db, dog_ids, sparse):
+        for doc in query.stream():
+            event = doc.to_dict()
+            dog_ref = event.get("dogId")
+            dog_events = newest.get(getattr(dog_ref, "id", None))
+            if dog_events is not None:
+                dog_events.add(event)
+    return [(dog_id, json.dumps(build_pack(dog_id, profiles[dog_id], newest[dog_id], events_read_at)))
+            for dog_id in dog_ids]
+
+def read_profiles(db):
+    """{dog ID: simplified profile} of every dog in Firestore."""
+    return {doc.id: {field: to_plain((doc.to_dict() or {}).get(field)) for field in PROFILE_FIELDS}
+            for doc in db.collection("dogs").select(PROFILE_FIELDS).stream()}
+
+def dogs_with_new_events(db, since):
+    """IDs of dogs with an event written or edited after since."""
+    from google.cloud.firestore import FieldFilter
+
+    query = db.collection(EVENTS_COLLECTION).where(filter=FieldFilter("updatedAt", ">", since)).select(["dogId"])
+    return {doc.get("dogId").id for doc in query.stream() if doc.get("dogId") is not None}
+
+def dog_signatures(profiles, events_per_type):
+    """A short hash per dog of its profile and the pack size; a changed signature means its pack must be rebuilt."""
+    signatures = {}
+    for dog_id, profile in profiles.items():
+        key = json.dumps([profile, events_per_type], sort_keys=True, default=str)
+        signatures[dog_id] = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return signatures
+
+def open_context_file(path=CONTEXT_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS dog_context (dog_id TEXT PRIMARY KEY, signature TEXT NOT NULL, pack TEXT NOT NULL, built_at TEXT NOT NULL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS build_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    return connection
+
+def load_pack(dog_id, path=CONTEXT_FILE):
+    """A dog's pack from the key-value file, or None."""
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute("SELECT pack FROM dog_context WHERE dog_id = ?", (dog_id,)).fetchone()
+    finally:
+        connection.close()
+    return json.loads(row[0]) if row else None
+
+def build_context_packs(incremental=False, events_per_type=DEFAULT_EVENTS_PER_TYPE, workers=None, firestore=False):
+    """
+    Build the context pack of every dog from the dogs and events collections, the
+    same documents generateDogResponse reads, in a process pool, into the
+    key-value file and optionally the dogContext collection.
+
+    With incremental, only dogs whose profile changed or that have events
+    written since the previous build are rebuilt and written. Deleted events
+    are only dropped from packs by a full build. Packs of dogs that no longer
+    exist are removed. Returns (packs written, packs removed).
+    """
+    from connections import get_firestore_client
+
+    db = get_firestore_client()
+    started_at = datetime.now(timezone.utc) - CLOCK_SKEW_MARGIN
+    with span("read_profiles"):
+        profiles = read_profiles(db)
+    signatures = dog_signatures(profiles, events_per_type)
+
+    connection = open_context_file()
+    stored = dict(connection.execute("SELECT dog_id, signature FROM dog_context"))
+    last_build = connection.execute("SELECT value FROM build_state WHERE key = 'events_read_at'").fetchone()
+    sparse = incremental and last_build is not None
+    if sparse:
+        with span("read_new_events"):
+            new_events = dogs_with_new_events(db, datetime.fromisoformat(last_build[0]))
+        changed = sorted(dog_id for dog_id, signature in signatures.items()
+                         if stored.get(dog_id) != signature or dog_id in new_events)
+    else:
+        changed = sorted(signatures)
+    removed = sorted(set(stored) - set(signatures))
+    print(f"Building packs of {len(changed)} of {len(signatures)} dogs, removing {len(removed)}")
+
+    tasks = [changed[start:start + PACK_CHUNK_SIZE] for start in range(0, len(changed), PACK_CHUNK_SIZE)]
+    built_at = datetime.now(timezone.utc).isoformat()
+
+    def packs():
+        # Spawned workers open their own Firestore client: a gRPC channel must not cross a fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = executor.map(build_pack_chunk, tasks, [{dog_id: profiles[dog_id] for dog_id in task} for task in tasks],
+                                   [events_per_type] * len(tasks), [sparse] * len(tasks))
+            for chunk in results:
+                connection.executemany("INSERT OR REPLACE INTO dog_context VALUES (?, ?, ?, ?)",
+                                       [(dog_id, signatures[dog_id], pack, built_at) for dog_id, pack in chunk])
+                count("packs_built", len(chunk))
+                yield from chunk
+
+    try:
+        with span("build_packs"):
+            if firestore:
+                written, deleted = write_packs_to_firestore(packs(), signatures, built_at, removed)
+                print(f"Wrote {written} and deleted {deleted} {CONTEXT_COLLECTION} documents")
+            else:
+                written = sum(1 for _ in packs())
+        connection.executemany("DELETE FROM dog_context WHERE dog_id = ?", [(dog_id,) for dog_id in removed])
+        # The next incremental build picks up every event written after this one started reading
+        connection.execute("INSERT OR REPLACE INTO build_state VALUES ('events_read_at', ?)", (started_at.isoformat(),))
+        connection.commit()
+    finally:
+        connection.close()
+    return written, len(removed)
+
+def write_packs_to_firestore(packs, signatures, built_at, removed=()):
+    """
+    Upsert one dogContext/<dogId> document per (dog ID, pack JSON) pair and delete
+    removed dogs' documents. eventsReadAt is stored as a timestamp, so the chat
+    flow can query the events written after it.
+    """
+    from connections import get_firestore_client
+    from mock_data_delete import delete_refs_bulk
+    from mock_data_to_firebase import write_documents_bulk
+
+    db = get_firestore_client()
+    collection_ref = db.collection(CONTEXT_COLLECTION)
+
+    def documents():
+        for dog_id, pack in packs:
+            data = json.loads(pack)
+            data.update(dogId=db.document(f"dogs/{dog_id}"), signature=signatures[dog_id], builtAt=built_at,
+                        eventsReadAt=datetime.fromisoformat(data["eventsReadAt"]))
+            yield collection_ref.document(dog_id), data
+
+    written = write_documents_bulk(documents(), record_created=False)
+    deleted = delete_refs_bulk(collection_ref.document(dog_id) for dog_id in removed) if removed else 0
+    return written, deleted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute per-dog RAG context packs from the dogs and events collections.")
+    parser.add_argument("--incremental", action="store_true", help="Only rebuild packs of dogs changed or with new events since the last build")
+    parser.add_argument("--events-per-type", type=int, default=DEFAULT_EVENTS_PER_TYPE, help="Most recent events kept per prompt section")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--firestore", action="store_true", help=f"Also write the packs to the {CONTEXT_COLLECTION} collection")
+    args = parser.parse_args()
+
+    try:
+        written, removed = build_context_packs(args.incremental, args.events_per_type, args.workers, args.firestore)
+        print(f"Wrote {written} packs to {CONTEXT_FILE}, removed {removed}")
+    except Exception as e:
+        print(f"Error building context packs: {e}")
+    write_run_report("context_packs")
@@ -1,11 +1,7 @@
 import os
-from google.cloud import storage
-from firebase_admin import credentials, initialize_app
-
-# Firebase/GCS initialization
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-initialize_app(cred)
-storage_client = storage.Client()
+from gcs_upload import publish_content_manifest, upload_files
+from metrics import span, write_run_report
+from output_files import resolve_output
 
 # Bucket and folder configuration
 BUCKET_NAME = "firestore-batch-boi"
@@ -17,26 +13,36 @@ FILES_TO_UPLOAD = ["users.csv", "dogs.csv", "exerciseEvents.csv", "healthEvents.
 
 def upload_to_gcs():
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-
+        uploads = []
         for file_name in FILES_TO_UPLOAD:
-            local_file_path = os.path.join(LOCAL_FOLDER, file_name)
+            # The plain CSV, or its compressed content-addressed version
+            local_file_path = resolve_output(os.path.join(LOCAL_FOLDER, file_name))
 
-            if not os.path.exists(local_file_path):
-                print(f"File not found: {local_file_path}. Skipping...")
+            if local_file_path is None:
+                print(f"File not found: {os.path.join(LOCAL_FOLDER, file_name)}. Skipping...")
                 continue
 
             # Construct GCS file path
-            blob_path = f"{FOLDER_NAME}/{file_name}"
-
-            # Upload file
-            blob = bucket.blob(blob_path)
-            blob.upload_from_filename(local_file_path)
-
-            print(f"Uploaded {file_name} to gs://{BUCKET_NAME}/{blob_path}")
+            uploads.append((local_file_path, BUCKET_NAME, f"{FOLDER_NAME}/{os.path.basename(local_file_path)}"))
+
+        # Upload files concurrently, skipping those already up to date
+        skipped = []
+        failed = upload_files(uploads, skipped=skipped)
+        for local_file_path, _, blob_path in uploads:
+            if local_file_path in skipped:
+                print(f"gs://{BUCKET_NAME}/{blob_path} is up to date, not uploading {os.path.basename(local_file_path)}")
+            elif local_file_path not in failed:
+                print(f"Uploaded {os.path.basename(local_file_path)} to gs://{BUCKET_NAME}/{blob_path}")
+
+        # Compressed CSVs: the manifest naming the current files, then removal of the ones they replace
+        deleted = publish_content_manifest(LOCAL_FOLDER, [upload for upload in uploads if upload[0] not in failed])
+        if deleted:
+            print(f"Deleted {deleted} superseded files from gs://{BUCKET_NAME}/{FOLDER_NAME}")
 
     except Exception as e:
         print(f"Error uploading files to GCS: {e}")
 
 if __name__ == "__main__":
-    upload_to_gcs()
+    with span("upload"):
+        upload_to_gcs()
+    write_run_report("csv_to_gcs_bucket")
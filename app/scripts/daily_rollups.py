@@ -0,0 +1,242 @@
+import argparse
+import os
+from itertools import islice
+import numpy as np
+import pandas as pd
+from incremental_export import compact_jsonl, pending_deltas
+from jsonl_to_csv_to_gcs import EVENT_JSONL_FILES, iter_jsonl
+from output_files import resolve_output
+
+# Compact per-dog per-day summary table
+SUMMARY_FILE = "app/scripts/outputs/dog_daily_stats.csv"
+# Optional Firestore copy, one document per dog and day
+ROLLUP_COLLECTION = "dogDailyStats"
+
+# Events turned into a DataFrame and aggregated at a time
+CHUNK_SIZE = 100_000
+# Partial aggregates kept per event type before they are merged
+MAX_PARTIALS = 32
+
+KEYS = ["dog_id", "date"]
+
+# (field, aggregation) pairs rolled up per event type; every type also gets a count
+ROLLUP_METRICS = {
+    "exercise": [("distance", "sum"), ("duration", "sum")],
+    "diet": [("quantity", "sum")],
+    "behavior": [("severity", "max")],
+    "health": [("severity", "max")],
+}
+
+ROLLUP_COLUMNS = [
+    column
+    for event_type, metrics in ROLLUP_METRICS.items()
+    for column in [f"{event_type}_{field}_{how}" for field, how in metrics] + [f"{event_type}_count"]
+]
+
+# Summary table column -> dogDailyStats field
+FIRESTORE_FIELDS = {
+    "exercise_distance_sum": "exerciseDistance",
+    "exercise_duration_sum": "exerciseDuration",
+    "exercise_count": "exerciseCount",
+    "diet_quantity_sum": "dietQuantity",
+    "diet_count": "dietCount",
+    "behavior_severity_max": "behaviorSeverityMax",
+    "behavior_count": "behaviorCount",
+    "health_severity_max": "healthSeverityMax",
+    "health_count": "healthCount",
+}
+
+def bare_id(value):
+    return value.split("/")[-1] if isinstance(value, str) else None
+
+def event_frame(event_type, events):
+    """
+    (dog_id, date, metric...) frame for a list of exported event dicts.
+
+    The day is taken from eventDate, falling back to createdAt, in UTC.
+    """
+    fields = [field for field, _ in ROLLUP_METRICS[event_type]]
+    frame = pd.DataFrame.from_records(events, columns=["dogId", "eventDate", "createdAt", *fields])
+    timestamps = pd.to_datetime(frame["eventDate"].fillna(frame["createdAt"]), utc=True, errors="coerce", format="ISO8601")
+    result = pd.DataFrame({
+        "dog_id": frame["dogId"].astype("string").str.split("/").str[-1],
+        "date": timestamps.dt.strftime("%Y-%m-%d"),
+    })
+    for field in fields:
+        result[field] = pd.to_numeric(frame[field], errors="coerce")
+    return result.dropna(subset=KEYS)
+
+def aggregate(event_type, frame):
+    """Group an event frame by dog and day into the event type's rollup columns."""
+    named = {f"{event_type}_{field}_{how}": (field, how) for field, how in ROLLUP_METRICS[event_type]}
+    named[f"{event_type}_count"] = ("dog_id", "size")
+    return frame.groupby(KEYS, sort=False, observed=True).agg(**named)
+
+def merge_partials(partials):
+    """Combine partial aggregates of one event type: sums and counts add up, maxima take the max."""
+    combined = pd.concat(partials)
+    how = {column: "max" if column.endswith("_max") else "sum" for column in combined.columns}
+    return combined.groupby(level=KEYS, sort=False, observed=True).agg(how)
+
+class RollupAccumulator:
+    """
+    Aggregates chunks of events as they arrive, keeping only per-chunk partial
+    aggregates in memory. If dog_ids is given, other dogs' events are ignored.
+
+    With a dog IdIndex, dog IDs are grouped as categorical codes (the dense
+    index keys) instead of strings; events of dogs missing from it are skipped.
+    """
+
+    def __init__(self, dog_ids=None, dog_index=None):
+        self.dog_ids = dog_ids
+        self.dog_index = dog_index
+        self.dog_dtype = pd.CategoricalDtype(dog_index.id_strings()) if dog_index is not None else None
+        self.partials = {event_type: [] for event_type in ROLLUP_METRICS}
+
+    def add(self, event_type, events):
+        if not events:
+            return
+        frame = event_frame(event_type, events)
+        if self.dog_ids is not None:
+            frame = frame[frame["dog_id"].isin(self.dog_ids)]
+        if self.dog_index is not None:
+            codes = self.dog_index.lookup(frame["dog_id"].to_numpy(dtype=str))
+            frame = frame.assign(dog_id=pd.Categorical.from_codes(codes, dtype=self.dog_dtype)).dropna(subset=["dog_id"])
+        partials = self.partials[event_type]
+        partials.append(aggregate(event_type, frame))
+        if len(partials) >= MAX_PARTIALS:
+            self.partials[event_type] = [merge_partials(partials)]
+
+    def result(self):
+        """The rollup table, one row per dog and day, sorted by dog and day."""
+        tables = [merge_partials(partials) for partials in self.partials.values() if partials]
+        if not tables:
+            return pd.DataFrame(columns=KEYS + ROLLUP_COLUMNS)
+        table = pd.concat(tables, axis=1).reindex(columns=ROLLUP_COLUMNS)
+        for column in ROLLUP_COLUMNS:
+            if not column.endswith("_max"):
+                table[column] = table[column].fillna(0)
+            if column.endswith("_count"):
+                table[column] = table[column].astype(np.int64)
+        table.index.names = KEYS
+        table = table.reset_index()
+        if self.dog_index is not None:
+            table["dog_id"] = table["dog_id"].astype(str)
+        return table.sort_values(KEYS, ignore_index=True)
+
+def compute_rollups(dog_ids=None, event_files=EVENT_JSONL_FILES, dog_index=None):
+    """Stream the exported event JSONL files in chunks and roll them up."""
+    accumulator = RollupAccumulator(dog_ids, dog_index)
+    for event_type, path in event_files.items():
+        if resolve_output(path) is None:
+            print(f"File not found: {path}. Skipping...")
+            continue
+        events = iter_jsonl(path)
+        while chunk := list(islice(events, CHUNK_SIZE)):
+            accumulator.add(event_type, chunk)
+    return accumulator.result()
+
+def read_summary(path=SUMMARY_FILE):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=KEYS + ROLLUP_COLUMNS)
+    return pd.read_csv(path, dtype={"dog_id": str, "date": str})
+
+def write_summary(table, path=SUMMARY_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def affected_dogs(event_files=EVENT_JSONL_FILES):
+    """
+    Dogs whose rollups pending JSONL deltas change: the dogs of the changed
+    events, before and after the change.
+    """
+    dogs = set()
+    for event_type, path in event_files.items():
+        changed = set()
+        for delta in pending_deltas(f"{event_type}Events", "jsonl"):
+            for event in iter_jsonl(delta):
+                changed.add(event["id"])
+                dogs.add(bare_id(event.get("dogId")))
+        if changed and os.path.exists(path):
+            for event in iter_jsonl(path):
+                if event["id"] in changed:
+                    dogs.add(bare_id(event.get("dogId")))
+    dogs.discard(None)
+    return dogs
+
+def update_rollups_incremental(event_files=EVENT_JSONL_FILES, summary_path=SUMMARY_FILE):
+    """
+    Fold pending JSONL deltas (from export_firestore_to_jsonl --incremental)
+    into the summary table.
+
+    The deltas are compacted into the event snapshots and only the affected
+    dogs are re-aggregated. Returns (recomputed rows, (dog_id, date) keys that
+    no longer have any events).
+    """
+    dogs = affected_dogs(event_files)
+    for event_type, path in event_files.items():
+        compact_jsonl(path, f"{event_type}Events")
+    if not dogs:
+        return pd.DataFrame(columns=KEYS + ROLLUP_COLUMNS), []
+
+    recomputed = compute_rollups(dogs, event_files)
+    summary = read_summary(summary_path)
+    previous = summary[summary["dog_id"].isin(dogs)]
+    kept_keys = set(zip(recomputed["dog_id"], recomputed["date"]))
+    removed = [key for key in zip(previous["dog_id"], previous["date"]) if key not in kept_keys]
+
+    summary = pd.concat([summary[~summary["dog_id"].isin(dogs)], recomputed], ignore_index=True)
+    write_summary(summary.sort_values(KEYS, ignore_index=True), summary_path)
+    return recomputed, removed
+
+def to_firestore_value(value):
+    """numpy scalars to Python values, NaN to null."""
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+def write_rollups_to_firestore(table, removed=()):
+    """Upsert one dogDailyStats document per row (ID "<dogId>_<date>") and delete removed days."""
+    from connections import get_firestore_client
+    from mock_data_delete import delete_refs_bulk
+    from mock_data_to_firebase import write_documents_bulk
+
+    db = get_firestore_client()
+    collection_ref = db.collection(ROLLUP_COLLECTION)
+
+    def documents():
+        for row in table.to_dict("records"):
+            data = {"dogId": db.document(f"dogs/{row['dog_id']}"), "date": row["date"]}
+            data.update((field, to_firestore_value(row[column])) for column, field in FIRESTORE_FIELDS.items())
+            yield collection_ref.document(f"{row['dog_id']}_{row['date']}"), data
+
+    written = write_documents_bulk(documents(), record_created=False)
+    deleted = delete_refs_bulk(collection_ref.document(f"{dog_id}_{date}") for dog_id, date in removed) if removed else 0
+    return written, deleted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll exported events up into per-dog daily stats.")
+    parser.add_argument("--incremental", action="store_true", help="Fold pending JSONL deltas into the existing summary")
+    parser.add_argument("--id-index", action="store_true", help="Group dogs by their dense ID-index keys")
+    parser.add_argument("--firestore", action="store_true", help=f"Also write the rows to the {ROLLUP_COLLECTION} collection")
+    args = parser.parse_args()
+
+    removed = []
+    if args.incremental:
+        table, removed = update_rollups_incremental()
+        print(f"Recomputed {len(table)} daily rows, {len(removed)} days removed")
+    else:
+        dog_index = None
+        if args.id_index:
+            from id_index import build_id_indexes, load_id_indexes
+
+            dog_index = (load_id_indexes(["dogs"]) or build_id_indexes(["dogs"]))["dogs"]
+        table = compute_rollups(dog_index=dog_index)
+        write_summary(table)
+        print(f"Wrote {len(table)} daily rows to {SUMMARY_FILE}")
+
+    if args.firestore:
+        written, deleted = write_rollups_to_firestore(table, removed)
+        print(f"Wrote {written} and deleted {deleted} {ROLLUP_COLLECTION} documents")
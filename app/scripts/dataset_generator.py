@@ -0,0 +1,289 @@
+import argparse
+import csv
+import json
+import os
+import random
+import string
+from datetime import datetime, timedelta
+from constants import ACTIVITY_TYPES, SOURCES, FOOD_TYPES, BREEDS, ZIP_CODES, NAMES, DOG_NAMES, BEHAVIOR_TYPES, BEHAVIOR_NOTES, DIET_BRANDS, HEALTH_EVENT_TYPES, HEALTH_NOTES
+
+# Directory to save generated fixtures
+OUTPUT_DIRECTORY = "app/scripts/outputs/generated"
+
+# Fixed reference date so repeated runs produce identical timestamps
+DEFAULT_BASE_DATE = "2025-01-01T00:00:00"
+
+EVENT_TYPES = ["behavior", "diet", "exercise", "health"]
+ID_ALPHABET = string.ascii_letters + string.digits
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+# Fields holding "collection/id" reference paths, converted to DocumentReferences for Firestore
+REFERENCE_FIELDS = {"users", "dogList", "dogId", "userId", "behaviorEventIds", "dietEventIds", "exerciseEventIds", "healthEventIds"}
+
+CSV_FIELDS = {
+    "users": ["id", "full_name", "email", "address.zip", "dogList", "createdAt", "updatedAt"],
+    "dogs": ["id", "name", "age", "breed", "sex", "weight", "birthday", "users",
+             "behaviorEventIds", "dietEventIds", "exerciseEventIds", "healthEventIds", "createdAt", "updatedAt"],
+    "behaviorEvents": ["id", "type", "userId", "dogId", "behaviorType", "severity", "notes", "createdAt", "updatedAt"],
+    "dietEvents": ["id", "type", "userId", "dogId", "brandName", "foodType", "quantity", "createdAt", "updatedAt"],
+    "exerciseEvents": ["id", "type", "userId", "dogId", "activityType", "source", "distance", "duration", "createdAt", "updatedAt"],
+    "healthEvents": ["id", "type", "userId", "dogId", "eventType", "severity", "notes", "createdAt", "updatedAt"],
+}
+
+def generate_id(rng):
+    """Generate a 20-character Firestore-style document ID from the given RNG."""
+    return "".join(rng.choices(ID_ALPHABET, k=20))
+
+def generate_event(rng, event_type, dog_path, user_path, base_date):
+    created_at = base_date - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86399))
+    updated_at = created_at + timedelta(days=rng.randint(0, 10))
+
+    event = {
+        "type": event_type,
+        "userId": user_path,
+        "dogId": dog_path,
+        "createdAt": created_at,
+        "updatedAt": updated_at
+    }
+
+    if event_type == "behavior":
+        event.update({
+            "behaviorType": rng.choice(BEHAVIOR_TYPES),
+            "severity": rng.randint(1, 10),
+            "notes": rng.choice(BEHAVIOR_NOTES)
+        })
+    elif event_type == "diet":
+        event.update({
+            "brandName": rng.choice(DIET_BRANDS),
+            "foodType": rng.choice(FOOD_TYPES),
+            "quantity": rng.randint(100, 500)
+        })
+    elif event_type == "exercise":
+        event.update({
+            "activityType": rng.choice(ACTIVITY_TYPES),
+            "source": rng.choice(SOURCES),
+            "distance": round(rng.uniform(0.5, 5.0), 2),
+            "duration": rng.randint(10, 120)
+        })
+    elif event_type == "health":
+        event.update({
+            "eventType": rng.choice(HEALTH_EVENT_TYPES),
+            "severity": rng.randint(1, 10),
+            "notes": rng.choice(HEALTH_NOTES)
+        })
+
+    return event
+
+def generate_records(num_users=10, min_dogs=1, max_dogs=3, events_per_dog=30, seed=0, base_date=DEFAULT_BASE_DATE):
+    """
+    Stream (collection, doc_id, data) records for a synthetic dataset.
+
+    Each user gets its own RNG derived from the seed and the user's index, so
+    the output is identical across runs and only one user's dogs and events are
+    held in memory at a time. Events are yielded before their dog and dogs
+    before their user, so every *EventIds array and dogList is complete when
+    its parent document is emitted.
+    """
+    base_date = datetime.fromisoformat(base_date)
+
+    for user_index in range(num_users):
+        rng = random.Random(f"{seed}:{user_index}")
+        user_path = f"users/{generate_id(rng)}"
+        real_name = rng.choice(NAMES)
+        updated_at = base_date - timedelta(days=rng.randint(0, 365))
+        created_at = updated_at - timedelta(days=rng.randint(1, 10))
+        user = {
+            "full_name": f"T-{real_name}",
+            "email": f"t-{real_name.lower()}{user_index}@example.com",
+            "address": {
+                "zip": rng.choice(ZIP_CODES)
+            },
+            "dogList": [],
+            "createdAt": created_at.isoformat(),
+            "updatedAt": updated_at.isoformat()
+        }
+
+        for _ in range(rng.randint(min_dogs, max_dogs)):
+            dog_path = f"dogs/{generate_id(rng)}"
+            dog_created_at = base_date - timedelta(days=rng.randint(0, 365))
+            dog = {
+                "users": [user_path],
+                "name": rng.choice(DOG_NAMES),
+                "age": rng.randint(1, 10),
+                "breed": rng.choice(BREEDS),
+                "sex": rng.choice(["Male", "Female"]),
+                "weight": f"{rng.randint(10, 40)} lbs",
+                "birthday": (base_date - timedelta(days=rng.randint(365, 3650))).isoformat(),
+                "createdAt": dog_created_at.isoformat(),
+                "updatedAt": dog_created_at.isoformat(),
+                "behaviorEventIds": [],
+                "dietEventIds": [],
+                "exerciseEventIds": [],
+                "healthEventIds": []
+            }
+
+            for _ in range(events_per_dog):
+                event_type = rng.choice(EVENT_TYPES)
+                event_id = generate_id(rng)
+                dog[f"{event_type}EventIds"].append(f"{event_type}Events/{event_id}")
+                yield f"{event_type}Events", event_id, generate_event(rng, event_type, dog_path, user_path, base_date)
+
+            user["dogList"].append(dog_path)
+            yield "dogs", dog_path.split("/")[-1], dog
+
+        yield "users", user_path.split("/")[-1], user
+
+def to_plain_value(value):
+    """Convert generated values to JSON/CSV-friendly types."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+class JsonlSink:
+    """Writes one JSONL file per collection."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.files = {}
+
+    def write(self, collection, doc_id, data):
+        if collection not in self.files:
+            self.files[collection] = open(os.path.join(self.output_dir, f"{collection}.jsonl"), "w")
+        record = {**data, "id": doc_id}
+        self.files[collection].write(json.dumps(record, default=to_plain_value) + "\n")
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+class CsvSink:
+    """Writes one CSV file per collection using the columns in CSV_FIELDS."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.files = {}
+        self.writers = {}
+
+    def write(self, collection, doc_id, data):
+        if collection not in self.writers:
+            file = open(os.path.join(self.output_dir, f"{collection}.csv"), "w", newline="")
+            self.files[collection] = file
+            self.writers[collection] = csv.writer(file)
+            self.writers[collection].writerow(CSV_FIELDS[collection])
+
+        record = {**data, "id": doc_id}
+        row = []
+        for field in CSV_FIELDS[collection]:
+            value = record
+            for part in field.split("."):
+                value = value.get(part, "") if isinstance(value, dict) else ""
+            if isinstance(value, list):
+                value = ",".join(value)
+            row.append(to_plain_value(value))
+        self.writers[collection].writerow(row)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+class ParquetSink:
+    """Writes one Parquet file per collection, buffering rows into row groups."""
+
+    def __init__(self, output_dir, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        import pyarrow  # noqa: F401 - fail early if the optional dependency is missing
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.buffers = {}
+        self.writers = {}
+
+    def write(self, collection, doc_id, data):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append({**data, "id": doc_id})
+        if len(buffer) >= self.row_group_size:
+            self.flush(collection)
+
+    def flush(self, collection):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.buffers.get(collection)
+        if not rows:
+            return
+        writer = self.writers.get(collection)
+        if writer is None:
+            table = pa.Table.from_pylist(rows)
+            writer = pq.ParquetWriter(os.path.join(self.output_dir, f"{collection}.parquet"), table.schema)
+            self.writers[collection] = writer
+        else:
+            table = pa.Table.from_pylist(rows, schema=writer.schema)
+        writer.write_table(table)
+        self.buffers[collection] = []
+
+    def close(self):
+        for collection in list(self.buffers):
+            self.flush(collection)
+        for writer in self.writers.values():
+            writer.close()
+
+SINKS = {
+    "jsonl": JsonlSink,
+    "csv": CsvSink,
+    "parquet": ParquetSink,
+}
+
+def write_to_files(records, output_format, output_dir=OUTPUT_DIRECTORY):
+    """Stream records into per-collection files. Returns the number of records written."""
+    os.makedirs(output_dir, exist_ok=True)
+    sink = SINKS[output_format](output_dir)
+    count = 0
+    try:
+        for collection, doc_id, data in records:
+            sink.write(collection, doc_id, data)
+            count += 1
+    finally:
+        sink.close()
+    return count
+
+def write_to_firestore(records):
+    """Stream records into Firestore through the bulk seeder's batched writer."""
+    # Imported lazily so offline fixture generation never needs the Firestore libraries
+    from connections import get_firestore_client
+    from mock_data_to_firebase import write_documents_bulk, write_created_items
+
+    db = get_firestore_client()
+
+    def to_firestore_value(field, value):
+        if field in REFERENCE_FIELDS:
+            if isinstance(value, list):
+                return [db.document(path) for path in value]
+            return db.document(value)
+        return value
+
+    def documents():
+        for collection, doc_id, data in records:
+            data = {field: to_firestore_value(field, value) for field, value in data.items()}
+            yield db.collection(collection).document(doc_id), data
+
+    try:
+        return write_documents_bulk(documents())
+    finally:
+        write_created_items()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a reproducible synthetic users/dogs/events dataset.")
+    parser.add_argument("--users", type=int, default=10, help="Number of users to generate")
+    parser.add_argument("--min-dogs", type=int, default=1, help="Minimum dogs per user")
+    parser.add_argument("--max-dogs", type=int, default=3, help="Maximum dogs per user")
+    parser.add_argument("--events-per-dog", type=int, default=30, help="Events generated for each dog")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the deterministic generator")
+    parser.add_argument("--base-date", default=DEFAULT_BASE_DATE, help="ISO date all timestamps are generated relative to")
+    parser.add_argument("--format", choices=[*SINKS, "firestore"], default="jsonl", help="Output target")
+    parser.add_argument("--output-dir", default=OUTPUT_DIRECTORY, help="Directory for file outputs")
+    args = parser.parse_args()
+
+    records = generate_records(args.users, args.min_dogs, args.max_dogs, args.events_per_dog, args.seed, args.base_date)
+    if args.format == "firestore":
+        total = write_to_firestore(records)
+    else:
+        total = write_to_files(records, args.format, args.output_dir)
+    print(f"Generated {total} records ({args.format}).")
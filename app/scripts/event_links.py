@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import random
+import string
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import firestore
+from google.cloud.firestore import FieldFilter
+from connections import get_firestore_client
+from metrics import Progress, count, span, timed, write_run_report
+from mock_data_delete import INITIAL_BACKOFF_SECONDS, MAX_RETRIES, RETRYABLE_ERRORS
+from projections import EVENT_COLLECTIONS, event_id_field
+from serializers import EVENT_ID_FIELDS
+
+# How dog -> event links are stored:
+#   arrays         *EventIds reference arrays on the dog document (the original layout)
+#   indexed        only the events' own dogId, queried through its automatic single-field index
+#   subcollection  one dogs/{dogId}/eventLinks/{eventId} document per event
+LAYOUTS = ["arrays", "indexed", "subcollection"]
+LINK_SUBCOLLECTION = "eventLinks"
+
+# Checkpoints and migration reports
+MIGRATION_DIRECTORY = "app/scripts/outputs/migrations"
+
+# Migration passes: dogs are split into key ranges scanned in parallel, a page at a time
+DEFAULT_PARTITIONS = 8
+DOG_PAGE_SIZE = 300
+BATCH_SIZE = 500  # Firestore limit of operations per commit
+
+# Characters of auto-generated document IDs, in Firestore's key order
+ID_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+def link_reference(dog_ref, event_ref):
+    return dog_ref.collection(LINK_SUBCOLLECTION).document(event_ref.id)
+
+def link_data(event_ref, collection_name):
+    return {"event": event_ref, "collection": collection_name}
+
+def append_event(db, layout, dog_ref, event_type, event):
+    """Add a new event of a dog, linking it in the given layout. Returns its reference."""
+    collection_name = f"{event_type}Events"
+    event_ref = db.collection(collection_name).document()
+    if layout == "indexed":
+        event_ref.set(event)
+        return event_ref
+
+    batch = db.batch()
+    batch.set(event_ref, event)
+    if layout == "arrays":
+        batch.update(dog_ref, {event_id_field(collection_name): firestore.ArrayUnion([event_ref])})
+    else:
+        batch.set(link_reference(dog_ref, event_ref), link_data(event_ref, collection_name))
+    batch.commit()
+    return event_ref
+
+def count_documents(query):
+    """Server-side count of a query's results, billed per 1000 index entries rather than per document."""
+    with timed("rpc_seconds", rpc="count"):
+        result = query.count().get()
+    return int(result[0][0].value)
+
+def linked_counts(db, dog_ref, layout):
+    """Events linked to a dog in the indexed or subcollection layout, per event collection."""
+    if layout == "indexed":
+        return {collection_name: count_documents(db.collection(collection_name).where(filter=FieldFilter("dogId", "==", dog_ref)))
+                for collection_name in EVENT_COLLECTIONS}
+    links = dog_ref.collection(LINK_SUBCOLLECTION)
+    return {collection_name: count_documents(links.where(filter=FieldFilter("collection", "==", collection_name)))
+            for collection_name in EVENT_COLLECTIONS}
+
+def listed_events(db, dog):
+    """
+    The event references in a dog's *EventIds arrays, per event collection,
+    or None if the dog has no arrays left (it was already migrated).
+    """
+    data = dog.to_dict() or {}
+    if not any(field in data for field in EVENT_ID_FIELDS):
+        return None
+    return {collection_name: [db.document(value) if isinstance(value, str) else value
+                              for value in data.get(event_id_field(collection_name)) or []]
+            for collection_name in EVENT_COLLECTIONS}
+
+def reference_path(value):
+    return getattr(value, "path", value)
+
+def migrate_dog(db, dog, layout):
+    """
+    Write operations that link a dog's listed events in the new layout, and its link counts.
+
+    Subcollection links are copied one document per event. In the indexed
+    layout the events already carry dogId, so the listed events are only
+    read, and dogId set, for collections whose count does not match the array.
+    """
+    listed = listed_events(db, dog)
+    if listed is None:
+        return [], {"migrated": 1}
+    before = {collection_name: len(refs) for collection_name, refs in listed.items()}
+
+    if layout == "subcollection":
+        operations = [("set", link_reference(dog.reference, event_ref), link_data(event_ref, collection_name))
+                      for collection_name, refs in listed.items() for event_ref in refs]
+        return operations, {"before": before}
+
+    operations = []
+    counts = linked_counts(db, dog.reference, layout)
+    for collection_name, refs in listed.items():
+        if counts[collection_name] == len(refs):
+            continue
+        with timed("rpc_seconds", rpc="get_all"):
+            events = list(db.get_all(refs, field_paths=["dogId"]))
+        for event in events:
+            if not event.exists:
+                count("dangling_links", collection=collection_name)
+                continue
+            if reference_path((event.to_dict() or {}).get("dogId")) != dog.reference.path:
+                operations.append(("update", event.reference, {"dogId": dog.reference}))
+    return operations, {"before": before}
+
+def check_dog(db, dog, layout, drop_arrays=False):
+    """
+    Compare a dog's array lengths with its links in the new layout. With
+    drop_arrays, a dog whose counts match also gets its arrays deleted.
+    """
+    listed = listed_events(db, dog)
+    if listed is None:
+        return [], {"migrated": 1}
+    before = {collection_name: len(refs) for collection_name, refs in listed.items()}
+    after = linked_counts(db, dog.reference, layout)
+    if before != after:
+        return [], {"before": before, "after": after, "mismatched": [dog.id]}
+    operations = []
+    if drop_arrays:
+        operations.append(("update", dog.reference, {field: firestore.DELETE_FIELD for field in EVENT_ID_FIELDS}))
+    return operations, {"before": before, "after": after}
+
+def commit_operations(operations):
+    """Commit ("set" | "update", reference, data) operations in one batch, retrying transient errors."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            batch = get_firestore_client().batch()
+            for kind, doc_ref, data in operations:
+                getattr(batch, kind)(doc_ref, data)
+            with timed("rpc_seconds", rpc="batch_commit"):
+                batch.commit()
+            count("batches_committed")
+            for collection_name, written in Counter(doc_ref.parent.id for _, doc_ref, _ in operations).items():
+                count("docs_written", written, collection=collection_name)
+            return
+        except RETRYABLE_ERRORS as e:
+            count("batch_retries")
+            if attempt == MAX_RETRIES:
+                raise
+            backoff = INITIAL_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+            print(f"Batch commit failed ({e}), retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+
+def key_ranges(partitions):
+    """Split dog IDs into contiguous (start, end) ranges by first character; None is unbounded."""
+    bounds = [ID_ALPHABET[len(ID_ALPHABET) * index // partitions] for index in range(1, partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+def iter_dogs(db, key_range, after=None):
+    """Dogs in a key range after the given ID, in key order, with only their *EventIds fields."""
+    dogs = db.collection("dogs")
+    start, end = key_range
+    while True:
+        query = dogs.select(EVENT_ID_FIELDS)
+        if after:
+            query = query.where(filter=FieldFilter("__name__", ">", dogs.document(after)))
+        elif start:
+            query = query.where(filter=FieldFilter("__name__", ">=", dogs.document(start)))
+        if end:
+            query = query.where(filter=FieldFilter("__name__", "<", dogs.document(end)))
+        with timed("rpc_seconds", rpc="query"):
+            page = list(query.limit(DOG_PAGE_SIZE).stream())
+        yield from page
+        if len(page) < DOG_PAGE_SIZE:
+            return
+        after = page[-1].id
+
+def new_entry():
+    return {"after": None, "complete": False, "dogs": 0, "writes": 0, "migrated": 0,
+            "before": {}, "after_counts": {}, "mismatched": []}
+
+def load_checkpoint(checkpoint_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, "r") as file:
+        return json.load(file)
+
+def save_checkpoint(checkpoint_path, state):
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, checkpoint_path)
+
+def add_counts(totals, counts):
+    for collection_name, value in counts.items():
+        totals[collection_name] = totals.get(collection_name, 0) + value
+
+def run_pass(db, label, handle_dog, partitions, checkpoint_path=None):
+    """
+    Scan the dogs in `partitions` key ranges at once, committing the operations
+    handle_dog(dog) returns in 500-op batches, and return the summed results.
+
+    Each partition records the last dog whose operations have all committed,
+    so with checkpoint_path an interrupted pass resumes from there.
+    """
+    state = load_checkpoint(checkpoint_path)
+    if state:
+        print(f"Resuming {label} pass from {checkpoint_path}")
+    lock = threading.Lock()
+    progress = Progress(f"dogs {label}")
+
+    def run_partition(index, key_range):
+        with lock:
+            entry = state.setdefault(str(index), new_entry())
+        if entry["complete"]:
+            return
+        operations = []
+        results = []
+
+        def flush(last_id, complete=False):
+            for start in range(0, len(operations), BATCH_SIZE):
+                commit_operations(operations[start:start + BATCH_SIZE])
+            with lock:
+                entry["after"] = last_id
+                entry["complete"] = complete
+                entry["dogs"] += len(results)
+                entry["writes"] += len(operations)
+                for result in results:
+                    entry["migrated"] += result.get("migrated", 0)
+                    add_counts(entry["before"], result.get("before", {}))
+                    add_counts(entry["after_counts"], result.get("after", {}))
+                    entry["mismatched"].extend(result.get("mismatched", []))
+                progress.update(len(results))
+                if checkpoint_path:
+                    save_checkpoint(checkpoint_path, state)
+            operations.clear()
+            results.clear()
+
+        last_id = entry["after"]
+        for dog in iter_dogs(db, key_range, last_id):
+            dog_operations, result = handle_dog(dog)
+            operations.extend(dog_operations)
+            results.append(result)
+            last_id = dog.id
+            if len(operations) >= BATCH_SIZE or len(results) >= DOG_PAGE_SIZE:
+                flush(last_id)
+        flush(last_id, complete=True)
+
+    with ThreadPoolExecutor(max_workers=partitions) as executor:
+        futures = [executor.submit(run_partition, index, key_range) for index, key_range in enumerate(key_ranges(partitions))]
+        for future in futures:
+            future.result()
+    progress.finish()
+
+    totals = new_entry()
+    for entry in state.values():
+        for key in ["dogs", "writes", "migrated"]:
+            totals[key] += entry[key]
+        add_counts(totals["before"], entry["before"])
+        add_counts(totals["after_counts"], entry["after_counts"])
+        totals["mismatched"].extend(entry["mismatched"])
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return totals
+
+def checkpoint_file(layout, pass_name):
+    return os.path.join(MIGRATION_DIRECTORY, f"event_links-{layout}-{pass_name}.checkpoint.json")
+
+def migrate_event_links(layout, partitions=DEFAULT_PARTITIONS, drop_arrays=False, verify_only=False):
+    """
+    Move the dogs' event links from the *EventIds arrays to the indexed or subcollection layout.
+
+    Runs a copy pass, then a verify pass comparing each dog's array lengths
+    with its links in the new layout. With drop_arrays the verify pass also
+    deletes the arrays of every dog whose counts match; mismatched dogs keep
+    theirs. Both passes are resumable. Returns the report, also written to
+    outputs/migrations/event_links-<layout>.json.
+    """
+    db = get_firestore_client()
+    if not verify_only:
+        with span("migrate", layout=layout):
+            copied = run_pass(db, "migrated", lambda dog: migrate_dog(db, dog, layout), partitions,
+                              checkpoint_file(layout, "migrate"))
+        print(f"Copy pass: {copied['dogs']} dogs, {copied['writes']} writes, {copied['migrated']} already without arrays")
+
+    with span("verify", layout=layout):
+        checked = run_pass(db, "dropped" if drop_arrays else "verified",
+                           lambda dog: check_dog(db, dog, layout, drop_arrays), partitions,
+                           checkpoint_file(layout, "drop") if drop_arrays else None)
+
+    report = {
+        "layout": layout,
+        "dogs": checked["dogs"],
+        "dogsWithoutArrays": checked["migrated"],
+        "linksBefore": checked["before"],
+        "linksAfter": checked["after_counts"],
+        "mismatchedDogs": sorted(checked["mismatched"]),
+        "arraysDropped": checked["writes"] if drop_arrays else 0,
+    }
+    os.makedirs(MIGRATION_DIRECTORY, exist_ok=True)
+    report_path = os.path.join(MIGRATION_DIRECTORY, f"event_links-{layout}.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Links before: {sum(report['linksBefore'].values())}, after: {sum(report['linksAfter'].values())}")
+    if report["mismatchedDogs"]:
+        print(f"{len(report['mismatchedDogs'])} dogs have mismatched counts and kept their arrays; see {report_path}")
+    elif drop_arrays:
+        print(f"Dropped the *EventIds arrays of {report['arraysDropped']} dogs")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate dog -> event links off the dogs' *EventIds arrays.")
+    parser.add_argument("--layout", choices=LAYOUTS[1:], default="indexed", help="Layout to migrate the links to")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="Key ranges of dogs processed in parallel")
+    parser.add_argument("--drop-arrays", action="store_true", help="Delete the arrays of dogs whose counts verify")
+    parser.add_argument("--verify-only", action="store_true", help="Skip the copy pass and only compare counts")
+    args = parser.parse_args()
+
+    try:
+        migrate_event_links(args.layout, args.partitions, args.drop_arrays, args.verify_only)
+    except Exception as e:
+        print(f"Migration failed: {e}")
+    write_run_report("event_links")
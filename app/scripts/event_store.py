@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import shutil
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from jsonl_to_csv_to_gcs import EVENT_JSONL_FILES, OUTPUT_PARQUET_DIRECTORY
+from metrics import count
+from output_files import open_input, resolve_output
+
+# Events sorted by (dog_id, event_date), split into part files, plus index.json with their zone maps
+STORE_DIRECTORY = "app/scripts/outputs/event_store"
+INDEX_NAME = "index.json"
+
+# Rows per row group, the unit a query reads; a dog's events usually fit in one or two
+STORE_ROW_GROUP_SIZE = 4096
+# Rows per part file
+STORE_FILE_ROWS = 1_000_000
+# Exported lines parsed into a column batch at a time
+BUILD_CHUNK_SIZE = 100_000
+# Events sorted in memory at a time into a temporary run file; bounds the build's memory
+BUILD_RUN_ROWS = 1_000_000
+# Fewest rows read from each run at a time while merging them
+MIN_MERGE_BATCH_ROWS = 1024
+# Subdirectory of the store holding the sorted runs during a build
+RUN_DIRECTORY = "runs"
+
+# Dogs whose events EventStore.query keeps in memory
+DEFAULT_CACHE_SIZE = 1024
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+STORE_SCHEMA = pa.schema([
+    ("dog_id", pa.string()),
+    ("event_date", TIMESTAMP),
+    ("type", pa.string()),
+    ("event_id", pa.string()),
+    ("user_id", pa.string()),
+    ("created_at", TIMESTAMP),
+    ("updated_at", TIMESTAMP),
+    # The whole event as exported, as JSON
+    ("data", pa.string()),
+])
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MIN_MICROS = -2 ** 63
+MAX_MICROS = 2 ** 63 - 1
+
+def to_micros(value):
+    """A datetime or ISO 8601 string as microseconds since the epoch (naive times are UTC); None stays None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def bare_id(value):
+    return value.split("/")[-1] if isinstance(value, str) else None
+
+def event_files(file_path):
+    """
+    The files holding an exported collection: its plain or compressed JSONL,
+    or else the shards listed in the <collection>.manifest.json of a parallel export.
+    """
+    if resolve_output(file_path) is not None:
+        return [file_path]
+    directory = os.path.dirname(file_path)
+    manifest_path = os.path.join(directory, f"{os.path.basename(file_path)[:-len('.jsonl')]}.manifest.json")
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path, "r") as file:
+        return [os.path.join(directory, shard["file"]) for shard in json.load(file)["shards"]]
+
+def jsonl_batch(event_type, lines):
+    """A STORE_SCHEMA table of exported JSONL lines; event_date is eventDate, else dateTime, else createdAt."""
+    events = [json.loads(line) for line in lines]
+    frame = pd.DataFrame.from_records(events, columns=["id", "dogId", "userId", "type", "eventDate", "dateTime", "createdAt", "updatedAt"])
+    created_at = pd.to_datetime(frame["createdAt"], utc=True, errors="coerce", format="ISO8601")
+    event_date = pd.to_datetime(frame["eventDate"].fillna(frame["dateTime"]), utc=True, errors="coerce", format="ISO8601")
+    return pa.table({
+        "dog_id": [bare_id(value) for value in frame["dogId"]],
+        "event_date": pa.array(event_date.fillna(created_at), type=TIMESTAMP),
+        "type": frame["type"].fillna(event_type).astype(str).tolist(),
+        "event_id": frame["id"].astype(str).tolist(),
+        "user_id": [bare_id(value) for value in frame["userId"]],
+        "created_at": pa.array(created_at, type=TIMESTAMP),
+        "updated_at": pa.array(pd.to_datetime(frame["updatedAt"], utc=True, errors="coerce", format="ISO8601"), type=TIMESTAMP),
+        "data": [line.rstrip("\n") for line in lines],
+    }, schema=STORE_SCHEMA)
+
+def read_jsonl_events():
+    """Every exported event as STORE_SCHEMA tables of up to BUILD_CHUNK_SIZE rows."""
+    for event_type, file_path in EVENT_JSONL_FILES.items():
+        for path in event_files(file_path):
+            with open_input(path) as file:
+                while lines := list(islice(file, BUILD_CHUNK_SIZE)):
+                    yield jsonl_batch(event_type, lines)
+
+def read_parquet_events(directory=OUTPUT_PARQUET_DIRECTORY):
+    """The joined events of jsonl_to_csv_to_gcs --parquet as STORE_SCHEMA tables, one per partition file."""
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(directory, format="parquet", partitioning="hive")
+    for fragment in dataset.get_fragments():
+        table = fragment.to_table(schema=dataset.schema)
+        details = table.drop_columns(["event_month"])
+        yield pa.table({
+            "dog_id": table["dog_id"],
+            "event_date": pc.coalesce(table["event_timestamp"], table["created_at"]),
+            "type": table["event_type"].cast(pa.string()),
+            "event_id": table["event_id"],
+            "user_id": table["user_id"],
+            "created_at": table["created_at"],
+            "updated_at": table["updated_at"],
+            "data": [json.dumps({field: value for field, value in row.items() if value is not None}, default=isoformat)
+                     for row in details.to_pylist()],
+        }, schema=STORE_SCHEMA)
+
+def zone_map(table):
+    """Smallest and largest (dog_id, event_date) key and the event types of a sorted slice."""
+    dates = table["event_date"].cast(pa.int64())
+    return {
+        "rows": table.num_rows,
+        "min": [table["dog_id"][0].as_py(), dates[0].as_py()],
+        "max": [table["dog_id"][-1].as_py(), dates[-1].as_py()],
+        "types": sorted(pc.unique(table["type"]).to_pylist()),
+    }
+
+def sort_events(table):
+    """Events with a dogId, sorted by (dog_id, event_date); those without any timestamp sort first within their dog."""
+    table = table.filter(pc.is_valid(table["dog_id"]))
+    table = table.set_column(1, "event_date", pc.fill_null(table["event_date"], pa.scalar(0, type=TIMESTAMP)))
+    return table.sort_by([("dog_id", "ascending"), ("event_date", "ascending")])
+
+def write_sorted_runs(batches, run_directory):
+    """
+    Sort the batches BUILD_RUN_ROWS events at a time into Parquet run files.
+    Returns (run paths, events read, events without a dogId).
+    """
+    runs = []
+    pending = []
+    pending_rows = read = missing_dog = 0
+
+    def flush():
+        nonlocal missing_dog
+        table = sort_events(pa.concat_tables(pending))
+        missing_dog += pending_rows - table.num_rows
+        path = os.path.join(run_directory, f"run-{len(runs):05d}.parquet")
+        pq.write_table(table, path, row_group_size=MIN_MERGE_BATCH_ROWS)
+        runs.append(path)
+
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        read += batch.num_rows
+        if pending_rows >= BUILD_RUN_ROWS:
+            flush()
+            pending = []
+            pending_rows = 0
+    if pending:
+        flush()
+    return runs, read, missing_dog
+
+def merge_runs(run_paths, batch_rows):
+    """
+    Merge sorted run files into sorted tables, holding batch_rows rows of each
+    run at a time. Each step emits every buffered row up to the smallest last
+    key among the buffers: no row still unread can sort before those.
+    """
+    readers = [pq.ParquetFile(path).iter_batches(batch_size=batch_rows) for path in run_paths]
+    # Run -> [buffered table, its (dog_id, event_date) keys, first row not yet emitted]
+    buffers = {}
+
+    def refill(run):
+        for batch in readers[run]:
+            if batch.num_rows:
+                table = pa.Table.from_batches([batch])
+                keys = list(zip(table["dog_id"].to_pylist(), table["event_date"].cast(pa.int64()).to_pylist()))
+                buffers[run] = [table, keys, 0]
+                return
+        buffers.pop(run, None)
+
+    for run in range(len(readers)):
+        refill(run)
+    while buffers:
+        frontier = min(keys[-1] for _, keys, _ in buffers.values())
+        slices = []
+        for run, (table, keys, start) in list(buffers.items()):
+            end = bisect_right(keys, frontier, start)
+            if end > start:
+                slices.append(table.slice(start, end - start))
+            if end == len(keys):
+                refill(run)
+            else:
+                buffers[run][2] = end
+        yield pa.concat_tables(slices).sort_by([("dog_id", "ascending"), ("event_date", "ascending")])
+
+class PartWriter:
+    """
+    Writes sorted tables as part files of up to STORE_FILE_ROWS rows in row
+    groups of STORE_ROW_GROUP_SIZE, collecting the zone map of each.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = []
+        self.writer = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def write(self, table):
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        while self.pending_rows >= STORE_ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def write_row_group(self):
+        if self.writer is None:
+            name = f"part-{len(self.files):05d}.parquet"
+            self.writer = pq.ParquetWriter(os.path.join(self.directory, name), STORE_SCHEMA, compression="zstd")
+            self.files.append({"file": name, "rows": 0, "rowGroups": []})
+        part = self.files[-1]
+        table = pa.concat_tables(self.pending)
+        size = min(STORE_ROW_GROUP_SIZE, STORE_FILE_ROWS - part["rows"], table.num_rows)
+        group = table.slice(0, size)
+        self.writer.write_table(group, row_group_size=size)
+        part["rows"] += size
+        part["rowGroups"].append(zone_map(group))
+        self.pending = [table.slice(size)]
+        self.pending_rows -= size
+        if part["rows"] == STORE_FILE_ROWS:
+            self.close_part()
+
+    def close_part(self):
+        self.writer.close()
+        self.writer = None
+        part = self.files[-1]
+        part["min"] = part["rowGroups"][0]["min"]
+        part["max"] = part["rowGroups"][-1]["max"]
+
+    def close(self):
+        """Write what is left and return the {"file", "rows", "rowGroups", "min", "max"} entries of the parts."""
+        while self.pending_rows:
+            self.write_row_group()
+        if self.writer is not None:
+            self.close_part()
+        return self.files
+
+def build_event_store(source="jsonl", directory=STORE_DIRECTORY):
+    """
+    Sort every exported event by (dog_id, event_date) into Parquet part files
+    under directory and write index.json with min/max zone maps per file and
+    per row group. Events without a dogId are left out. Returns the index.
+
+    Events are sorted BUILD_RUN_ROWS at a time into temporary run files, which
+    are then merged, so memory is bounded by the run size rather than by the
+    number of events.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    run_directory = os.path.join(directory, RUN_DIRECTORY)
+    os.makedirs(run_directory)
+    runs, read, missing_dog = write_sorted_runs(read_parquet_events() if source == "parquet" else read_jsonl_events(), run_directory)
+    if not read:
+        raise FileNotFoundError(f"No exported events found for source {source!r}")
+
+    writer = PartWriter(directory)
+    for table in merge_runs(runs, max(MIN_MERGE_BATCH_ROWS, BUILD_RUN_ROWS // len(runs))):
+        writer.write(table)
+    files = writer.close()
+    shutil.rmtree(run_directory)
+    rows = read - missing_dog
+
+    index = {
+        "builtAt": datetime.now(timezone.utc).isoformat(),
+        "source": source,
+        "rows": rows,
+        "eventsWithoutDog": missing_dog,
+        "rowGroupSize": STORE_ROW_GROUP_SIZE,
+        "files": files,
+    }
+    tmp_path = os.path.join(directory, f"{INDEX_NAME}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(index, file)
+    os.replace(tmp_path, os.path.join(directory, INDEX_NAME))
+    print(f"Stored {rows} events in {len(files)} files under {directory} ({missing_dog} without a dogId left out)")
+    return index
+
+def store_is_stale(directory=STORE_DIRECTORY):
+    """True if the store is missing, has an older schema, or is older than any event export."""
+    index_path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return True
+    with open(index_path, "r") as file:
+        parts = json.load(file)["files"]
+    # No part files when no exported event has a dogId: there is no schema to compare
+    if parts and pq.read_schema(os.path.join(directory, parts[0]["file"])).names != STORE_SCHEMA.names:
+        return True
+    exports = [resolve_output(path) for file_path in EVENT_JSONL_FILES.values() for path in event_files(file_path)]
+    return any(os.path.getmtime(path) > os.path.getmtime(index_path) for path in exports if path)
+
+class EventStore:
+    """
+    Per-dog time-range lookups over the store written by build_event_store.
+
+    Row groups are kept in (dog_id, event_date) order with their key ranges, so
+    finding the ones that can hold a dog's events in a time window is a binary
+    search, and only those row groups are read. query() additionally keeps the
+    events of the last cache_size dogs in memory.
+    """
+
+    def __init__(self, directory=STORE_DIRECTORY, cache_size=DEFAULT_CACHE_SIZE):
+        with open(os.path.join(directory, INDEX_NAME), "r") as file:
+            self.index = json.load(file)
+        self.files = [pq.ParquetFile(os.path.join(directory, entry["file"]), memory_map=True) for entry in self.index["files"]]
+        # (file, row group, min key, max key, types), in key order
+        self.row_groups = [
+            (file_index, group_index, tuple(group["min"]), tuple(group["max"]), frozenset(group["types"]))
+            for file_index, entry in enumerate(self.index["files"])
+            for group_index, group in enumerate(entry["rowGroups"])
+        ]
+        self.max_keys = [max_key for _, _, _, max_key, _ in self.row_groups]
+        self.dog_events = lru_cache(maxsize=cache_size)(self.read_dog)
+
+    def matching_row_groups(self, dog_id, start=None, end=None, types=None):
+        """(file, row group) pairs whose zone maps overlap the dog's window and event types."""
+        low = (dog_id, MIN_MICROS if start is None else to_micros(start))
+        high = (dog_id, MAX_MICROS if end is None else to_micros(end))
+        return self.key_range_row_groups(low, high, types)
+
+    def key_range_row_groups(self, low, high, types=None):
+        """(file, row group) pairs whose zone maps overlap the (dog_id, micros) keys from low to high."""
+        wanted = set(types) if types else None
+        matches = []
+        for position in range(bisect_left(self.max_keys, low), len(self.row_groups)):
+            file_index, group_index, min_key, _, group_types = self.row_groups[position]
+            if min_key > high:
+                break
+            if wanted is None or wanted & group_types:
+                matches.append((file_index, group_index))
+        return matches
+
+    def read_row_groups(self, row_groups, columns=None):
+        count("row_groups_read", len(row_groups))
+        tables = []
+        for file_index in sorted({file_index for file_index, _ in row_groups}):
+            groups = [group_index for index, group_index in row_groups if index == file_index]
+            tables.append(self.files[file_index].read_row_groups(groups, columns=columns))
+        return pa.concat_tables(tables) if tables else STORE_SCHEMA.empty_table().select(columns or STORE_SCHEMA.names)
+
+    def scan(self, dog_id, start=None, end=None, types=None, columns=None):
+        """A dog's events between start and end (inclusive), of the given types, reading only matching row groups."""
+        table = self.read_row_groups(self.matching_row_groups(dog_id, start, end, types), columns)
+        return filter_events(table, dog_id, start, end, types)
+
+    def scan_dogs(self, first_dog_id, last_dog_id, columns=None):
+        """Every event of the dogs from first_dog_id to last_dog_id (inclusive, in ID order), in one read."""
+        row_groups = self.key_range_row_groups((first_dog_id, MIN_MICROS), (last_dog_id, MAX_MICROS))
+        table = self.read_row_groups(row_groups, columns)
+        return table.filter(pc.and_(pc.greater_equal(table["dog_id"], first_dog_id), pc.less_equal(table["dog_id"], last_dog_id)))
+
+    def read_dog(self, dog_id):
+        return self.scan(dog_id)
+
+    def query(self, dog_id, start=None, end=None, types=None):
+        """scan() served from the cached events of recently queried dogs."""
+        return filter_events(self.dog_events(dog_id), None, start, end, types)
+
+    def events(self, dog_id, start=None, end=None, types=None):
+        """query() as the exported event dicts, oldest first."""
+        return [json.loads(data) for data in self.query(dog_id, start, end, types)["data"].to_pylist()]
+
+def filter_events(table, dog_id=None, start=None, end=None, types=None):
+    conditions = []
+    if dog_id is not None:
+        conditions.append(pc.equal(table["dog_id"], dog_id))
+    if start is not None:
+        conditions.append(pc.greater_equal(table["event_date"], pa.scalar(to_micros(start), type=TIMESTAMP)))
+    if end is not None:
+        conditions.append(pc.less_equal(table["event_date"], pa.scalar(to_micros(end), type=TIMESTAMP)))
+    if types:
+        conditions.append(pc.is_in(table["type"], value_set=pa.array(list(types), type=pa.string())))
+    if not conditions:
+        return table
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    return table.filter(mask)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local (dogId, eventDate)-sorted event store.")
+    parser.add_argument("--build", action="store_true", help="Rebuild the store from the exports")
+    parser.add_argument("--source", choices=["jsonl", "parquet"], default="jsonl", help="Build from the event JSONL exports or the dog_data_parquet dataset")
+    parser.add_argument("--dog", help="Print this dog's events as JSONL")
+    parser.add_argument("--start", help="Earliest event date (ISO 8601)")
+    parser.add_argument("--end", help="Latest event date (ISO 8601)")
+    parser.add_argument("--types", help="Comma-separated event types, e.g. health,diet")
+    args = parser.parse_args()
+
+    if args.build:
+        build_event_store(args.source)
+    if args.dog:
+        store = EventStore()
+        types = args.types.split(",") if args.types else None
+        for event in store.events(args.dog, args.start, args.end, types):
+            print(json.dumps(event))
+    elif not args.build:
+        parser.error("pass --build and/or --dog")
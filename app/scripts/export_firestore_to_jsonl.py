@@ -1,15 +1,19 @@
-from google.cloud import firestore, storage
-from google.cloud.firestore_v1._helpers import DatetimeWithNanoseconds
 import json
 import os
 import datetime
 import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Change to DEBUG for more granular logs
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from async_engine import DEFAULT_CONCURRENCY, run_bounded
+from connections import get_async_firestore_client, get_firestore_client
+from gcs_upload import publish_content_manifest, upload_file, upload_files
+from id_index import build_id_indexes
+from metrics import count, span, write_run_report
+from output_files import COMPRESSION_SUFFIXES, compression_codec, open_output, resolve_output
+from projections import TARGET_FIELDS, fields_for, project
+from serializers import encode_jsonl_line, to_plain
+from incremental_export import WatermarkTracker, incremental_stream, load_watermarks, save_watermarks, delta_path, compact_jsonl
 
 # Path to your Google Cloud service account key file
 SERVICE_ACCOUNT_KEY = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -17,75 +21,294 @@ SERVICE_ACCOUNT_KEY = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 GCS_BUCKET_NAME = "firestore-batch-boi"
 
 # Firestore collections to export
-COLLECTIONS = ["users", "dogs", "healthEvents", "dietEvents", "exerciseEvents"]
+COLLECTIONS = ["users", "dogs", "healthEvents", "dietEvents", "exerciseEvents", "behaviorEvents"]
 
 # Directory to save JSONL files
 OUTPUT_DIRECTORY = "app/scripts/outputs"
 
-# Ensure the output directory exists
-os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+# Per-collection updatedAt high-water marks for incremental exports
+WATERMARK_FILE = os.path.join(OUTPUT_DIRECTORY, "jsonl_watermarks.json")
+
+# Default number of key-range partitions (and worker threads) for parallel exports
+DEFAULT_PARTITION_COUNT = 8
 
 def custom_json_serializer(obj):
     """Custom JSON serializer for unsupported Firestore data types."""
-    if isinstance(obj, DatetimeWithNanoseconds):
-        return obj.isoformat()  # Convert to ISO 8601 string
-    elif isinstance(obj, datetime.datetime):
-        return obj.isoformat()
-    elif isinstance(obj, firestore.DocumentReference):
-        return obj.path  # Serialize DocumentReference as its path
-    logging.warning(f"Unhandled data type during serialization: {type(obj)}")
-    return str(obj)
-
-def fetch_and_save_data(collection_name):
-    """Fetch data from Firestore and save to a local JSONL file."""
+    return to_plain(obj)
+
+def write_documents_to_jsonl(docs, local_file_path, collection_name=None, compression=None):
+    """
+    Write streamed document snapshots to a JSONL file as they arrive. Returns the record count.
+
+    Documents are converted with the collection's precompiled encoder. With a
+    compression codec the file is compressed as it is written and stored under
+    a content-addressed name; resolve_output(local_file_path) returns it.
+    """
+    written = 0
+    with open_output(local_file_path, compression) as f:
+        for doc in docs:
+            f.write(encode_jsonl_line(collection_name, doc.id, doc.to_dict()))
+            written += 1
+    count("docs_read", written, collection=collection_name)
+    return written
+
+def export_stem(collection_name, target="jsonl"):
+    """
+    "dogs" for full exports, "dogs.join" for exports projected to another
+    target's fields, so a projected file never replaces the full snapshot.
+    """
+    return collection_name if target == "jsonl" else f"{collection_name}.{target}"
+
+def fetch_and_save_data(collection_name, compression=None, target="jsonl"):
+    """
+    Stream documents from Firestore straight into a local JSONL file. Returns the written path.
+
+    Only the fields the target reads are fetched, through a select() projection.
+    """
     try:
         logging.info(f"Fetching data from Firestore collection: {collection_name}")
-        db = firestore.Client()
+        db = get_firestore_client()
         collection_ref = db.collection(collection_name)
-        docs = collection_ref.stream()
+        docs = project(collection_ref, fields_for([target], collection_name)).stream()
 
-        data = []
-        for doc in docs:
-            doc_dict = doc.to_dict()
-            doc_dict["id"] = doc.id  # Add document ID
-            data.append(doc_dict)
+        # Each document is written as it arrives; memory is bounded by the write buffer
+        local_file_path = os.path.join(OUTPUT_DIRECTORY, f"{export_stem(collection_name, target)}.jsonl")
+        written = write_documents_to_jsonl(docs, local_file_path, collection_name, compression)
+        local_file_path = resolve_output(local_file_path)
 
-        logging.info(f"Fetched {len(data)} records from collection: {collection_name}")
+        logging.info(f"Saved {written} records from collection {collection_name} to JSONL file: {local_file_path}")
+        return local_file_path
+    except Exception as e:
+        logging.error(f"Failed to fetch or save data for collection {collection_name}: {e}")
+        raise
+
+async def fetch_and_save_data_async(collection_name, compression=None, target="jsonl"):
+    """Stream a collection (or the fields of it the target reads) through the AsyncClient into a local JSONL file."""
+    try:
+        logging.info(f"Fetching data from Firestore collection: {collection_name}")
+        collection_ref = project(get_async_firestore_client().collection(collection_name), fields_for([target], collection_name))
 
-        # Save to JSONL file
-        local_file_path = os.path.join(OUTPUT_DIRECTORY, f"{collection_name}.jsonl")
-        with open(local_file_path, "w") as f:
-            for record in data:
-                f.write(json.dumps(record, default=custom_json_serializer) + "\n")
+        local_file_path = os.path.join(OUTPUT_DIRECTORY, f"{export_stem(collection_name, target)}.jsonl")
+        written = 0
+        with open_output(local_file_path, compression) as f:
+            async for doc in collection_ref.stream():
+                f.write(encode_jsonl_line(collection_name, doc.id, doc.to_dict()))
+                written += 1
+        count("docs_read", written, collection=collection_name)
+        local_file_path = resolve_output(local_file_path)
 
-        logging.info(f"Data saved to JSONL file: {local_file_path}")
+        logging.info(f"Saved {written} records from collection {collection_name} to JSONL file: {local_file_path}")
         return local_file_path
     except Exception as e:
         logging.error(f"Failed to fetch or save data for collection {collection_name}: {e}")
         raise
 
+async def fetch_and_save_all_async(collections, concurrency=DEFAULT_CONCURRENCY, compression=None, target="jsonl"):
+    """
+    Stream several collections at once, at most `concurrency` at a time.
+
+    Reads are not rate limited; the 500/50/5 ramp-up applies to the writers.
+    Only the fields the target reads are fetched. Returns the local paths of
+    the collections that were exported.
+    """
+    local_files = []
+    collections = [collection_name for collection_name in collections if fields_for([target], collection_name) != []]
+
+    async def export(collection_name):
+        local_files.append(await fetch_and_save_data_async(collection_name, compression, target))
+
+    await run_bounded(collections, export, concurrency, label="collections exported", rpc="collection_stream")
+    return local_files
+
+def fetch_and_save_data_parallel(collection_name, partition_count=DEFAULT_PARTITION_COUNT, compression=None, target="jsonl"):
+    """
+    Export a collection as one JSONL shard per key range, streaming the ranges concurrently.
+
+    The key ranges come from a partition query on the collection group, so
+    subcollections sharing the same ID would be included. A manifest listing the
+    shards and their record counts is written next to them. Returns the paths of
+    the shard files followed by the manifest.
+    """
+    try:
+        logging.info(f"Partitioning Firestore collection {collection_name} into up to {partition_count} ranges")
+        db = get_firestore_client()
+        partitions = list(db.collection_group(collection_name).get_partitions(partition_count))
+        fields = fields_for([target], collection_name)
+        stem = export_stem(collection_name, target)
+        shard_paths = [
+            os.path.join(OUTPUT_DIRECTORY, f"{stem}-{index:05d}-of-{len(partitions):05d}.jsonl")
+            for index in range(len(partitions))
+        ]
+
+        def save_partition(index):
+            docs = project(partitions[index].query(), fields).stream()
+            written = write_documents_to_jsonl(docs, shard_paths[index], collection_name, compression)
+            logging.info(f"Saved {written} records to shard {shard_paths[index]}")
+            return written
+
+        with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+            counts = list(executor.map(save_partition, range(len(partitions))))
+        shard_paths = [resolve_output(path) for path in shard_paths]
+
+        manifest_path = os.path.join(OUTPUT_DIRECTORY, f"{stem}.manifest.json")
+        with open(manifest_path, "w") as f:
+            json.dump({
+                "collection": collection_name,
+                "exportedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "records": sum(counts),
+                "shards": [
+                    {"file": os.path.basename(path), "records": records}
+                    for path, records in zip(shard_paths, counts)
+                ]
+            }, f, indent=4)
+
+        logging.info(f"Saved {sum(counts)} records from collection {collection_name} across {len(partitions)} shards")
+        return shard_paths + [manifest_path]
+    except Exception as e:
+        logging.error(f"Failed to export collection {collection_name} in parallel: {e}")
+        raise
+
+def fetch_and_save_delta(collection_name, watermarks):
+    """
+    Export only documents updated since the collection's stored watermark.
+
+    The first run for a collection writes a full snapshot; later runs write a
+    delta file for compact_jsonl to merge. The watermark is advanced to the
+    newest updatedAt seen once the file is written. Returns the written path.
+    """
+    try:
+        db = get_firestore_client()
+        collection_ref = db.collection(collection_name)
+        snapshot_path = os.path.join(OUTPUT_DIRECTORY, f"{collection_name}.jsonl")
+        watermark = watermarks.get(collection_name)
+        tracker = WatermarkTracker(watermark)
+
+        if watermark is None or not os.path.exists(snapshot_path):
+            logging.info(f"No watermark for {collection_name}, exporting a full snapshot")
+            local_file_path = snapshot_path
+            docs = collection_ref.stream()
+        else:
+            logging.info(f"Exporting {collection_name} changes newer than {watermark}")
+            local_file_path = delta_path(collection_name, "jsonl")
+            docs = incremental_stream(collection_ref, watermark)
+
+        written = write_documents_to_jsonl(tracker.track(docs), local_file_path, collection_name)
+        watermarks[collection_name] = tracker.watermark
+        save_watermarks(watermarks, WATERMARK_FILE)
+
+        logging.info(f"Saved {written} changed records from collection {collection_name} to {local_file_path}")
+        return local_file_path
+    except Exception as e:
+        logging.error(f"Failed to export changes for collection {collection_name}: {e}")
+        raise
+
 def upload_to_gcs(local_file_path, bucket_name, destination_blob_name):
-    """Upload a file to Google Cloud Storage."""
+    """Upload a file to Google Cloud Storage through the shared upload engine."""
     try:
         logging.info(f"Uploading {local_file_path} to GCS bucket {bucket_name} as {destination_blob_name}")
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(local_file_path)
-        logging.info(f"File {local_file_path} successfully uploaded to gs://{bucket_name}/{destination_blob_name}")
+        upload_file(local_file_path, bucket_name, destination_blob_name)
     except Exception as e:
         logging.error(f"Failed to upload file {local_file_path} to GCS: {e}")
         raise
 
-def main():
+def upload_content_manifest(uploads):
+    """
+    Upload the map of logical names to content-addressed files next to the
+    compressed exports among uploads, so readers of the bucket can find the
+    current ones, and delete the blobs they replace.
+    """
+    try:
+        publish_content_manifest(OUTPUT_DIRECTORY, uploads)
+    except Exception as e:
+        logging.error(f"Failed to upload the content manifest: {e}")
+
+def main(partition_count=None, incremental=False, compact=False, run_async=False, concurrency=DEFAULT_CONCURRENCY,
+         compression=None, target="jsonl"):
+    """
+    Export every collection. target names the consumer the files are for (see
+    projections.TARGET_FIELDS): only the fields it reads are fetched and
+    collections it does not read are skipped. Files of any target but jsonl
+    are named <collection>.<target>.jsonl and leave the full snapshots alone.
+    """
     logging.info("Starting Firestore export process")
+    # The ID indexes are built from the full users and dogs snapshots
+    index_ids = target == "jsonl"
+    if run_async:
+        with span("export"):
+            local_files = asyncio.run(fetch_and_save_all_async(COLLECTIONS, concurrency, compression, target))
+        with span("upload"):
+            uploads = [(path, GCS_BUCKET_NAME, os.path.basename(path)) for path in local_files]
+            failed = upload_files(uploads)
+            upload_content_manifest([upload for upload in uploads if upload[0] not in failed])
+        if index_ids:
+            with span("id_index"):
+                build_id_indexes()
+        return
+    watermarks = load_watermarks(WATERMARK_FILE)
+    # Uploaded (local path, bucket, blob name) triples, for the content manifest
+    uploaded = []
     for collection in COLLECTIONS:
+        if fields_for([target], collection) == []:
+            logging.info(f"Skipping collection {collection}: not read by {target}")
+            continue
         try:
             logging.info(f"Processing collection: {collection}")
-            local_file = fetch_and_save_data(collection)
-            upload_to_gcs(local_file, GCS_BUCKET_NAME, f"{collection}.jsonl")
+            with span("export", collection=collection):
+                if compact:
+                    snapshot_path = os.path.join(OUTPUT_DIRECTORY, f"{collection}.jsonl")
+                    records = compact_jsonl(snapshot_path, collection)
+                    if records is None:
+                        logging.info(f"No pending deltas for collection: {collection}")
+                        continue
+                    logging.info(f"Compacted {collection} into {records} records")
+                    upload_to_gcs(snapshot_path, GCS_BUCKET_NAME, f"{collection}.jsonl")
+                elif incremental:
+                    local_file = fetch_and_save_delta(collection, watermarks)
+                    upload_to_gcs(local_file, GCS_BUCKET_NAME, os.path.relpath(local_file, OUTPUT_DIRECTORY))
+                elif partition_count:
+                    local_files = fetch_and_save_data_parallel(collection, partition_count, compression, target)
+                    uploads = [(path, GCS_BUCKET_NAME, os.path.basename(path)) for path in local_files]
+                    failed = upload_files(uploads)
+                    uploaded.extend(upload for upload in uploads if upload[0] not in failed)
+                else:
+                    local_file = fetch_and_save_data(collection, compression, target)
+                    upload_to_gcs(local_file, GCS_BUCKET_NAME, os.path.basename(local_file))
+                    uploaded.append((local_file, GCS_BUCKET_NAME, os.path.basename(local_file)))
         except Exception as e:
             logging.error(f"Error processing collection {collection}: {e}")
 
+    if compression:
+        upload_content_manifest(uploaded)
+
+    # Full single-file exports get fresh dense ID indexes for the joins and rollups
+    if index_ids and not (partition_count or incremental or compact):
+        with span("id_index"):
+            build_id_indexes()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,  # Change to DEBUG for more granular logs (slows large exports down)
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    # Ensure the output directory exists
+    os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+
+    parser = argparse.ArgumentParser(description="Export Firestore collections to JSONL and upload them to GCS.")
+    parser.add_argument("--parallel", type=int, nargs="?", const=DEFAULT_PARTITION_COUNT, default=None,
+                        metavar="PARTITIONS", help="Export each collection as concurrently streamed key-range shards")
+    parser.add_argument("--incremental", action="store_true", help="Export only documents updated since the last run")
+    parser.add_argument("--compact", action="store_true", help="Merge pending delta files into the JSONL snapshots")
+    parser.add_argument("--async", dest="run_async", action="store_true", help="Stream all collections concurrently with the asyncio client")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Collections streamed at once in async mode")
+    parser.add_argument("--compress", type=compression_codec, default=None, metavar="{" + ",".join(COMPRESSION_SUFFIXES) + "}",
+                        help="Compress the JSONL files as they are written and name them by content hash")
+    parser.add_argument("--fields", choices=list(TARGET_FIELDS), default="jsonl",
+                        help="Only fetch the fields this consumer reads, e.g. join or lean (dogs without *EventIds), into <collection>.<target>.jsonl")
+    args = parser.parse_args()
+    if args.compress and (args.incremental or args.compact):
+        parser.error("--compress only applies to full exports; deltas and compaction work on plain JSONL")
+    if args.fields != "jsonl" and (args.incremental or args.compact):
+        parser.error("--fields only applies to full exports; deltas are merged into complete snapshots")
+    main(args.parallel, args.incremental, args.compact, args.run_async, args.concurrency, args.compress, args.fields)
+    write_run_report("export_firestore_to_jsonl")
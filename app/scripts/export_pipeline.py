@@ -0,0 +1,325 @@
+import argparse
+import csv
+import logging
+import os
+import queue
+import sys
+import threading
+from contextlib import ExitStack
+from connections import get_firestore_client
+from export_firestore_to_jsonl import COLLECTIONS, GCS_BUCKET_NAME, OUTPUT_DIRECTORY, write_documents_to_jsonl
+from firebase_to_csv_direct import collection_writers
+from gcs_upload import publish_content_manifest, upload_files
+from metrics import count, span, write_run_report
+from output_files import COMPRESSION_SUFFIXES, compression_codec, open_output, resolve_output
+from projections import fields_for, project
+from serializers import get_encoder
+
+# Records handed to a sink per queue item
+CHUNK_SIZE = 500
+# Chunks a sink may fall behind the reader before the reader blocks
+QUEUE_CHUNKS = 16
+
+# Queue markers
+COLLECTION_END = object()
+STREAM_END = object()
+
+class ExportedDocument:
+    """
+    A document read once from Firestore and shared by every sink.
+
+    References are already converted to paths and timestamps to ISO strings,
+    so sinks see the same values the JSONL export contains. to_dict returns a
+    shallow copy, so a sink may modify the top-level fields it gets.
+    """
+
+    __slots__ = ("id", "_data")
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+def event_type_of(collection_name):
+    """"healthEvents" -> "health"; None for non-event collections."""
+    return collection_name[:-len("Events")] if collection_name.endswith("Events") else None
+
+class JsonlSink:
+    """One JSONL file per collection, as written by export_firestore_to_jsonl."""
+
+    name = "jsonl"
+
+    def __init__(self, compression=None):
+        self.compression = compression
+        self.outputs = []
+
+    def write_collection(self, collection_name, docs):
+        local_file_path = os.path.join(OUTPUT_DIRECTORY, f"{collection_name}.jsonl")
+        records = write_documents_to_jsonl(docs, local_file_path, collection_name, self.compression)
+        local_file_path = resolve_output(local_file_path)
+        logging.info(f"[jsonl] Saved {records} records to {local_file_path}")
+        self.outputs.append((local_file_path, GCS_BUCKET_NAME, os.path.basename(local_file_path)))
+
+    def close(self):
+        pass
+
+class CsvSink:
+    """Per-collection CSVs, as written by firebase_to_csv_direct."""
+
+    name = "csv"
+
+    def __init__(self, compression=None):
+        self.compression = compression
+        self.writers = dict(collection_writers())
+        self.outputs = []
+
+    def write_collection(self, collection_name, docs):
+        write_csv = self.writers.get(collection_name)
+        if write_csv is None:
+            return
+        local_file_path = os.path.join(OUTPUT_DIRECTORY, f"{collection_name}.csv")
+        write_csv(docs, local_file_path, compression=self.compression)
+        local_file_path = resolve_output(local_file_path)
+        logging.info(f"[csv] Saved {local_file_path}")
+        self.outputs.append((local_file_path, GCS_BUCKET_NAME, f"mockData/{os.path.basename(local_file_path)}"))
+
+    def close(self):
+        pass
+
+class JoinSinkBase:
+    """
+    Indexes users and dogs as they stream past and hands each event to
+    write_event joined with its dog and owner. users and dogs must therefore be
+    read before the event collections.
+    """
+
+    def __init__(self):
+        import jsonl_to_csv_to_gcs as join
+
+        self.join = join
+        self.users = {}
+        self.dogs = {}
+
+    def write_collection(self, collection_name, docs):
+        event_type = event_type_of(collection_name)
+        if collection_name == "users":
+            self.users.update((doc.id, self.join.user_index_entry(doc.to_dict())) for doc in docs)
+        elif collection_name == "dogs":
+            self.dogs.update((doc.id, self.join.dog_index_entry(doc.to_dict())) for doc in docs)
+        elif event_type:
+            for doc in docs:
+                event = {**doc.to_dict(), "id": doc.id}
+                try:
+                    self.write_event(event_type, event, *self.join.join_event(event, self.users, self.dogs))
+                except Exception as e:
+                    logging.warning(f"Error processing event: {event}, Error: {e}")
+
+class DenormalizedJoinSink(JoinSinkBase):
+    """The dog_data.csv join of jsonl_to_csv_to_gcs."""
+
+    name = "join"
+
+    def __init__(self, compression=None):
+        super().__init__()
+        self.compression = compression
+        self.files = ExitStack()
+        self.writer = csv.writer(self.files.enter_context(open_output(self.join.OUTPUT_CSV, compression, newline="")))
+        self.writer.writerow(self.join.CSV_HEADERS)
+        self.outputs = []
+
+    def write_event(self, *joined):
+        self.writer.writerow(self.join.to_csv_row(*joined))
+
+    def close(self):
+        self.files.close()
+        local_file_path = resolve_output(self.join.OUTPUT_CSV)
+        logging.info(f"[join] Saved {local_file_path}")
+        blob_name = os.path.basename(local_file_path) if self.compression else self.join.GCS_OUTPUT_FILE
+        self.outputs = [(local_file_path, self.join.GCS_BUCKET_NAME, blob_name)]
+
+class ParquetSink(JoinSinkBase):
+    """The partitioned Parquet dataset of jsonl_to_csv_to_gcs --parquet."""
+
+    name = "parquet"
+
+    def __init__(self, compression=None):
+        # Parquet pages are already zstd-compressed
+        super().__init__()
+        self.dataset = self.join.ParquetDatasetWriter()
+        self.outputs = []
+
+    def write_event(self, *joined):
+        self.dataset.write(*joined)
+
+    def close(self):
+        self.dataset.close()
+        self.outputs = self.dataset.uploads()
+
+class RollupSink:
+    """The per-dog daily stats of daily_rollups, aggregated in chunks as events stream past."""
+
+    name = "rollup"
+
+    def __init__(self, compression=None):
+        # The summary stays plain CSV: daily_rollups --incremental reads and rewrites it
+        import daily_rollups
+
+        self.rollups = daily_rollups
+        self.accumulator = daily_rollups.RollupAccumulator()
+        self.outputs = []
+
+    def write_collection(self, collection_name, docs):
+        event_type = event_type_of(collection_name)
+        if event_type not in self.rollups.ROLLUP_METRICS:
+            return
+        chunk = []
+        for doc in docs:
+            chunk.append(doc.to_dict())
+            if len(chunk) == self.rollups.CHUNK_SIZE:
+                self.accumulator.add(event_type, chunk)
+                chunk = []
+        self.accumulator.add(event_type, chunk)
+
+    def close(self):
+        self.rollups.write_summary(self.accumulator.result())
+        logging.info(f"[rollup] Saved {self.rollups.SUMMARY_FILE}")
+        self.outputs = [(self.rollups.SUMMARY_FILE, GCS_BUCKET_NAME, os.path.basename(self.rollups.SUMMARY_FILE))]
+
+SINKS = {sink.name: sink for sink in (JsonlSink, CsvSink, DenormalizedJoinSink, ParquetSink, RollupSink)}
+
+class SinkWorker(threading.Thread):
+    """Feeds one sink from a bounded queue on its own thread."""
+
+    def __init__(self, sink):
+        super().__init__(name=f"sink-{sink.name}", daemon=True)
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.error = None
+
+    def documents(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is COLLECTION_END:
+                return
+            if chunk is STREAM_END:
+                # The reader stopped partway through the collection
+                self.stream_ended = True
+                return
+            yield from chunk
+
+    def run(self):
+        self.stream_ended = False
+        while not self.stream_ended:
+            collection_name = self.queue.get()
+            if collection_name is STREAM_END:
+                break
+            docs = self.documents()
+            try:
+                if self.error is None:
+                    self.sink.write_collection(collection_name, docs)
+            except Exception as e:
+                logging.error(f"[{self.sink.name}] Failed on collection {collection_name}: {e}")
+                self.error = e
+            # Drain whatever the sink left unread so the reader never blocks on a dead sink
+            for _ in docs:
+                pass
+        try:
+            if self.error is None:
+                self.sink.close()
+        except Exception as e:
+            logging.error(f"[{self.sink.name}] Failed to close: {e}")
+            self.error = e
+
+def run_pipeline(sink_names, collections=COLLECTIONS, upload=False, compression=None):
+    """
+    Read every collection from Firestore once and fan the documents out to the
+    selected sinks. A slow sink fills its queue and throttles the reader instead
+    of buffering without limit. Each collection is read with a select() of the
+    fields the sinks declare under their names in projections.TARGET_FIELDS
+    (whole documents if any of them needs them), and collections no sink reads
+    are skipped. With a compression codec the JSONL, CSV and join outputs are
+    compressed as they are written. Returns the names of sinks that failed.
+    """
+    os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+    workers = [SinkWorker(SINKS[name](compression)) for name in sink_names]
+    for worker in workers:
+        worker.start()
+
+    def broadcast(item):
+        for worker in workers:
+            worker.queue.put(item)
+
+    db = get_firestore_client()
+    # users and dogs first, so the join sinks have their indexes before any event arrives
+    ordered = sorted(collections, key=lambda name: event_type_of(name) is not None)
+    in_collection = False
+    try:
+        for collection_name in ordered:
+            fields = fields_for(sink_names, collection_name)
+            if fields == []:
+                logging.info(f"Skipping collection {collection_name}: no sink reads it")
+                continue
+            logging.info(f"Streaming collection: {collection_name}")
+            broadcast(collection_name)
+            in_collection = True
+            encode = get_encoder(collection_name)
+            chunk = []
+            records = 0
+            with span("read", collection=collection_name):
+                for doc in project(db.collection(collection_name), fields).stream():
+                    chunk.append(ExportedDocument(doc.id, encode(doc.to_dict())))
+                    if len(chunk) == CHUNK_SIZE:
+                        broadcast(chunk)
+                        records += len(chunk)
+                        chunk = []
+                if chunk:
+                    broadcast(chunk)
+                    records += len(chunk)
+            broadcast(COLLECTION_END)
+            in_collection = False
+            count("docs_read", records, collection=collection_name)
+            logging.info(f"Read {records} records from collection: {collection_name}")
+    finally:
+        # A read error leaves the sinks inside a collection: end it first, then
+        # the stream, so every worker finishes and the error propagates after the join
+        if in_collection:
+            broadcast(COLLECTION_END)
+        broadcast(STREAM_END)
+        with span("drain_sinks"):
+            for worker in workers:
+                worker.join()
+
+    if upload:
+        with span("upload"):
+            uploads = [item for worker in workers if worker.error is None for item in worker.sink.outputs]
+            failed = upload_files(uploads)
+            try:
+                publish_content_manifest(OUTPUT_DIRECTORY, [upload for upload in uploads if upload[0] not in failed])
+            except Exception as e:
+                logging.error(f"Failed to upload the content manifest: {e}")
+
+    return [worker.sink.name for worker in workers if worker.error is not None]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Read each Firestore collection once and write it to several outputs.")
+    parser.add_argument("--sinks", default="jsonl,csv,join", help=f"Comma-separated outputs from: {', '.join(SINKS)}")
+    parser.add_argument("--upload", action="store_true", help="Upload the outputs to GCS when done")
+    parser.add_argument("--compress", type=compression_codec, default=None, metavar="{" + ",".join(COMPRESSION_SUFFIXES) + "}",
+                        help="Compress the jsonl, csv and join outputs and name them by content hash")
+    args = parser.parse_args()
+
+    failed = run_pipeline([name.strip() for name in args.sinks.split(",") if name.strip()], upload=args.upload,
+                          compression=args.compress)
+    if failed:
+        logging.error(f"Sinks failed: {', '.join(failed)}")
+    write_run_report("export_pipeline")
+    # A partial export must not look like a successful one to cron or CI
+    if failed:
+        sys.exit(1)
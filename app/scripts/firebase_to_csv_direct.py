@@ -1,162 +1,369 @@
+import argparse
 import csv
-from firebase_admin import firestore, credentials, initialize_app
+import json
 from datetime import datetime
+from itertools import chain, islice
+from google.cloud.firestore import DocumentReference
 import os
-
-# Firebase initialization
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-initialize_app(cred)
-db = firestore.client()
+from functools import partial
+from serializers import format_timestamp, join_reference_paths
+from connections import get_firestore_client
+from metrics import counted, span, write_run_report
+from output_files import COMPRESSION_SUFFIXES, compression_codec, open_output
+from projections import DOG_FIELDS, DocumentWithFields, EventIdCollector
+from incremental_export import WatermarkTracker, incremental_stream, load_watermarks, save_watermarks, delta_path, compact_csv
 
 def ensure_output_directory():
     os.makedirs("app/scripts/outputs", exist_ok=True)
 
-def format_timestamp(ts):
-    """Helper function to format Firestore timestamps and ISO 8601 strings."""
-    if hasattr(ts, "isoformat"):  # Firestore Timestamp
-        return ts.isoformat()
-    elif isinstance(ts, str):  # ISO 8601 string
-        try:
-            return datetime.fromisoformat(ts).isoformat()
-        except ValueError:
-            return ""  # Leave blank for invalid strings
-    return ""  # Leave blank if the field is missing
-
-def fetch_and_write_csv():
+USER_HEADERS = ["User ID", "Full Name", "Email", "ZIP Code", "Dog IDs", "CreatedAt", "UpdatedAt"]
+DOG_HEADERS = ["Dog ID", "Name", "Age", "Breed", "Sex", "Weight", "Birthday", "User IDs",
+               "Behavior Event IDs", "Diet Event IDs", "Exercise Event IDs", "Health Event IDs", "CreatedAt", "UpdatedAt"]
+EVENT_HEADERS = ["Event ID", "User ID", "Dog ID", "CreatedAt", "UpdatedAt", "Details"]
+
+# Event collections exported to individual CSVs
+EVENT_TYPES = ["behaviorEvents", "dietEvents", "exerciseEvents", "healthEvents"]
+
+# Per-collection updatedAt high-water marks for incremental exports
+WATERMARK_FILE = "app/scripts/outputs/csv_watermarks.json"
+
+# Typed per-event-type CSVs and their column schemas
+TYPED_OUTPUT_DIRECTORY = "app/scripts/outputs/typed"
+
+# (field, column type) pairs; nested fields are addressed with dotted paths
+TYPED_EVENT_COMMON_FIELDS = [
+    ("type", "string"),
+    ("userId", "reference"),
+    ("dogId", "reference"),
+    ("createdAt", "timestamp"),
+    ("updatedAt", "timestamp"),
+]
+TYPED_EVENT_FIELDS = {
+    "behaviorEvents": [("behaviorType", "string"), ("severity", "integer"), ("notes", "string")],
+    "dietEvents": [("brandName", "string"), ("foodType", "string"), ("quantity", "float")],
+    "exerciseEvents": [("activityType", "string"), ("source", "string"), ("distance", "float"), ("duration", "float")],
+    "healthEvents": [("eventType", "string"), ("severity", "integer"), ("notes", "string")],
+}
+
+# Documents read ahead to discover fields beyond the known ones
+TYPED_SAMPLE_SIZE = 1000
+
+def write_users_csv(users_ref, path, compression=None):
+    with open_output(path, compression, newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(USER_HEADERS)
+        for user in users_ref:
+            try:
+                user_data = user.to_dict()
+                full_name = user_data.get("full_name", "")
+                if not full_name:
+                    continue
+
+                email = user_data.get("email", "")
+                zip_code = user_data.get("address", {}).get("zip", "")
+
+                # Handle createdAt and updatedAt
+                created_at = format_timestamp(user_data.get("createdAt"))
+                updated_at = format_timestamp(user_data.get("updatedAt"))
+
+                # Process Dog IDs
+                dog_ids = join_reference_paths(user_data["dogList"]) if "dogList" in user_data else ""
+
+                writer.writerow([user.id, full_name, email, zip_code, dog_ids, created_at, updated_at])
+            except Exception as e:
+                print(f"Error processing user {user.id}: {e}")
+
+def write_dogs_csv(dogs_ref, path, compression=None):
+    with open_output(path, compression, newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(DOG_HEADERS)
+        for dog in dogs_ref:
+            try:
+                dog_data = dog.to_dict()
+                name = dog_data.get("name", "")
+                age = dog_data.get("age", "")
+                breed = dog_data.get("breed", "")
+                sex = dog_data.get("sex", "")
+                weight = dog_data.get("weight", "")
+
+                # Handle birthday, createdAt, and updatedAt
+                birthday = format_timestamp(dog_data.get("birthday"))
+                created_at = format_timestamp(dog_data.get("createdAt"))
+                updated_at = format_timestamp(dog_data.get("updatedAt"))
+
+                # Convert Firestore DocumentReferences to paths for users
+                user_ids = join_reference_paths(dog_data.get("users", []))
+
+                # Process individual event fields
+                behavior_event_ids = join_reference_paths(dog_data.get("behaviorEventIds", []))
+                diet_event_ids = join_reference_paths(dog_data.get("dietEventIds", []))
+                exercise_event_ids = join_reference_paths(dog_data.get("exerciseEventIds", []))
+                health_event_ids = join_reference_paths(dog_data.get("healthEventIds", []))
+
+                # Write to CSV
+                writer.writerow([dog.id, name, age, breed, sex, weight, birthday, user_ids,
+                                 behavior_event_ids, diet_event_ids, exercise_event_ids, health_event_ids,
+                                 created_at, updated_at])
+            except Exception as e:
+                print(f"Error processing dog {dog.id}: {e}")
+
+def write_events_csv(event_type, events_ref, path, compression=None):
+    with open_output(path, compression, newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(EVENT_HEADERS)
+
+        for event in events_ref:
+            try:
+                event_data = event.to_dict()
+
+                # Extract createdAt and updatedAt from the event data
+                created_at = format_timestamp(event_data.get("createdAt"))
+                updated_at = format_timestamp(event_data.get("updatedAt"))
+
+                # Remove createdAt and updatedAt from the details
+                event_data.pop("createdAt", None)
+                event_data.pop("updatedAt", None)
+
+                # Convert Firestore references to string paths
+                user_id = event_data.get("userId")
+                if isinstance(user_id, DocumentReference):
+                    user_id = user_id.path
+
+                dog_id = event_data.get("dogId")
+                if isinstance(dog_id, DocumentReference):
+                    dog_id = dog_id.path
+
+                # Add 'type' as the first item in Details
+                event_type_field = f"type: {event_data.get('type', '')}"
+                event_data.pop("type", None)  # Remove it from the remaining fields
+
+                # Extract remaining details
+                details = ", ".join(
+                    [event_type_field] + 
+                    [f"{key}: {value}" for key, value in event_data.items() if key not in ["userId", "dogId"]]
+                )
+                writer.writerow([event.id, user_id, dog_id, created_at, updated_at, details])
+            except Exception as e:
+                print(f"Error processing event {event.id} in {event_type}: {e}")
+
+def flatten_fields(data, prefix=""):
+    """Yield (dotted field path, value) pairs, descending into maps."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from flatten_fields(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+def infer_column_type(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, datetime):
+        return "timestamp"
+    if hasattr(value, "path"):  # DocumentReference
+        return "reference"
+    if isinstance(value, list):
+        if value and all(hasattr(item, "path") for item in value):
+            return "reference_list"
+        return "json"
+    return "string"
+
+def bare_id(value):
+    """Document ID of a DocumentReference or "collection/id" path."""
+    if hasattr(value, "id"):
+        return value.id
+    return str(value).split("/")[-1]
+
+def float_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return ""
+
+def integer_value(value):
+    """The value as an int, or "" when it is not a whole number (12.5 is never truncated to 12)."""
+    number = float_value(value)
+    if number == "" or not number.is_integer():
+        return ""
+    return int(number)
+
+TYPED_CONVERTERS = {
+    "string": str,
+    "boolean": lambda value: str(bool(value)).lower(),
+    "integer": integer_value,
+    "float": float_value,
+    "timestamp": format_timestamp,
+    "reference": bare_id,
+    "reference_list": lambda values: ",".join(bare_id(value) for value in values),
+    "json": lambda value: json.dumps(value, default=str),
+}
+
+def typed_event_columns(collection_name, sample):
+    """
+    Known columns of an event collection, followed by any other field found in
+    the sampled documents. A field seen with both integers and floats is typed float.
+    """
+    columns = dict(TYPED_EVENT_COMMON_FIELDS + TYPED_EVENT_FIELDS.get(collection_name, []))
+    known = set(columns)
+    for doc in sample:
+        for field, value in flatten_fields(doc.to_dict()):
+            if value is None or field in known:
+                continue
+            column_type = infer_column_type(value)
+            if {columns.setdefault(field, column_type), column_type} == {"integer", "float"}:
+                columns[field] = "float"
+    return columns
+
+def write_typed_events_csv(collection_name, events_ref, path, sample_size=TYPED_SAMPLE_SIZE):
+    """
+    Write one event collection with a real column per field, plus a
+    {collection}.schema.json next to it listing each column's type.
+
+    References are written as bare document IDs, timestamps as ISO 8601 and
+    numbers unquoted, so the file can be loaded into a warehouse table as is.
+    Fields first appearing after the sampled documents are not exported.
+    """
+    events = iter(events_ref)
+    sample = list(islice(events, sample_size))
+    columns = typed_event_columns(collection_name, sample)
+    converters = [(field, TYPED_CONVERTERS[column_type]) for field, column_type in columns.items()]
+
+    schema_path = os.path.splitext(path)[0] + ".schema.json"
+    with open(schema_path, "w") as file:
+        json.dump([{"name": "id", "type": "string"}] +
+                  [{"name": field, "type": column_type} for field, column_type in columns.items()], file, indent=2)
+
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id"] + list(columns))
+        for event in chain(sample, events):
+            try:
+                values = dict(flatten_fields(event.to_dict()))
+                row = [event.id]
+                for field, convert in converters:
+                    value = values.get(field)
+                    row.append("" if value is None else convert(value))
+                writer.writerow(row)
+            except Exception as e:
+                print(f"Error processing event {event.id} in {collection_name}: {e}")
+
+def fetch_and_write_typed_csv():
+    """Export each event collection to its own typed CSV under outputs/typed."""
+    try:
+        os.makedirs(TYPED_OUTPUT_DIRECTORY, exist_ok=True)
+
+        for collection_name in EVENT_TYPES:
+            path = os.path.join(TYPED_OUTPUT_DIRECTORY, f"{collection_name}.csv")
+            write_typed_events_csv(collection_name, get_firestore_client().collection(collection_name).stream(), path)
+            print(f"Exported {collection_name} to {path}")
+
+    except Exception as e:
+        print(f"Error exporting typed CSVs: {e}")
+
+def collection_writers():
+    """(collection name, CSV writer) pairs in export order."""
+    writers = [
+        ("users", write_users_csv),
+        ("dogs", write_dogs_csv),
+    ]
+    for event_type in EVENT_TYPES:
+        writers.append((event_type, partial(write_events_csv, event_type)))
+    return writers
+
+def fetch_and_write_csv(compression=None, lean=False):
+    """
+    Export every collection to its CSV.
+
+    With lean, the event collections are exported first and each event's
+    dogId is collected as it streams past; dogs are then read without their
+    *EventIds arrays (a select() projection) and the Event IDs columns are
+    filled from the collected IDs.
+    """
     try:
         ensure_output_directory()
+        writers = collection_writers()
+        event_ids = EventIdCollector()
+        if lean:
+            writers = [writer for writer in writers if writer[0] in EVENT_TYPES] + \
+                      [writer for writer in writers if writer[0] not in EVENT_TYPES]
 
-        # Fetch users
-        users_ref = db.collection("users").stream()
-        with open("app/scripts/outputs/users.csv", "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["User ID", "Full Name", "Email", "ZIP Code", "Dog IDs", "CreatedAt", "UpdatedAt"])
-            for user in users_ref:
-                try:
-                    user_data = user.to_dict()
-                    full_name = user_data.get("full_name", "")
-                    if not full_name:
-                        continue
-
-                    email = user_data.get("email", "")
-                    zip_code = user_data.get("address", {}).get("zip", "")
-
-                    # Handle createdAt and updatedAt
-                    created_at = format_timestamp(user_data.get("createdAt"))
-                    updated_at = format_timestamp(user_data.get("updatedAt"))
-
-                    # Process Dog IDs
-                    dog_ids = ",".join(
-                        [dog.path if isinstance(dog, firestore.DocumentReference) else str(dog) for dog in user_data.get("dogList", [])]
-                    ) if "dogList" in user_data else ""
-
-                    writer.writerow([user.id, full_name, email, zip_code, dog_ids, created_at, updated_at])
-                except Exception as e:
-                    print(f"Error processing user {user.id}: {e}")
-
-        # Fetch dogs
-        dogs_ref = db.collection("dogs").stream()
-        with open("app/scripts/outputs/dogs.csv", "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Dog ID", "Name", "Age", "Breed", "Sex", "Weight", "Birthday", "User IDs",
-                             "Behavior Event IDs", "Diet Event IDs", "Exercise Event IDs", "Health Event IDs", "CreatedAt", "UpdatedAt"])
-            for dog in dogs_ref:
-                try:
-                    dog_data = dog.to_dict()
-                    name = dog_data.get("name", "")
-                    age = dog_data.get("age", "")
-                    breed = dog_data.get("breed", "")
-                    sex = dog_data.get("sex", "")
-                    weight = dog_data.get("weight", "")
-
-                    # Handle birthday, createdAt, and updatedAt
-                    birthday = format_timestamp(dog_data.get("birthday"))
-                    created_at = format_timestamp(dog_data.get("createdAt"))
-                    updated_at = format_timestamp(dog_data.get("updatedAt"))
-
-                    # Convert Firestore DocumentReferences to paths for users
-                    raw_users = dog_data.get("users", [])
-                    user_ids = ",".join(
-                        [user.path if isinstance(user, firestore.DocumentReference) else str(user) for user in raw_users]
-                    )
-
-                    # Process individual event fields
-                    behavior_event_ids = ",".join(
-                        [event.path if isinstance(event, firestore.DocumentReference) else str(event)
-                         for event in dog_data.get("behaviorEventIds", [])]
-                    )
-                    diet_event_ids = ",".join(
-                        [event.path if isinstance(event, firestore.DocumentReference) else str(event)
-                         for event in dog_data.get("dietEventIds", [])]
-                    )
-                    exercise_event_ids = ",".join(
-                        [event.path if isinstance(event, firestore.DocumentReference) else str(event)
-                         for event in dog_data.get("exerciseEventIds", [])]
-                    )
-                    health_event_ids = ",".join(
-                        [event.path if isinstance(event, firestore.DocumentReference) else str(event)
-                         for event in dog_data.get("healthEventIds", [])]
-                    )
-
-                    # Write to CSV
-                    writer.writerow([dog.id, name, age, breed, sex, weight, birthday, user_ids,
-                                     behavior_event_ids, diet_event_ids, exercise_event_ids, health_event_ids,
-                                     created_at, updated_at])
-                except Exception as e:
-                    print(f"Error processing dog {dog.id}: {e}")
-
-        # Fetch events for each type and create individual CSVs
-        event_types = {
-            "behaviorEvents": ["Event ID", "User ID", "Dog ID", "CreatedAt", "UpdatedAt", "Details"],
-            "dietEvents": ["Event ID", "User ID", "Dog ID", "CreatedAt", "UpdatedAt", "Details"],
-            "exerciseEvents": ["Event ID", "User ID", "Dog ID", "CreatedAt", "UpdatedAt", "Details"],
-            "healthEvents": ["Event ID", "User ID", "Dog ID", "CreatedAt", "UpdatedAt", "Details"]
-        }
-
-        for event_type, headers in event_types.items():
-            with open(f"app/scripts/outputs/{event_type}.csv", "w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(headers)
-
-                events_ref = db.collection(event_type).stream()
-                for event in events_ref:
-                    try:
-                        event_data = event.to_dict()
-
-                        # Extract createdAt and updatedAt from the event data
-                        created_at = format_timestamp(event_data.get("createdAt"))
-                        updated_at = format_timestamp(event_data.get("updatedAt"))
-
-                        # Remove createdAt and updatedAt from the details
-                        event_data.pop("createdAt", None)
-                        event_data.pop("updatedAt", None)
-
-                        # Convert Firestore references to string paths
-                        user_id = event_data.get("userId")
-                        if isinstance(user_id, firestore.DocumentReference):
-                            user_id = user_id.path
-
-                        dog_id = event_data.get("dogId")
-                        if isinstance(dog_id, firestore.DocumentReference):
-                            dog_id = dog_id.path
-
-                        # Add 'type' as the first item in Details
-                        event_type_field = f"type: {event_data.get('type', '')}"
-                        event_data.pop("type", None)  # Remove it from the remaining fields
-
-                        # Extract remaining details
-                        details = ", ".join(
-                            [event_type_field] + 
-                            [f"{key}: {value}" for key, value in event_data.items() if key not in ["userId", "dogId"]]
-                        )
-                        writer.writerow([event.id, user_id, dog_id, created_at, updated_at, details])
-                    except Exception as e:
-                        print(f"Error processing event {event.id} in {event_type}: {e}")
+        for collection_name, write_csv in writers:
+            with span("export", collection=collection_name):
+                collection_ref = get_firestore_client().collection(collection_name)
+                if lean and collection_name == "dogs":
+                    docs = (DocumentWithFields(dog, event_ids.fields(dog.id)) for dog in collection_ref.select(DOG_FIELDS).stream())
+                elif lean and collection_name in EVENT_TYPES:
+                    docs = event_ids.track(collection_name, collection_ref.stream())
+                else:
+                    docs = collection_ref.stream()
+                write_csv(counted(docs, "docs_read", collection=collection_name), f"app/scripts/outputs/{collection_name}.csv",
+                          compression=compression)
 
         print("Firebase data successfully exported to individual CSV files.")
 
     except Exception as e:
         print(f"Error exporting data to CSV: {e}")
 
+def fetch_and_write_csv_incremental():
+    """
+    Export only documents updated since the last run into per-collection delta CSVs.
+
+    Collections without a stored watermark get a full snapshot first.
+    """
+    try:
+        ensure_output_directory()
+        watermarks = load_watermarks(WATERMARK_FILE)
+
+        for collection_name, write_csv in collection_writers():
+            snapshot_path = f"app/scripts/outputs/{collection_name}.csv"
+            collection_ref = get_firestore_client().collection(collection_name)
+            watermark = watermarks.get(collection_name)
+            tracker = WatermarkTracker(watermark)
+
+            if watermark is None or not os.path.exists(snapshot_path):
+                path, docs = snapshot_path, collection_ref.stream()
+            else:
+                path, docs = delta_path(collection_name, "csv"), incremental_stream(collection_ref, watermark)
+
+            write_csv(tracker.track(docs), path)
+            watermarks[collection_name] = tracker.watermark
+            save_watermarks(watermarks, WATERMARK_FILE)
+            print(f"Exported {collection_name} changes to {path}")
+
+        print("Firebase changes successfully exported to CSV files.")
+
+    except Exception as e:
+        print(f"Error exporting changes to CSV: {e}")
+
+def compact_csv_deltas():
+    """Merge pending delta CSVs into the per-collection snapshots."""
+    for collection_name, _ in collection_writers():
+        count = compact_csv(f"app/scripts/outputs/{collection_name}.csv", collection_name)
+        if count is not None:
+            print(f"Compacted {collection_name}.csv into {count} rows")
+
 if __name__ == "__main__":
-    fetch_and_write_csv()
+    parser = argparse.ArgumentParser(description="Export Firestore collections straight to CSV.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true", help="Export only documents updated since the last run into delta CSVs")
+    mode.add_argument("--compact", action="store_true", help="Merge pending delta CSVs into the snapshots")
+    mode.add_argument("--typed", action="store_true", help="Write each event collection with one typed column per field to outputs/typed")
+    parser.add_argument("--lean", action="store_true", help="Skip the dogs' *EventIds arrays and rebuild them from the events")
+    parser.add_argument("--compress", type=compression_codec, default=None, metavar="{" + ",".join(COMPRESSION_SUFFIXES) + "}",
+                        help="Compress the CSV files as they are written and name them by content hash")
+    args = parser.parse_args()
+    if (args.lean or args.compress) and (args.incremental or args.compact or args.typed):
+        parser.error("--lean and --compress only apply to the full export")
+
+    if args.compact:
+        compact_csv_deltas()
+    elif args.typed:
+        fetch_and_write_typed_csv()
+    elif args.incremental:
+        fetch_and_write_csv_incremental()
+    else:
+        fetch_and_write_csv(args.compress, lean=args.lean)
+    write_run_report("firebase_to_csv_direct")
@@ -0,0 +1,161 @@
+import base64
+import logging
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound
+from connections import get_storage_client
+from metrics import count, timed
+from output_files import CONTENT_ADDRESSED_NAME, MANIFEST_NAME, content_versions, is_content_addressed, manifest_path
+
+# Files at least this large are split into parts uploaded in parallel and composed
+PARALLEL_UPLOAD_THRESHOLD = 64 * 1024 * 1024
+# Smallest part size; parts are grown so a file never needs more than MAX_PARTS
+MIN_PART_SIZE = 16 * 1024 * 1024
+# GCS compose accepts at most 32 source objects
+MAX_PARTS = 32
+# Resumable session chunk size, must be a multiple of 256 KiB
+CHUNK_SIZE = 8 * 1024 * 1024
+# Concurrent file (and part) uploads
+MAX_UPLOAD_WORKERS = 8
+# Read size used while checksumming local files
+READ_SIZE = 1024 * 1024
+
+def local_crc32c(local_file_path, offset=0, size=None):
+    """Base64 CRC32C of a file (or a byte range of it), as reported by GCS."""
+    import google_crc32c
+
+    checksum = google_crc32c.Checksum()
+    remaining = os.path.getsize(local_file_path) - offset if size is None else size
+    with open(local_file_path, "rb") as f:
+        f.seek(offset)
+        while remaining > 0:
+            chunk = f.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            checksum.update(chunk)
+            remaining -= len(chunk)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+def remote_matches(blob, crc32c):
+    """
+    True if the blob exists and already has the given CRC32C.
+
+    CRC32C is used rather than MD5 because composed objects have no MD5 hash.
+    """
+    try:
+        blob.reload()
+    except NotFound:
+        return False
+    return blob.crc32c == crc32c
+
+def upload_file(local_file_path, bucket_name, destination_blob_name):
+    """
+    Upload a file unless the remote blob already has the same contents.
+
+    A content-addressed name (see output_files) changes whenever the contents
+    do, so for those an existing blob is enough and the file is not checksummed.
+
+    Large files are uploaded as parallel resumable parts and composed into the
+    destination. Parts that already exist with a matching checksum are not sent
+    again, so rerunning after a dropped connection resumes from the missing parts.
+    Returns True if the file was uploaded, False if it was skipped.
+    """
+    bucket = get_storage_client().bucket(bucket_name)
+    blob = bucket.blob(destination_blob_name)
+    if is_content_addressed(destination_blob_name):
+        up_to_date = blob.exists()
+    else:
+        up_to_date = remote_matches(blob, local_crc32c(local_file_path))
+
+    if up_to_date:
+        logging.info(f"Skipping {local_file_path}: gs://{bucket_name}/{destination_blob_name} is up to date")
+        count("uploads_skipped")
+        return False
+
+    size = os.path.getsize(local_file_path)
+    with timed("rpc_seconds", rpc="gcs_upload"):
+        if size < PARALLEL_UPLOAD_THRESHOLD:
+            blob.chunk_size = CHUNK_SIZE
+            blob.upload_from_filename(local_file_path, checksum="crc32c")
+        else:
+            upload_in_parts(local_file_path, bucket, blob, size)
+    count("files_uploaded")
+    count("bytes_uploaded", size)
+
+    logging.info(f"File {local_file_path} successfully uploaded to gs://{bucket_name}/{destination_blob_name}")
+    return True
+
+def upload_in_parts(local_file_path, bucket, blob, size):
+    """Upload byte ranges of a file as temporary part blobs in parallel, then compose them."""
+    part_size = max(MIN_PART_SIZE, -(-size // MAX_PARTS))
+    offsets = list(range(0, size, part_size))
+    parts = [bucket.blob(f"{blob.name}.parts/{index:05d}") for index in range(len(offsets))]
+
+    def upload_part(index):
+        part = parts[index]
+        length = min(part_size, size - offsets[index])
+        if remote_matches(part, local_crc32c(local_file_path, offsets[index], length)):
+            return
+        part.chunk_size = CHUNK_SIZE
+        with open(local_file_path, "rb") as f:
+            f.seek(offsets[index])
+            part.upload_from_file(f, size=length, checksum="crc32c")
+
+    with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+        list(executor.map(upload_part, range(len(parts))))
+
+    blob.compose(parts)
+    for part in parts:
+        part.delete()
+
+def delete_superseded(bucket_name, blob_name):
+    """Delete the other versions of a content-addressed blob, e.g. the one its local file replaced. Returns how many."""
+    pattern = content_versions(blob_name)
+    bucket = get_storage_client().bucket(bucket_name)
+    deleted = 0
+    # Every version shares the name up to the hash
+    for blob in bucket.list_blobs(prefix=blob_name[:CONTENT_ADDRESSED_NAME.search(blob_name).start()]):
+        if blob.name != blob_name and pattern.fullmatch(blob.name):
+            blob.delete()
+            logging.info(f"Deleted superseded gs://{bucket_name}/{blob.name}")
+            deleted += 1
+    count("blobs_deleted", deleted)
+    return deleted
+
+def publish_content_manifest(directory, uploads):
+    """
+    After content-addressed outputs of directory were uploaded as (local path,
+    bucket name, destination blob name) triples, upload the directory's manifest
+    next to them so readers of the bucket can find the current files, then
+    delete the versions they replace. Plain uploads are ignored. Returns the
+    number of blobs deleted.
+    """
+    uploads = [(bucket_name, blob_name) for _, bucket_name, blob_name in uploads if is_content_addressed(blob_name)]
+    if not uploads:
+        return 0
+    for bucket_name, folder in sorted({(bucket_name, posixpath.dirname(blob_name)) for bucket_name, blob_name in uploads}):
+        upload_file(manifest_path(directory), bucket_name, posixpath.join(folder, MANIFEST_NAME))
+    # Only once the manifest points at the new versions are the old ones removed
+    return sum(delete_superseded(bucket_name, blob_name) for bucket_name, blob_name in uploads)
+
+def upload_files(uploads, max_workers=MAX_UPLOAD_WORKERS, skipped=None):
+    """
+    Upload (local path, bucket name, destination blob name) triples concurrently.
+
+    Failures are logged and do not stop the remaining uploads. Returns the
+    list of local paths that failed. Paths not uploaded because their blob
+    was already up to date are appended to skipped, if given.
+    """
+    def upload(item):
+        local_file_path, bucket_name, destination_blob_name = item
+        try:
+            if not upload_file(local_file_path, bucket_name, destination_blob_name) and skipped is not None:
+                skipped.append(local_file_path)
+        except Exception as e:
+            logging.error(f"Failed to upload file {local_file_path} to GCS: {e}")
+            return local_file_path
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [path for path in executor.map(upload, uploads) if path is not None]
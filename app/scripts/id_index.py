@@ -0,0 +1,128 @@
+import argparse
+import json
+import logging
+import os
+import numpy as np
+from output_files import open_input, resolve_output
+
+# Exported JSONL files the indexes are built from, and where the indexes are stored
+JSONL_DIRECTORY = "app/scripts/outputs"
+INDEX_DIRECTORY = "app/scripts/outputs/id_index"
+
+# Collections joins and rollups resolve references against
+INDEXED_COLLECTIONS = ["users", "dogs"]
+
+def encode_ids(ids):
+    """IDs as a fixed-width byte array, taking the fast ASCII path when possible."""
+    if isinstance(ids, np.ndarray) and ids.dtype.kind == "S":
+        return ids
+    try:
+        return np.array(ids, dtype="S")
+    except UnicodeEncodeError:
+        return np.char.encode(np.array(ids, dtype=str), "utf-8")
+
+class IdIndex:
+    """
+    Interns Firestore document IDs as dense integer keys.
+
+    The IDs are kept as one sorted fixed-width byte array, saved as .npy and
+    memory-mapped when loaded, so an index over millions of IDs costs no heap
+    and opens instantly. A document's key is its position in the array;
+    lookups are vectorized binary searches.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    @classmethod
+    def build(cls, ids, path=None):
+        """Index an iterable of ID strings, saving it to path if given."""
+        values = np.unique(encode_ids(list(ids)))
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.save(path, values)
+        return cls(values)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path, mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, ids):
+        """Keys of a sequence of IDs; -1 for IDs not in the index."""
+        values = encode_ids(ids)
+        if len(self.ids) == 0:
+            return np.full(values.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, values), len(self.ids) - 1)
+        return np.where(self.ids[positions] == values, positions, -1)
+
+    def key(self, doc_id):
+        return int(self.lookup([doc_id])[0])
+
+    def id_strings(self):
+        """All indexed IDs as Python strings, in key order."""
+        return np.char.decode(np.asarray(self.ids), "utf-8").tolist()
+
+def index_path(collection_name, index_directory=INDEX_DIRECTORY):
+    return os.path.join(index_directory, f"{collection_name}.npy")
+
+def source_path(collection_name, index_directory=INDEX_DIRECTORY):
+    return os.path.join(index_directory, f"{collection_name}.source.json")
+
+def source_stamp(jsonl_path):
+    """Name, size and modification time of the export an index is built from, or None if there is none."""
+    path = resolve_output(jsonl_path)
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return {"file": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def iter_jsonl_ids(file_path):
+    with open_input(file_path) as file:
+        for line in file:
+            yield json.loads(line)["id"]
+
+def build_id_indexes(collections=INDEXED_COLLECTIONS, jsonl_directory=JSONL_DIRECTORY, index_directory=INDEX_DIRECTORY):
+    """
+    Build and save the ID index of each collection from its JSONL export, with
+    the stamp of the export it was built from. Returns {collection: IdIndex}.
+    """
+    indexes = {}
+    for collection_name in collections:
+        jsonl_path = os.path.join(jsonl_directory, f"{collection_name}.jsonl")
+        # Stamped before reading: an export rewritten meanwhile no longer matches and is re-indexed
+        stamp = source_stamp(jsonl_path)
+        indexes[collection_name] = IdIndex.build(iter_jsonl_ids(jsonl_path), index_path(collection_name, index_directory))
+        with open(source_path(collection_name, index_directory), "w") as file:
+            json.dump(stamp, file)
+        logging.info(f"Indexed {len(indexes[collection_name])} {collection_name} IDs")
+    return indexes
+
+def load_id_indexes(collections=INDEXED_COLLECTIONS, jsonl_directory=JSONL_DIRECTORY, index_directory=INDEX_DIRECTORY):
+    """
+    Memory-map the saved indexes, or return None if any of them is missing or
+    was built from a different version of its export than the current one.
+    """
+    indexes = {}
+    for collection_name in collections:
+        path = index_path(collection_name, index_directory)
+        stamp_file = source_path(collection_name, index_directory)
+        if not (os.path.exists(path) and os.path.exists(stamp_file)):
+            return None
+        with open(stamp_file, "r") as file:
+            stamp = json.load(file)
+        if stamp is None or stamp != source_stamp(os.path.join(jsonl_directory, f"{collection_name}.jsonl")):
+            logging.info(f"ID index of {collection_name} is older than its export")
+            return None
+        indexes[collection_name] = IdIndex.load(path)
+    return indexes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dense ID indexes of exported collections.")
+    parser.add_argument("--collections", default=",".join(INDEXED_COLLECTIONS), help="Comma-separated collections to index")
+    args = parser.parse_args()
+
+    for collection_name, index in build_id_indexes(args.collections.split(",")).items():
+        print(f"{collection_name}: {len(index)} IDs -> {index_path(collection_name)}")
@@ -0,0 +1,160 @@
+import csv
+import glob
+import json
+import os
+from datetime import datetime, timezone
+from itertools import chain
+
+# Field used to detect changed documents
+WATERMARK_FIELD = "updatedAt"
+
+# Directory holding delta files, one subdirectory per collection
+DELTA_DIRECTORY = "app/scripts/outputs/deltas"
+
+# Lower bound used for timestamp watermarks that have not been seen yet
+MIN_TIMESTAMP = datetime(1, 1, 1, tzinfo=timezone.utc)
+
+def load_watermarks(path):
+    """Load per-collection watermarks, or an empty dict on the first run."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_watermarks(watermarks, path):
+    """Atomically persist per-collection watermarks."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=4)
+    os.replace(tmp_path, path)
+
+def incremental_stream(collection_ref, watermark):
+    """
+    Stream only documents whose updatedAt is newer than the stored watermark.
+
+    updatedAt is a Timestamp on some documents and an ISO 8601 string on
+    others, and Firestore range filters only match values of the filter's own
+    type, so one query is issued per type. Deleted documents are not seen.
+    """
+    from google.cloud.firestore import FieldFilter
+
+    watermark = watermark or {}
+    timestamp_value = watermark.get("timestamp")
+    timestamp_value = datetime.fromisoformat(timestamp_value) if timestamp_value else MIN_TIMESTAMP
+    string_value = watermark.get("string", "")
+    return chain(
+        collection_ref.where(filter=FieldFilter(WATERMARK_FIELD, ">", timestamp_value)).stream(),
+        collection_ref.where(filter=FieldFilter(WATERMARK_FIELD, ">", string_value)).stream(),
+    )
+
+class WatermarkTracker:
+    """Records the highest updatedAt seen while documents stream past."""
+
+    def __init__(self, watermark=None):
+        watermark = watermark or {}
+        self.timestamp = datetime.fromisoformat(watermark["timestamp"]) if "timestamp" in watermark else None
+        self.string = watermark.get("string")
+
+    def track(self, docs):
+        for doc in docs:
+            try:
+                self.observe(doc.get(WATERMARK_FIELD))
+            except KeyError:
+                pass
+            yield doc
+
+    def observe(self, value):
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            if self.timestamp is None or value > self.timestamp:
+                self.timestamp = value
+        elif isinstance(value, str) and value:
+            if self.string is None or value > self.string:
+                self.string = value
+
+    @property
+    def watermark(self):
+        watermark = {}
+        if self.timestamp is not None:
+            watermark["timestamp"] = self.timestamp.isoformat()
+        if self.string is not None:
+            watermark["string"] = self.string
+        return watermark
+
+def delta_path(collection_name, extension):
+    """Path for a new delta file of a collection, named by the UTC run time."""
+    directory = os.path.join(DELTA_DIRECTORY, collection_name)
+    os.makedirs(directory, exist_ok=True)
+    run_stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return os.path.join(directory, f"{collection_name}-{run_stamp}.{extension}")
+
+def pending_deltas(collection_name, extension):
+    """Delta files of a collection in the order they were written."""
+    return sorted(glob.glob(os.path.join(DELTA_DIRECTORY, collection_name, f"{collection_name}-*.{extension}")))
+
+def compact_jsonl(snapshot_path, collection_name):
+    """
+    Merge pending JSONL deltas into the snapshot, newest version of each id wins.
+
+    Only the deltas are held in memory; the snapshot is streamed record by
+    record. Merged delta files are removed. Returns the number of records in
+    the new snapshot, or None if there was nothing to merge.
+    """
+    def read(f):
+        for line in f:
+            yield json.loads(line)["id"], line
+
+    def write(out, line):
+        out.write(line)
+
+    return _compact(snapshot_path, pending_deltas(collection_name, "jsonl"), read, write, header=False)
+
+def compact_csv(snapshot_path, collection_name):
+    """Merge pending CSV deltas into the snapshot, keyed on the first (ID) column."""
+    def read(f):
+        for row in csv.reader(f):
+            yield row[0], row
+
+    def write(out, row):
+        csv.writer(out).writerow(row)
+
+    return _compact(snapshot_path, pending_deltas(collection_name, "csv"), read, write, header=True)
+
+def _compact(snapshot_path, deltas, read, write, header):
+    if not deltas:
+        return None
+
+    changed = {}
+    header_row = None
+    for path in deltas:
+        with open(path, "r", newline="") as f:
+            records = read(f)
+            if header:
+                header_row = next(records, (None, None))[1]
+            for key, record in records:
+                changed[key] = record
+
+    count = 0
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "w", newline="") as out:
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", newline="") as f:
+                records = read(f)
+                if header:
+                    header_row = next(records, (None, header_row))[1]
+                    write(out, header_row)
+                    header_row = None
+                for key, record in records:
+                    write(out, changed.pop(key, record))
+                    count += 1
+        if header_row:
+            write(out, header_row)
+        for record in changed.values():
+            write(out, record)
+            count += 1
+    os.replace(tmp_path, snapshot_path)
+
+    for path in deltas:
+        os.remove(path)
+    return count
@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import time
+import numpy as np
+from id_index import IdIndex
+from output_files import open_input, resolve_output
+
+# Exported JSONL (or generated Parquet) files to check, and where results go
+INPUT_DIRECTORY = "app/scripts/outputs"
+REPORT_FILE = "app/scripts/outputs/integrity_report.json"
+REPAIR_PLAN_FILE = "app/scripts/outputs/integrity_repair_plan.jsonl"
+
+EVENT_TYPES = ["behavior", "diet", "exercise", "health"]
+
+# Example documents listed per finding in the report
+EXAMPLE_COUNT = 20
+# Repair operations per batch commit
+BATCH_SIZE = 500
+
+def bare_id(value):
+    return value.split("/")[-1] if isinstance(value, str) else ""
+
+def read_records(collection_name, fields, directory=INPUT_DIRECTORY):
+    """
+    Columns {field: list} of a collection, from its JSONL export or, failing
+    that, its Parquet file. Returns None if neither exists.
+    """
+    jsonl_path = os.path.join(directory, f"{collection_name}.jsonl")
+    parquet_path = os.path.join(directory, f"{collection_name}.parquet")
+    if resolve_output(jsonl_path):
+        columns = {field: [] for field in ["id", *fields]}
+        with open_input(jsonl_path) as file:
+            for line in file:
+                record = json.loads(line)
+                for field, values in columns.items():
+                    values.append(record.get(field))
+        return columns
+    if os.path.exists(parquet_path):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(parquet_path)
+        return {field: table.column(field).to_pylist() if field in table.column_names else [None] * table.num_rows
+                for field in ["id", *fields]}
+    logging.warning(f"No export found for {collection_name} in {directory}")
+    return None
+
+def flatten_links(lists):
+    """(owner positions, bare target IDs) of a column of reference lists."""
+    owners = []
+    targets = []
+    for position, values in enumerate(lists):
+        for value in values or []:
+            owners.append(position)
+            targets.append(bare_id(value))
+    return np.array(owners, dtype=np.int64), targets
+
+class Finding:
+    """Offending {"collection", "id", "field", "value"} entries of one check."""
+
+    def __init__(self, description):
+        self.description = description
+        self.entries = []
+
+    def extend(self, collection, field, doc_ids, values):
+        self.entries.extend({"collection": collection, "id": doc_id, "field": field, "value": value}
+                            for doc_id, value in zip(doc_ids, values))
+
+    def summary(self):
+        return {"description": self.description, "count": len(self.entries), "examples": self.entries[:EXAMPLE_COUNT]}
+
+def check_integrity(directory=INPUT_DIRECTORY):
+    """
+    Check every relationship the seeder writes in both directions.
+
+    Document IDs are interned with IdIndex, each relationship becomes an
+    array of (source key, target key) pairs encoded as one int64, and the
+    checks are vectorized set operations on those arrays. Returns
+    ({finding name: Finding}, {collection: document count}).
+    """
+    users = read_records("users", ["dogList"], directory)
+    dogs = read_records("dogs", ["users"] + [f"{event_type}EventIds" for event_type in EVENT_TYPES], directory)
+    if users is None or dogs is None:
+        raise FileNotFoundError(f"users and dogs exports are required in {directory}")
+    events = {event_type: read_records(f"{event_type}Events", ["dogId", "userId"], directory) for event_type in EVENT_TYPES}
+    events = {event_type: columns for event_type, columns in events.items() if columns is not None}
+
+    user_ids = np.array(users["id"], dtype=object)
+    dog_ids = np.array(dogs["id"], dtype=object)
+    user_index = IdIndex.build(users["id"])
+    dog_index = IdIndex.build(dogs["id"])
+    user_keys = user_index.lookup(users["id"])
+    dog_keys = dog_index.lookup(dogs["id"])
+    dog_count = max(len(dog_index), 1)
+
+    findings = {}
+
+    def record(name, collection, field, description, doc_ids, values):
+        findings.setdefault(name, Finding(description)).extend(collection, field, doc_ids, values)
+
+    # users.dogList <-> dogs.users
+    owners, targets = flatten_links(users["dogList"])
+    listed_dogs = dog_index.lookup(targets)
+    dangling = listed_dogs < 0
+    record("dangling_user_dogs", "users", "dogList", "users.dogList entries whose dog does not exist",
+           user_ids[owners[dangling]].tolist(), [f"dogs/{target}" for target, bad in zip(targets, dangling) if bad])
+    user_dog_pairs = user_keys[owners[~dangling]] * dog_count + listed_dogs[~dangling]
+
+    owners, targets = flatten_links(dogs["users"])
+    listed_users = user_index.lookup(targets)
+    dangling = listed_users < 0
+    record("dangling_dog_users", "dogs", "users", "dogs.users entries whose user does not exist",
+           dog_ids[owners[dangling]].tolist(), [f"users/{target}" for target, bad in zip(targets, dangling) if bad])
+    dog_user_owners = owners[~dangling]
+    dog_user_pairs = listed_users[~dangling] * dog_count + dog_keys[dog_user_owners]
+
+    missing_back = ~np.isin(user_dog_pairs, dog_user_pairs)
+    record("user_dog_not_linked_back", "dogs", "users", "users.dogList entries whose dog does not list the user in dogs.users",
+           dog_index.ids[user_dog_pairs[missing_back] % dog_count].astype(str).tolist(),
+           [f"users/{user_id}" for user_id in user_index.ids[user_dog_pairs[missing_back] // dog_count].astype(str)])
+    missing_back = ~np.isin(dog_user_pairs, user_dog_pairs)
+    record("dog_user_not_linked_back", "users", "dogList", "dogs.users entries whose user does not list the dog in users.dogList",
+           user_index.ids[dog_user_pairs[missing_back] // dog_count].astype(str).tolist(),
+           [f"dogs/{dog_id}" for dog_id in dog_index.ids[dog_user_pairs[missing_back] % dog_count].astype(str)])
+
+    # dogs.*EventIds <-> events.dogId, and events.userId
+    for event_type, columns in events.items():
+        collection_name = f"{event_type}Events"
+        field = f"{event_type}EventIds"
+        event_ids = np.array(columns["id"], dtype=object)
+        event_index = IdIndex.build(columns["id"])
+        event_keys = event_index.lookup(columns["id"])
+        event_count = max(len(event_index), 1)
+
+        event_dogs = dog_index.lookup([bare_id(value) for value in columns["dogId"]])
+        orphaned = event_dogs < 0
+        record("orphaned_events", collection_name, "dogId", "Events whose dogId does not exist",
+               event_ids[orphaned].tolist(), [columns["dogId"][position] for position in np.flatnonzero(orphaned)])
+        event_users = user_index.lookup([bare_id(value) for value in columns["userId"]])
+        unknown_user = event_users < 0
+        record("events_with_missing_user", collection_name, "userId", "Events whose userId does not exist",
+               event_ids[unknown_user].tolist(), [columns["userId"][position] for position in np.flatnonzero(unknown_user)])
+
+        # An event's user should be one of its dog's users
+        linked = ~orphaned & ~unknown_user
+        mismatched = np.zeros(len(event_ids), dtype=bool)
+        mismatched[linked] = ~np.isin(event_users[linked] * dog_count + event_dogs[linked], dog_user_pairs)
+        record("event_user_not_dog_user", collection_name, "userId", "Events whose userId is not among their dog's users",
+               event_ids[mismatched].tolist(), [columns["userId"][position] for position in np.flatnonzero(mismatched)])
+
+        if dogs[field] and all(value is None for value in dogs[field]):
+            # A dogs export without the arrays, such as a lean one, would flag every event as unlisted
+            logging.warning(f"dogs export has no {field}, skipping the dog <-> {collection_name} checks")
+            continue
+        owners, targets = flatten_links(dogs[field])
+        listed_events = event_index.lookup(targets)
+        dangling = listed_events < 0
+        record("dangling_dog_events", "dogs", field, "dogs.*EventIds entries whose event does not exist",
+               dog_ids[owners[dangling]].tolist(), [f"{collection_name}/{target}" for target, bad in zip(targets, dangling) if bad])
+        dog_event_pairs = dog_keys[owners[~dangling]] * event_count + listed_events[~dangling]
+        event_dog_pairs = event_dogs[~orphaned] * event_count + event_keys[~orphaned]
+
+        # The event's own dogId is taken as the truth for the dog <-> event link
+        wrong_dog = ~np.isin(dog_event_pairs, event_dog_pairs)
+        record("dog_event_points_elsewhere", "dogs", field, "dogs.*EventIds entries whose event has a different dogId",
+               dog_index.ids[dog_event_pairs[wrong_dog] // event_count].astype(str).tolist(),
+               [f"{collection_name}/{event_id}" for event_id in event_index.ids[dog_event_pairs[wrong_dog] % event_count].astype(str)])
+        unlisted = ~np.isin(event_dog_pairs, dog_event_pairs)
+        record("event_not_listed_on_dog", "dogs", field, "Events missing from their dog's *EventIds array",
+               dog_index.ids[event_dog_pairs[unlisted] // event_count].astype(str).tolist(),
+               [f"{collection_name}/{event_id}" for event_id in event_index.ids[event_dog_pairs[unlisted] % event_count].astype(str)])
+
+    counts = {"users": len(user_ids), "dogs": len(dog_ids)}
+    counts.update((f"{event_type}Events", len(columns["id"])) for event_type, columns in events.items())
+    return findings, counts
+
+# Finding -> repair operation; findings not listed are only reported
+REPAIRS = {
+    "dangling_user_dogs": "array_remove",
+    "dangling_dog_users": "array_remove",
+    "dangling_dog_events": "array_remove",
+    "dog_event_points_elsewhere": "array_remove",
+    "user_dog_not_linked_back": "array_union",
+    "dog_user_not_linked_back": "array_union",
+    "event_not_listed_on_dog": "array_union",
+    "orphaned_events": "delete",
+}
+
+def write_repair_plan(findings, path=REPAIR_PLAN_FILE):
+    """Write one JSON operation per line for apply_repair_plan. Returns the number of operations."""
+    count = 0
+    with open(path, "w") as file:
+        for name, op in REPAIRS.items():
+            finding = findings.get(name)
+            if finding is None:
+                continue
+            for entry in finding.entries:
+                operation = {"op": op, "collection": entry["collection"], "id": entry["id"]}
+                if op != "delete":
+                    operation.update(field=entry["field"], value=entry["value"])
+                file.write(json.dumps(operation) + "\n")
+                count += 1
+    return count
+
+def apply_repair_plan(path=REPAIR_PLAN_FILE):
+    """Apply a repair plan through 500-op batch commits. Returns the number of operations applied."""
+    from google.cloud.firestore import ArrayRemove, ArrayUnion
+    from connections import get_firestore_client
+
+    db = get_firestore_client()
+    batch = db.batch()
+    pending = 0
+    applied = 0
+    with open(path, "r") as file:
+        for line in file:
+            operation = json.loads(line)
+            doc_ref = db.collection(operation["collection"]).document(operation["id"])
+            if operation["op"] == "delete":
+                batch.delete(doc_ref)
+            else:
+                transform = ArrayUnion if operation["op"] == "array_union" else ArrayRemove
+                batch.update(doc_ref, {operation["field"]: transform([db.document(operation["value"])])})
+            pending += 1
+            if pending == BATCH_SIZE:
+                batch.commit()
+                applied += pending
+                print(f"Applied {applied} repair operations")
+                batch = db.batch()
+                pending = 0
+    if pending:
+        batch.commit()
+        applied += pending
+    print(f"Applied {applied} repair operations from {path}")
+    return applied
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check relationships between exported users, dogs and events.")
+    parser.add_argument("--input-dir", default=INPUT_DIRECTORY, help="Directory with the JSONL exports (or generated Parquet files)")
+    parser.add_argument("--repair-plan", action="store_true", help=f"Also write the fixes to {REPAIR_PLAN_FILE}")
+    parser.add_argument("--apply", action="store_true", help="Apply an existing repair plan to Firestore instead of checking")
+    args = parser.parse_args()
+
+    if args.apply:
+        apply_repair_plan()
+    else:
+        start_time = time.monotonic()
+        findings, counts = check_integrity(args.input_dir)
+        report = {
+            "documents": counts,
+            "seconds": round(time.monotonic() - start_time, 2),
+            "findings": {name: finding.summary() for name, finding in findings.items()},
+        }
+        with open(REPORT_FILE, "w") as file:
+            json.dump(report, file, indent=2)
+        for name, finding in findings.items():
+            print(f"{name}: {len(finding.entries)}")
+        print(f"Checked {sum(counts.values())} documents in {report['seconds']}s, report written to {REPORT_FILE}")
+        if args.repair_plan:
+            print(f"Wrote {write_repair_plan(findings)} repair operations to {REPAIR_PLAN_FILE}")
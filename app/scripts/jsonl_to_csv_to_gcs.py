@@ -1,109 +1,404 @@
+import argparse
 import json
 import csv
 import os
-from google.cloud import storage
+import shutil
+from datetime import datetime, timezone
+from itertools import islice
+from gcs_upload import publish_content_manifest, upload_file, upload_files
+from metrics import count, span, write_run_report
+from output_files import COMPRESSION_SUFFIXES, compression_codec, open_input, open_output, resolve_output
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Change to DEBUG for more granular logs
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-
 # Paths and configurations
-JSONL_FILES = [
-    "app/scripts/outputs/users.jsonl",
-    "app/scripts/outputs/dogs.jsonl",
-    "app/scripts/outputs/healthEvents.jsonl",
-    "app/scripts/outputs/exerciseEvents.jsonl",
-    "app/scripts/outputs/dietEvents.jsonl"
-]
+USERS_JSONL = "app/scripts/outputs/users.jsonl"
+DOGS_JSONL = "app/scripts/outputs/dogs.jsonl"
+EVENT_JSONL_FILES = {
+    "health": "app/scripts/outputs/healthEvents.jsonl",
+    "exercise": "app/scripts/outputs/exerciseEvents.jsonl",
+    "diet": "app/scripts/outputs/dietEvents.jsonl",
+    "behavior": "app/scripts/outputs/behaviorEvents.jsonl"
+}
+CSV_HEADERS = ["user_id", "dog_id", "event_type", "event_timestamp", "dog_name", "dog_age", "dog_breed", "dog_sex", "dog_weight", "user_email", "user_name", "event_details"]
 OUTPUT_CSV = "app/scripts/outputs/dog_data.csv"
 GCS_BUCKET_NAME = "firestore-batch-boi"
 GCS_OUTPUT_FILE = "dog_data.csv"
+OUTPUT_PARQUET_DIRECTORY = "app/scripts/outputs/dog_data_parquet"
+GCS_PARQUET_PREFIX = "dog_data_parquet"
+PARQUET_ROW_GROUP_SIZE = 50_000
+# Rows buffered across all partitions before the largest buffer is flushed early
+PARQUET_BUFFERED_ROWS = 200_000
+# Events resolved per vectorized lookup in the ID-index join
+JOIN_CHUNK_SIZE = 50_000
 
 # Helper functions
-def load_jsonl(file_path):
-    """Loads JSONL data from a file."""
+def iter_jsonl(file_path):
+    """Streams JSONL records from a file (or its compressed version) one line at a time."""
     try:
-        with open(file_path, "r") as file:
-            return [json.loads(line) for line in file]
+        with open_input(file_path) as file:
+            for line in file:
+                yield json.loads(line)
     except Exception as e:
         logging.error(f"Error reading {file_path}: {e}")
-        return []
+
+def user_index_entry(user):
+    """The (email, name) pair of a user used in the output."""
+    return (user.get("email", "N/A"), user.get("name", "N/A"))
+
+def dog_index_entry(dog):
+    """The (owner user ID, name, age, breed, sex, weight) of a dog, without the event ID arrays."""
+    return (
+        (dog.get("users") or ["N/A"])[0].split("/")[-1],
+        dog.get("name", "N/A"),
+        dog.get("age", "N/A"),
+        dog.get("breed", "N/A"),
+        dog.get("sex", "N/A"),
+        dog.get("weight", "N/A")
+    )
+
+def build_user_index(file_path):
+    """Maps user ID to the (email, name) pair used in the output."""
+    return {user["id"]: user_index_entry(user) for user in iter_jsonl(file_path)}
+
+def build_dog_index(file_path):
+    """Maps dog ID to (owner user ID, name, age, breed, sex, weight), dropping the event ID arrays."""
+    return {dog["id"]: dog_index_entry(dog) for dog in iter_jsonl(file_path)}
 
 def upload_to_gcs(local_file_path, bucket_name, destination_blob_name):
-    """Uploads a file to Google Cloud Storage."""
+    """Uploads a file to Google Cloud Storage through the shared upload engine. Returns False if it failed."""
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(local_file_path)
-        logging.info(f"CSV file successfully uploaded to gs://{bucket_name}/{destination_blob_name}")
+        if upload_file(local_file_path, bucket_name, destination_blob_name):
+            logging.info(f"CSV file successfully uploaded to gs://{bucket_name}/{destination_blob_name}")
+        else:
+            logging.info(f"gs://{bucket_name}/{destination_blob_name} is up to date, CSV file not uploaded again")
+        return True
     except Exception as e:
         logging.error(f"Failed to upload file to GCS: {e}")
+        return False
 
 # Main processing
-def process_jsonl_to_csv():
-    """Processes JSONL files and generates a CSV with event_details."""
-    try:
-        # Load data from JSONL files
-        users = {user["id"]: user for user in load_jsonl(JSONL_FILES[0])}
-        dogs = {dog["id"]: dog for dog in load_jsonl(JSONL_FILES[1])}
-        health_events = load_jsonl(JSONL_FILES[2])
-        exercise_events = load_jsonl(JSONL_FILES[3])
-        diet_events = load_jsonl(JSONL_FILES[4])
-
-        # Prepare CSV data
-        csv_rows = [
-            ["user_id", "dog_id", "event_type", "event_timestamp", "dog_name", "dog_age", "dog_breed", "dog_sex", "dog_weight", "user_email", "user_name", "event_details"]
-        ]
-
-        def add_event_to_csv(event, event_type):
+MISSING_DOG = ("N/A", "N/A", "N/A", "N/A", "N/A", "N/A")
+MISSING_USER = ("N/A", "N/A")
+
+def join_event(event, users, dogs):
+    """Looks up an event's dog and owner, returning (user_id, dog_id, dog fields, user fields)."""
+    dog_id = event["dogId"].split("/")[-1]
+    dog = dogs.get(dog_id, MISSING_DOG)
+    user_id = dog[0]
+    return user_id, dog_id, dog, users.get(user_id, MISSING_USER)
+
+def iter_joined_events(users, dogs):
+    """
+    Streams every event joined against the user and dog indexes as
+    (event_type, event, user_id, dog_id, dog fields, user fields) tuples.
+    """
+    for event_type, file_path in EVENT_JSONL_FILES.items():
+        for event in iter_jsonl(file_path):
             try:
-                dog_id = event["dogId"].split("/")[-1]
-                dog = dogs.get(dog_id, {})
-                user_id = dog.get("users", ["N/A"])[0].split("/")[-1]
-                user = users.get(user_id, {})
-
-                csv_rows.append([
-                    user_id,
-                    dog_id,
-                    event_type,
-                    event.get("eventDate") or event.get("dateTime"),
-                    dog.get("name", "N/A"),
-                    dog.get("age", "N/A"),
-                    dog.get("breed", "N/A"),
-                    dog.get("sex", "N/A"),
-                    dog.get("weight", "N/A"),
-                    user.get("email", "N/A"),
-                    user.get("name", "N/A"),
-                    json.dumps(event, default=str)
-                ])
+                yield (event_type, event) + join_event(event, users, dogs)
             except Exception as e:
                 logging.warning(f"Error processing event: {event}, Error: {e}")
 
-        # Process events
-        for event in health_events:
-            add_event_to_csv(event, "health")
-        for event in exercise_events:
-            add_event_to_csv(event, "exercise")
-        for event in diet_events:
-            add_event_to_csv(event, "diet")
+def build_dimension_tables(indexes):
+    """
+    User and dog rows stored at their ID-index keys, plus each dog's owner as a
+    user key, so an event resolves with array lookups instead of string dicts.
+    """
+    import numpy as np
+
+    users, dogs = indexes["users"], indexes["dogs"]
+    user_rows = [MISSING_USER] * len(users)
+    records = iter_jsonl(USERS_JSONL)
+    while chunk := list(islice(records, JOIN_CHUNK_SIZE)):
+        for key, user in zip(users.lookup([user["id"] for user in chunk]).tolist(), chunk):
+            if key >= 0:
+                user_rows[key] = user_index_entry(user)
+
+    dog_rows = [MISSING_DOG] * len(dogs)
+    dog_owners = np.full(len(dogs), -1, dtype=np.int64)
+    records = iter_jsonl(DOGS_JSONL)
+    while chunk := list(islice(records, JOIN_CHUNK_SIZE)):
+        keys = dogs.lookup([dog["id"] for dog in chunk])
+        entries = [dog_index_entry(dog) for dog in chunk]
+        found = keys >= 0
+        for key, entry in zip(keys[found].tolist(), [entry for entry, ok in zip(entries, found) if ok]):
+            dog_rows[key] = entry
+        dog_owners[keys[found]] = users.lookup([entry[0] for entry, ok in zip(entries, found) if ok])
+    return user_rows, dog_rows, dog_owners
+
+def iter_joined_events_indexed(indexes):
+    """
+    iter_joined_events over the dense ID indexes of id_index: each chunk of
+    events has its dog references resolved with one vectorized lookup.
+    """
+    user_rows, dog_rows, dog_owners = build_dimension_tables(indexes)
+    for event_type, file_path in EVENT_JSONL_FILES.items():
+        events = iter_jsonl(file_path)
+        while chunk := list(islice(events, JOIN_CHUNK_SIZE)):
+            dog_ids = [event["dogId"].split("/")[-1] if "dogId" in event else None for event in chunk]
+            dog_keys = indexes["dogs"].lookup([dog_id or "" for dog_id in dog_ids])
+            for event, dog_id, dog_key in zip(chunk, dog_ids, dog_keys.tolist()):
+                if dog_id is None:
+                    logging.warning(f"Error processing event: {event}, Error: 'dogId'")
+                    continue
+                if dog_key < 0:
+                    yield event_type, event, MISSING_DOG[0], dog_id, MISSING_DOG, MISSING_USER
+                    continue
+                dog = dog_rows[dog_key]
+                owner = dog_owners[dog_key]
+                yield event_type, event, dog[0], dog_id, dog, user_rows[owner] if owner >= 0 else MISSING_USER
 
-        # Write to CSV
-        with open(OUTPUT_CSV, "w", newline="") as csvfile:
+def to_csv_row(event_type, event, user_id, dog_id, dog, user):
+    """Builds the dog_data.csv row for a joined event."""
+    _, name, age, breed, sex, weight = dog
+    email, user_name = user
+    return [
+        user_id,
+        dog_id,
+        event_type,
+        event.get("eventDate") or event.get("dateTime"),
+        name,
+        age,
+        breed,
+        sex,
+        weight,
+        email,
+        user_name,
+        json.dumps(event, default=str)
+    ]
+
+def process_jsonl_to_csv(use_id_index=False, compression=None):
+    """
+    Joins streamed events against in-memory user and dog indexes and writes each
+    CSV row with event_details as soon as its event is read. With use_id_index
+    the join runs over the dense ID indexes, built first if missing. With a
+    compression codec the CSV is compressed as it is written and uploaded under
+    its content-addressed name.
+    """
+    try:
+        # Only the dimension tables are held in memory
+        if use_id_index:
+            from id_index import build_id_indexes, load_id_indexes
+
+            joined_events = iter_joined_events_indexed(load_id_indexes() or build_id_indexes())
+        else:
+            joined_events = iter_joined_events(build_user_index(USERS_JSONL), build_dog_index(DOGS_JSONL))
+
+        rows = 0
+        with span("join"), open_output(OUTPUT_CSV, compression, newline="") as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerows(csv_rows)
+            writer.writerow(CSV_HEADERS)
+
+            for joined in joined_events:
+                writer.writerow(to_csv_row(*joined))
+                rows += 1
+        count("rows_written", rows, output=os.path.basename(OUTPUT_CSV))
 
-        logging.info(f"CSV file successfully saved to {OUTPUT_CSV}")
+        local_file_path = resolve_output(OUTPUT_CSV)
+        logging.info(f"CSV file successfully saved to {local_file_path}")
 
         # Upload CSV to GCS
-        upload_to_gcs(OUTPUT_CSV, GCS_BUCKET_NAME, GCS_OUTPUT_FILE)
+        with span("upload"):
+            upload = (local_file_path, GCS_BUCKET_NAME, os.path.basename(local_file_path) if compression else GCS_OUTPUT_FILE)
+            if upload_to_gcs(*upload):
+                publish_content_manifest(os.path.dirname(OUTPUT_CSV), [upload])
 
     except Exception as e:
         logging.error(f"Error during JSONL to CSV processing: {e}")
 
+def parse_timestamp(value):
+    """Parses an exported ISO 8601 string into a UTC datetime, or None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def parse_number(value, cast):
+    """Converts a numeric field to the given type, or None when it is missing or malformed."""
+    try:
+        return cast(value) if value not in (None, "", "N/A") else None
+    except (TypeError, ValueError):
+        return None
+
+def dog_data_schema():
+    """Typed Arrow schema for the denormalized table; enum columns are dictionary-encoded."""
+    import pyarrow as pa
+
+    enum = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("event_id", pa.string()),
+        ("user_id", pa.string()),
+        ("dog_id", pa.string()),
+        ("event_timestamp", pa.timestamp("us", tz="UTC")),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+        ("dog_name", pa.string()),
+        ("dog_age", pa.int32()),
+        ("dog_breed", enum),
+        ("dog_sex", enum),
+        ("dog_weight", pa.string()),
+        ("user_email", pa.string()),
+        ("user_name", pa.string()),
+        ("behavior_type", enum),
+        ("health_event_type", enum),
+        ("severity", pa.int32()),
+        ("notes", pa.string()),
+        ("brand_name", enum),
+        ("food_type", enum),
+        ("quantity", pa.float64()),
+        ("activity_type", enum),
+        ("source", enum),
+        ("distance", pa.float64()),
+        ("duration", pa.float64()),
+    ])
+
+def to_parquet_row(event, user_id, dog_id, dog, user):
+    """Flattens a joined event into the typed columns of dog_data_schema."""
+    _, name, age, breed, sex, weight = dog
+    email, user_name = user
+    created_at = parse_timestamp(event.get("createdAt"))
+    return {
+        "event_id": event.get("id"),
+        "user_id": user_id,
+        "dog_id": dog_id,
+        "event_timestamp": parse_timestamp(event.get("eventDate") or event.get("dateTime")) or created_at,
+        "created_at": created_at,
+        "updated_at": parse_timestamp(event.get("updatedAt")),
+        "dog_name": None if name == "N/A" else name,
+        "dog_age": parse_number(age, int),
+        "dog_breed": None if breed == "N/A" else breed,
+        "dog_sex": None if sex == "N/A" else sex,
+        "dog_weight": None if weight == "N/A" else str(weight),
+        "user_email": None if email == "N/A" else email,
+        "user_name": None if user_name == "N/A" else user_name,
+        "behavior_type": event.get("behaviorType"),
+        "health_event_type": event.get("eventType"),
+        "severity": parse_number(event.get("severity"), int),
+        "notes": event.get("notes"),
+        "brand_name": event.get("brandName"),
+        "food_type": event.get("foodType"),
+        "quantity": parse_number(event.get("quantity"), float),
+        "activity_type": event.get("activityType"),
+        "source": event.get("source"),
+        "distance": parse_number(event.get("distance"), float),
+        "duration": parse_number(event.get("duration"), float),
+    }
+
+class ParquetDatasetWriter:
+    """
+    Writes joined events as a Parquet dataset partitioned by event type and
+    month (event_type=<type>/event_month=<YYYY-MM>/part-00000.parquet). Each
+    partition keeps one open writer and buffers at most PARQUET_ROW_GROUP_SIZE
+    rows per row group. At most max_buffered_rows are held across all
+    partitions: past that the largest buffer is flushed as a smaller row
+    group, so memory does not grow with the number of months.
+    """
+
+    def __init__(self, output_directory=OUTPUT_PARQUET_DIRECTORY, max_buffered_rows=PARQUET_BUFFERED_ROWS):
+        import pyarrow  # noqa: F401 - fail early if the optional dependency is missing
+
+        self.output_directory = output_directory
+        self.schema = dog_data_schema()
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.max_buffered_rows = max_buffered_rows
+        self.writers = {}
+
+        # Partitions from a previous run would otherwise be mixed into this one
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+    def write(self, event_type, event, user_id, dog_id, dog, user):
+        row = to_parquet_row(event, user_id, dog_id, dog, user)
+        month = row["event_timestamp"].strftime("%Y-%m") if row["event_timestamp"] else "unknown"
+        partition = (event_type, month)
+        self.buffers.setdefault(partition, []).append(row)
+        self.buffered_rows += 1
+        if len(self.buffers[partition]) >= PARQUET_ROW_GROUP_SIZE:
+            self.flush(partition)
+        elif self.buffered_rows >= self.max_buffered_rows:
+            self.flush(max(self.buffers, key=lambda buffered: len(self.buffers[buffered])))
+
+    def flush(self, partition):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.buffers.pop(partition, None)
+        if not rows:
+            return
+        self.buffered_rows -= len(rows)
+        if partition not in self.writers:
+            event_type, month = partition
+            directory = os.path.join(self.output_directory, f"event_type={event_type}", f"event_month={month}")
+            os.makedirs(directory, exist_ok=True)
+            self.writers[partition] = pq.ParquetWriter(os.path.join(directory, "part-00000.parquet"), self.schema, compression="zstd")
+        self.writers[partition].write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        try:
+            for partition in list(self.buffers):
+                self.flush(partition)
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+        logging.info(f"Parquet dataset with {len(self.writers)} partitions saved to {self.output_directory}")
+
+    def uploads(self):
+        """(local path, bucket, blob name) triples for every written partition file."""
+        uploads = []
+        for root, _, files in os.walk(self.output_directory):
+            for file_name in files:
+                local_file_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(local_file_path, self.output_directory)
+                uploads.append((local_file_path, GCS_BUCKET_NAME, f"{GCS_PARQUET_PREFIX}/{relative_path}"))
+        return uploads
+
+def process_jsonl_to_parquet():
+    """
+    Writes the joined events as a partitioned Parquet dataset with type-specific
+    fields as nullable columns.
+    """
+    try:
+        users = build_user_index(USERS_JSONL)
+        dogs = build_dog_index(DOGS_JSONL)
+
+        writer = ParquetDatasetWriter()
+        with span("parquet"):
+            try:
+                for joined in iter_joined_events(users, dogs):
+                    writer.write(*joined)
+            finally:
+                writer.close()
+
+        # Upload every partition file to GCS concurrently
+        with span("upload"):
+            upload_files(writer.uploads())
+
+    except Exception as e:
+        logging.error(f"Error during JSONL to Parquet processing: {e}")
+
 if __name__ == "__main__":
-    logging.info("Starting JSONL to CSV processing")
-    process_jsonl_to_csv()
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,  # Change to DEBUG for more granular logs (slows large joins down)
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description="Join the exported JSONL files into dog_data.csv (or a Parquet dataset) and upload it to GCS.")
+    parser.add_argument("--parquet", action="store_true", help="Write a typed Parquet dataset partitioned by event type and month (requires pyarrow)")
+    parser.add_argument("--id-index", action="store_true", help="Join over the dense integer keys of outputs/id_index")
+    parser.add_argument("--compress", type=compression_codec, default=None, metavar="{" + ",".join(COMPRESSION_SUFFIXES) + "}",
+                        help="Compress dog_data.csv as it is written and name it by content hash")
+    args = parser.parse_args()
+    if args.parquet and (args.id_index or args.compress):
+        parser.error("--id-index and --compress only apply to the CSV output")
+
+    if args.parquet:
+        logging.info("Starting JSONL to Parquet processing")
+        process_jsonl_to_parquet()
+    else:
+        logging.info("Starting JSONL to CSV processing")
+        process_jsonl_to_csv(use_id_index=args.id_index, compression=args.compress)
+    write_run_report("jsonl_to_csv_to_gcs")
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Run reports, one JSON file per script run
+REPORT_DIRECTORY = "app/scripts/outputs/metrics"
+# Also write the metrics in Prometheus text format here (e.g. for node_exporter's textfile collector)
+PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE")
+METRIC_PREFIX = "vai_"
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Items counted() tallies locally before adding them to the shared counter
+COUNT_FLUSH_SIZE = 1000
+
+# Minimum time between two progress lines
+PROGRESS_INTERVAL_SECONDS = 5
+
+# Process-wide registry; every key is (metric name, sorted label pairs)
+lock = threading.Lock()
+counters = {}
+histograms = {}
+spans = {}
+started_at = datetime.now(timezone.utc)
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def count(name, value=1, **labels):
+    """Add value to a counter, e.g. count("docs_written", 500, collection="dogs")."""
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def counted(items, name, **labels):
+    """Pass items through, counting them into a counter in steps of COUNT_FLUSH_SIZE."""
+    pending = 0
+    try:
+        for item in items:
+            yield item
+            pending += 1
+            if pending == COUNT_FLUSH_SIZE:
+                count(name, pending, **labels)
+                pending = 0
+    finally:
+        if pending:
+            count(name, pending, **labels)
+
+class Histogram:
+    """Latency histogram with fixed LATENCY_BUCKETS, as Prometheus keeps them."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated inside its bucket."""
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.buckets):
+            if bucket_count and cumulative + bucket_count >= target:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+                return lower + (upper - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+def observe(name, seconds, **labels):
+    """Record one latency in a histogram."""
+    key = (name, label_key(labels))
+    with lock:
+        histograms.setdefault(key, Histogram()).observe(seconds)
+
+@contextmanager
+def timed(name, **labels):
+    """Time the enclosed call into a latency histogram, e.g. timed("rpc_seconds", rpc="batch_commit")."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+@contextmanager
+def span(name, **labels):
+    """Add the time spent in the enclosed block to a stage, e.g. span("export", collection="dogs")."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        key = (name, label_key(labels))
+        with lock:
+            seconds, calls = spans.get(key, (0.0, 0))
+            spans[key] = (seconds + elapsed, calls + 1)
+
+class Progress:
+    """
+    Sampled progress output: update() is cheap to call once per item, and a
+    "<done> <label> (<rate>/sec)" line is printed at most every
+    PROGRESS_INTERVAL_SECONDS. Not thread-safe; update it from one thread.
+    """
+
+    def __init__(self, label, interval=PROGRESS_INTERVAL_SECONDS):
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+
+    def update(self, n=1):
+        self.done += n
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            print(f"{self.done} {self.label} ({self.done / (now - self.start_time):.0f}/sec)")
+            self.last_report = now
+
+    def finish(self, suffix=""):
+        elapsed = time.monotonic() - self.start_time
+        print(f"{self.done} {self.label} in {elapsed:.1f}s ({self.done / max(elapsed, 1e-9):.0f}/sec){suffix}")
+
+def report():
+    """The run so far as a JSON-serializable dict."""
+    finished_at = datetime.now(timezone.utc)
+    with lock:
+        return {
+            "startedAt": started_at.isoformat(),
+            "finishedAt": finished_at.isoformat(),
+            "seconds": round((finished_at - started_at).total_seconds(), 3),
+            "spans": [{"name": name, "labels": dict(labels), "seconds": round(seconds, 6), "calls": calls}
+                      for (name, labels), (seconds, calls) in sorted(spans.items())],
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), **histogram.summary()}
+                           for (name, labels), histogram in sorted(histograms.items())],
+        }
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def prometheus_text():
+    """The registry in the Prometheus text exposition format."""
+    lines = []
+    with lock:
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{METRIC_PREFIX}{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{format_labels(labels)} {value}"
+                         for (entry_name, labels), value in sorted(counters.items()) if entry_name == name)
+        for name in sorted({name for name, _ in spans}):
+            metric = f"{METRIC_PREFIX}{name}_seconds_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{format_labels(labels)} {seconds:.6f}"
+                         for (entry_name, labels), (seconds, _) in sorted(spans.items()) if entry_name == name)
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{METRIC_PREFIX}{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for (entry_name, labels), histogram in sorted(histograms.items()):
+                if entry_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{format_labels(labels, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+def write_run_report(script_name, directory=REPORT_DIRECTORY):
+    """
+    Write the run report to <directory>/<script>-<UTC timestamp>.json, and the
+    Prometheus text to METRICS_PROMETHEUS_FILE when it is set. Returns the report path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{script_name}-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(path, "w") as file:
+        json.dump({"script": script_name, **report()}, file, indent=2)
+    if PROMETHEUS_FILE:
+        tmp_path = f"{PROMETHEUS_FILE}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(prometheus_text())
+        os.replace(tmp_path, PROMETHEUS_FILE)
+    print(f"Run report written to {path}")
+    return path
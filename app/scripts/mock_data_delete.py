@@ -1,35 +1,254 @@
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import time
+import random
+import argparse
+import asyncio
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore import FieldFilter
+from async_engine import DEFAULT_CONCURRENCY, RampUpLimiter, run_bounded
+from connections import get_async_firestore_client, get_firestore_client
+from metrics import Progress, count, span, timed, write_run_report
 
-# Initialize Firebase with credentials from environment variable
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# File path to the created items manifest (JSONL, one {"collection", "id"} object per line)
+file_path = 'app/scripts/outputs/created_items.jsonl'
 
-# File path to the JSON file
-file_path = 'app/scripts/outputs/created_items.json'
+# Bulk deletion configuration
+BATCH_SIZE = 500  # Firestore limit of operations per commit
+MAX_IN_FLIGHT_BATCHES = 8
+MAX_RETRIES = 5
+INITIAL_BACKOFF_SECONDS = 0.5
+
+# Errors worth retrying a batch commit for
+RETRYABLE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+)
+
+def iter_created_items(file_path):
+    """Stream manifest entries; legacy .json manifests are loaded whole."""
+    if file_path.endswith('.json'):
+        with open(file_path, 'r') as file:
+            yield from json.load(file)
+        return
+    with open(file_path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
 
 def delete_created_items(file_path):
     try:
-        # Read the JSON file
-        with open(file_path, 'r') as file:
-            created_items = json.load(file)
-        
+        db = get_firestore_client()
+        # Sampled progress instead of a line per document
+        progress = Progress("documents deleted")
         # Loop through the items and delete them from Firestore
-        for item in created_items:
+        for item in iter_created_items(file_path):
             collection = item.get("collection")
             doc_id = item.get("id")
             
             if collection and doc_id:
                 doc_ref = db.collection(collection).document(doc_id)
-                doc_ref.delete()
-                print(f"Deleted {doc_id} from {collection}")
+                with timed("rpc_seconds", rpc="delete"):
+                    doc_ref.delete()
+                count("docs_deleted", collection=collection)
+                progress.update()
             else:
                 print(f"Invalid item: {item}")
+        progress.finish()
     except Exception as e:
         print(f"An error occurred: {e}")
 
-# Run the deletion process
-delete_created_items(file_path)
+def commit_deletes(doc_refs):
+    """Delete a batch of documents in one commit, retrying transient errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            batch = get_firestore_client().batch()
+            for doc_ref in doc_refs:
+                batch.delete(doc_ref)
+            with timed("rpc_seconds", rpc="batch_delete"):
+                batch.commit()
+            count("batches_committed")
+            for collection, deleted in Counter(doc_ref.parent.id for doc_ref in doc_refs).items():
+                count("docs_deleted", deleted, collection=collection)
+            return len(doc_refs)
+        except RETRYABLE_ERRORS as e:
+            count("batch_retries")
+            if attempt == MAX_RETRIES:
+                raise
+            backoff = INITIAL_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+            print(f"Batch delete failed ({e}), retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+
+def delete_refs_bulk(doc_refs, on_batch_done=None):
+    """
+    Delete document references in 500-op batches with several commits in flight.
+
+    on_batch_done is called with each batch's sequence number as it completes.
+    Returns the number of documents deleted.
+    """
+    progress = Progress("documents deleted")
+    in_flight = {}
+    batch = []
+    batch_index = 0
+
+    def collect(done):
+        for future in done:
+            progress.update(future.result())
+            index = in_flight.pop(future)
+            if on_batch_done:
+                on_batch_done(index)
+
+    def submit(executor, batch, index):
+        if len(in_flight) >= MAX_IN_FLIGHT_BATCHES:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+        in_flight[executor.submit(commit_deletes, batch)] = index
+
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT_BATCHES) as executor:
+        for doc_ref in doc_refs:
+            batch.append(doc_ref)
+            if len(batch) == BATCH_SIZE:
+                submit(executor, batch, batch_index)
+                batch = []
+                batch_index += 1
+        if batch:
+            submit(executor, batch, batch_index)
+        if in_flight:
+            collect(wait(in_flight).done)
+
+    progress.finish()
+    return progress.done
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, 'r') as file:
+        return json.load(file)["deleted"]
+
+def save_checkpoint(checkpoint_path, deleted):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({"deleted": deleted}, file)
+    os.replace(tmp_path, checkpoint_path)
+
+def delete_created_items_bulk(file_path):
+    """
+    Delete every item in the manifest with batched, concurrent commits.
+
+    Progress is checkpointed as the number of leading manifest entries whose
+    batches have all committed, so an interrupted teardown resumes from there.
+    Returns the number of documents deleted by this run, or None if it failed.
+    """
+    checkpoint_path = f"{file_path}.checkpoint"
+    try:
+        start = load_checkpoint(checkpoint_path)
+        if start:
+            print(f"Resuming after {start} already deleted items")
+
+        completed = set()
+        next_batch = 0
+
+        def on_batch_done(index):
+            nonlocal next_batch
+            completed.add(index)
+            while next_batch in completed:
+                completed.remove(next_batch)
+                next_batch += 1
+            save_checkpoint(checkpoint_path, start + next_batch * BATCH_SIZE)
+
+        def doc_refs():
+            db = get_firestore_client()
+            for item in islice(iter_created_items(file_path), start, None):
+                collection = item.get("collection")
+                doc_id = item.get("id")
+                if collection and doc_id:
+                    yield db.collection(collection).document(doc_id)
+                else:
+                    print(f"Invalid item: {item}")
+
+        deleted = delete_refs_bulk(doc_refs(), on_batch_done)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        print(f"Deleted {deleted} documents listed in {file_path}")
+        return deleted
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+def delete_collection_bulk(collection, prefix=None):
+    """
+    Delete every document in a collection, or only those whose ID starts with prefix.
+
+    Only document keys are fetched. Rerunning after an interruption picks up
+    whatever is left, since deleted documents no longer match the query.
+    """
+    try:
+        db = get_firestore_client()
+        query = db.collection(collection).select([])
+        if prefix:
+            collection_ref = db.collection(collection)
+            query = query.where(filter=FieldFilter("__name__", ">=", collection_ref.document(prefix))) \
+                         .where(filter=FieldFilter("__name__", "<", collection_ref.document(prefix + "\uf8ff")))
+
+        deleted = delete_refs_bulk(doc.reference for doc in query.stream())
+        print(f"Deleted {deleted} documents from {collection}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def delete_created_items_async(file_path, concurrency=DEFAULT_CONCURRENCY, max_rate=None):
+    """
+    Delete every item in the manifest with concurrent AsyncClient deletes,
+    at most `concurrency` at once under the 500/50/5 ramp-up limiter.
+    """
+    async def delete_all():
+        db = get_async_firestore_client()
+
+        def doc_refs():
+            for item in iter_created_items(file_path):
+                collection = item.get("collection")
+                doc_id = item.get("id")
+                if collection and doc_id:
+                    yield db.collection(collection).document(doc_id)
+                else:
+                    print(f"Invalid item: {item}")
+
+        async def delete(doc_ref):
+            await doc_ref.delete()
+            count("docs_deleted", collection=doc_ref.parent.id)
+
+        return await run_bounded(doc_refs(), delete, concurrency, RampUpLimiter(max_rate=max_rate), "documents deleted", "delete")
+
+    try:
+        deleted, failed = asyncio.run(delete_all())
+        print(f"Deleted {deleted} documents listed in {file_path} ({failed} failed)")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete mock data created by mock_data_to_firebase.")
+    parser.add_argument("--manifest", default=file_path, help="Manifest of created items to delete")
+    parser.add_argument("--bulk", action="store_true", help="Delete through concurrent 500-op batches with checkpoints")
+    parser.add_argument("--async", dest="run_async", action="store_true", help="Delete documents concurrently with the asyncio client")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Deletes in flight at once in async mode")
+    parser.add_argument("--max-rate", type=float, help="Cap on deletes/sec in async mode (default: ramp up without limit)")
+    parser.add_argument("--collection", help="Delete from this collection instead of the manifest")
+    parser.add_argument("--prefix", help="With --collection, only delete documents whose ID starts with this prefix")
+    args = parser.parse_args()
+
+    # Run the deletion process
+    with span("delete"):
+        if args.collection:
+            delete_collection_bulk(args.collection, args.prefix)
+        elif args.run_async:
+            delete_created_items_async(args.manifest, args.concurrency, args.max_rate)
+        elif args.bulk:
+            delete_created_items_bulk(args.manifest)
+        else:
+            delete_created_items(args.manifest)
+    write_run_report("mock_data_delete")
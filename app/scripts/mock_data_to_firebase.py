@@ -1,37 +1,58 @@
 import random
+import json
 from datetime import datetime, timedelta
 import os
-from firebase_admin import firestore, credentials, initialize_app
+import argparse
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from async_engine import DEFAULT_CONCURRENCY, RampUpLimiter, run_bounded
+from connections import get_async_firestore_client, get_firestore_client
+from event_links import LAYOUTS, link_data, link_reference
+from metrics import Progress, count, span, timed, write_run_report
 from constants import ACTIVITY_TYPES, SOURCES, FOOD_TYPES, BREEDS, ZIP_CODES, NAMES, DOG_NAMES, BEHAVIOR_TYPES, BEHAVIOR_NOTES, DIET_BRANDS, HEALTH_EVENT_TYPES, HEALTH_NOTES
 
 
-# Firebase initialization
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-initialize_app(cred)
-db = firestore.client()
+# Append-only JSONL manifest of created documents, flushed in batches
+CREATED_ITEMS_FILE = "app/scripts/outputs/created_items.jsonl"
+MANIFEST_FLUSH_SIZE = 500
 
-# List to store references of created data
+# Manifest lines not yet flushed to CREATED_ITEMS_FILE
 created_items = []
 
+# Bulk seeding configuration
+BATCH_SIZE = 500  # Firestore limit of operations per commit
+MAX_IN_FLIGHT_BATCHES = 8
+
 def get_random_element(array):
     return random.choice(array)
 
 def ensure_output_directory():
     os.makedirs("app/scripts/outputs", exist_ok=True)
 
+def record_created_item(collection, doc_id):
+    """Queue a created document for the manifest, flushing once a batch has accumulated."""
+    created_items.append(json.dumps({"collection": collection, "id": doc_id}) + "\n")
+    if len(created_items) >= MANIFEST_FLUSH_SIZE:
+        write_created_items()
+
 def write_created_items():
+    """Append pending manifest lines to created_items.jsonl."""
     try:
         ensure_output_directory()
-        with open("app/scripts/outputs/created_items.json", "w") as file:
-            import json
-            json.dump(created_items, file, indent=4)
-        print("created_items.json successfully written.")
+        with open(CREATED_ITEMS_FILE, "a") as file:
+            file.writelines(created_items)
+        created_items.clear()
     except Exception as e:
-        print(f"Error writing created_items.json: {e}")
+        print(f"Error writing created_items.jsonl: {e}")
+
+def collection_path(doc_ref):
+    """"dogs/abc/eventLinks" for a subcollection document, "users" for a top-level one."""
+    return doc_ref.path.rsplit("/", 1)[0]
 
-def generate_random_users():
+def generate_random_users(count=10):
     users = []
-    for i in range(10):
+    for i in range(count):
         real_name = get_random_element(NAMES)
         updated_at = datetime.now() - timedelta(days=random.randint(0, 365))
         created_at = updated_at - timedelta(days=random.randint(1, 10))
@@ -48,8 +69,78 @@ def generate_random_users():
         })
     return users
 
-def generate_random_dog_events(dog_ref, user_ref):
-    events = []
+def generate_random_event(event_type, dog_ref, user_ref):
+    created_at = datetime.now() - timedelta(days=random.randint(0, 365))
+    updated_at = created_at + timedelta(days=random.randint(0, 10))  # Updates occur within 10 days of creation
+
+    event = {
+        "type": event_type,
+        "userId": user_ref,
+        "dogId": dog_ref,
+        "createdAt": created_at,
+        "updatedAt": updated_at
+    }
+
+    if event_type == "behavior":
+        event.update({
+            "behaviorType": get_random_element(BEHAVIOR_TYPES),
+            "severity": random.randint(1, 10),
+            "notes": get_random_element(BEHAVIOR_NOTES)
+        })
+    elif event_type == "diet":
+        event.update({
+            "brandName": get_random_element(DIET_BRANDS),  # Randomize brandName
+            "foodType": get_random_element(FOOD_TYPES),  # Randomize foodType
+            "quantity": random.randint(100, 500)  # Keep quantity random
+        })
+    elif event_type == "exercise":
+        event.update({
+            "activityType": get_random_element(ACTIVITY_TYPES),  # Randomize activityType
+            "source": get_random_element(SOURCES),  # Randomize source
+            "distance": round(random.uniform(0.5, 5.0), 2),  # Keep distance random
+            "duration": random.randint(10, 120)  # Keep duration random
+        })
+    elif event_type == "health":
+        event.update({
+            "eventType": get_random_element(HEALTH_EVENT_TYPES),  # Randomize eventType
+            "severity": random.randint(1, 10),
+            "notes": get_random_element(HEALTH_NOTES)  # Randomize notes
+        })
+
+    return event
+
+def generate_random_dog(user_reference):
+    return {
+        "users": [user_reference],  # Use the Firestore reference directly
+        "name": get_random_element(DOG_NAMES),
+        "age": random.randint(1, 10),
+        "breed": get_random_element(BREEDS),
+        "sex": get_random_element(["Male", "Female"]),
+        "weight": f"{random.randint(10, 40)} lbs",
+        "birthday": (datetime.now() - timedelta(days=random.randint(365, 3650))).isoformat(),
+        "createdAt": datetime.now().isoformat(),
+        "updatedAt": datetime.now().isoformat(),
+        "behaviorEventIds": [],
+        "dietEventIds": [],
+        "exerciseEventIds": [],
+        "healthEventIds": []
+    }
+
+def add_document(collection_name, data, progress):
+    """add() one document, recording the write. Returns its ID."""
+    with timed("rpc_seconds", rpc="add"):
+        _, doc_ref = get_firestore_client().collection(collection_name).add(data)
+    count("docs_written", collection=collection_name)
+    progress.update()
+    return doc_ref.id
+
+def update_document(collection_name, doc_id, data):
+    with timed("rpc_seconds", rpc="update"):
+        get_firestore_client().collection(collection_name).document(doc_id).update(data)
+    count("docs_written", collection=collection_name)
+
+def generate_random_dog_events(dog_ref, user_ref, progress):
+    db = get_firestore_client()
     event_ids = {
         "behavior": [],
         "diet": [],
@@ -59,106 +150,209 @@ def generate_random_dog_events(dog_ref, user_ref):
 
     for _ in range(30):
         event_type = get_random_element(["behavior", "diet", "exercise", "health"])
-        created_at = datetime.now() - timedelta(days=random.randint(0, 365))
-        updated_at = created_at + timedelta(days=random.randint(0, 10))  # Updates occur within 10 days of creation
-
-        event = {
-            "type": event_type,
-            "userId": user_ref,
-            "dogId": dog_ref,
-            "createdAt": created_at,
-            "updatedAt": updated_at
-        }
-
-        if event_type == "behavior":
-            event.update({
-                "behaviorType": get_random_element(BEHAVIOR_TYPES),
-                "severity": random.randint(1, 10),
-                "notes": get_random_element(BEHAVIOR_NOTES)
-            })
-        elif event_type == "diet":
-            event.update({
-                "brandName": get_random_element(DIET_BRANDS),  # Randomize brandName
-                "foodType": get_random_element(FOOD_TYPES),  # Randomize foodType
-                "quantity": random.randint(100, 500)  # Keep quantity random
-            })
-        elif event_type == "exercise":
-            event.update({
-                "activityType": get_random_element(ACTIVITY_TYPES),  # Randomize activityType
-                "source": get_random_element(SOURCES),  # Randomize source
-                "distance": round(random.uniform(0.5, 5.0), 2),  # Keep distance random
-                "duration": random.randint(10, 120)  # Keep duration random
-            })
-        elif event_type == "health":
-            event.update({
-                "eventType": get_random_element(HEALTH_EVENT_TYPES),  # Randomize eventType
-                "severity": random.randint(1, 10),
-                "notes": get_random_element(HEALTH_NOTES)  # Randomize notes
-            })
-
-        event_ref = db.collection(f"{event_type}Events").add(event)
-        event_path = db.document(f"{event_type}Events/{event_ref[1].id}")
+        event = generate_random_event(event_type, dog_ref, user_ref)
+
+        event_id = add_document(f"{event_type}Events", event, progress)
+        event_path = db.document(f"{event_type}Events/{event_id}")
         event_ids[event_type].append(event_path)  # Store as a reference
-        created_items.append({"collection": f"{event_type}Events", "id": event_ref[1].id})
-        print(f"Event created: {event_ref[1].id} in {event_type}Events")
+        record_created_item(f"{event_type}Events", event_id)
 
     return event_ids
 
 def add_mock_data():
     try:
+        db = get_firestore_client()
         ensure_output_directory()
         users = generate_random_users()
+        # Sampled progress instead of a line per document
+        progress = Progress("docs written")
 
         for user in users:
-            user_ref = db.collection("users").add(user)
-            user_id = user_ref[1].id
+            user_id = add_document("users", user, progress)
             user_reference = db.document(f"users/{user_id}")
-            created_items.append({"collection": "users", "id": user_id})
-            print(f"User added: {user_id}")
+            record_created_item("users", user_id)
 
             num_dogs = random.randint(1, 3)
             dog_ids = []
 
             for i in range(num_dogs):
-                dog_name = get_random_element(DOG_NAMES)
-                dog = {
-                    "users": [user_reference],  # Use the Firestore reference directly
-                    "name": dog_name,
-                    "age": random.randint(1, 10),
-                    "breed": get_random_element(BREEDS),
-                    "sex": get_random_element(["Male", "Female"]),
-                    "weight": f"{random.randint(10, 40)} lbs",
-                    "birthday": (datetime.now() - timedelta(days=random.randint(365, 3650))).isoformat(),
-                    "createdAt": datetime.now().isoformat(),
-                    "updatedAt": datetime.now().isoformat(),
-                    "behaviorEventIds": [],
-                    "dietEventIds": [],
-                    "exerciseEventIds": [],
-                    "healthEventIds": []
-                }
-
-                dog_ref = db.collection("dogs").add(dog)
-                dog_id = dog_ref[1].id
+                dog = generate_random_dog(user_reference)
+
+                dog_id = add_document("dogs", dog, progress)
                 dog_reference = db.document(f"dogs/{dog_id}")
-                created_items.append({"collection": "dogs", "id": dog_id})
-                print(f"Dog added: {dog_id}")
+                record_created_item("dogs", dog_id)
                 dog_ids.append(dog_reference)
 
-                event_ids = generate_random_dog_events(dog_reference, user_reference)
-                db.collection("dogs").document(dog_id).update({
+                event_ids = generate_random_dog_events(dog_reference, user_reference, progress)
+                update_document("dogs", dog_id, {
                     "behaviorEventIds": event_ids["behavior"],
                     "dietEventIds": event_ids["diet"],
                     "exerciseEventIds": event_ids["exercise"],
                     "healthEventIds": event_ids["health"]
                 })
 
-            db.collection("users").document(user_id).update({"dogList": dog_ids})
+            update_document("users", user_id, {"dogList": dog_ids})
 
+        progress.finish()
+        print("Mock data successfully added to Firestore.")
+    except Exception as e:
+        print(f"Error adding mock data: {e}")
+    finally:
         write_created_items()
 
+def generate_bulk_documents(users, db=None, layout="arrays"):
+    """
+    Yield (document reference, data) pairs for every user, dog and event.
+
+    Document IDs are generated client-side, so each dog's *EventIds arrays and
+    each user's dogList are complete in the first write and no update() pass
+    is needed afterwards. References are made with db, the shared sync client
+    by default. With the "indexed" or "subcollection" layout dogs get no arrays;
+    the subcollection layout also yields a dogs/{dogId}/eventLinks document per event.
+    """
+    db = db or get_firestore_client()
+    for user in users:
+        user_reference = db.collection("users").document()
+        dog_list = []
+
+        for _ in range(random.randint(1, 3)):
+            dog_reference = db.collection("dogs").document()
+            dog = generate_random_dog(user_reference)
+
+            for _ in range(30):
+                event_type = get_random_element(["behavior", "diet", "exercise", "health"])
+                event_reference = db.collection(f"{event_type}Events").document()
+                dog[f"{event_type}EventIds"].append(event_reference)
+                yield event_reference, generate_random_event(event_type, dog_reference, user_reference)
+                if layout == "subcollection":
+                    yield link_reference(dog_reference, event_reference), link_data(event_reference, f"{event_type}Events")
+
+            if layout != "arrays":
+                for event_type in ["behavior", "diet", "exercise", "health"]:
+                    del dog[f"{event_type}EventIds"]
+
+            dog_list.append(dog_reference)
+            yield dog_reference, dog
+
+        user["dogList"] = dog_list
+        yield user_reference, user
+
+def commit_batch(operations):
+    batch = get_firestore_client().batch()
+    for doc_ref, data in operations:
+        batch.set(doc_ref, data)
+    with timed("rpc_seconds", rpc="batch_commit"):
+        batch.commit()
+    count("batches_committed")
+    for collection_name, written in Counter(doc_ref.parent.id for doc_ref, _ in operations).items():
+        count("docs_written", written, collection=collection_name)
+    return len(operations)
+
+def write_documents_bulk(documents, record_created=True):
+    """
+    Write (document reference, data) pairs through batched commits with several
+    of them in flight at once. Returns the number of documents written.
+
+    Written documents are added to the created-items manifest unless
+    record_created is False.
+    """
+    progress = Progress("docs written")
+    in_flight = set()
+    operations = []
+
+    def collect(done):
+        for future in done:
+            progress.update(future.result())
+
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT_BATCHES) as executor:
+        for doc_ref, data in documents:
+            operations.append((doc_ref, data))
+            if record_created:
+                record_created_item(collection_path(doc_ref), doc_ref.id)
+            if len(operations) < BATCH_SIZE:
+                continue
+
+            if len(in_flight) >= MAX_IN_FLIGHT_BATCHES:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(commit_batch, operations))
+            operations = []
+
+        if operations:
+            in_flight.add(executor.submit(commit_batch, operations))
+        collect(wait(in_flight).done)
+
+    progress.finish()
+    return progress.done
+
+def add_mock_data_bulk(num_users=10, layout="arrays"):
+    """Seed mock data with batched commits, several of them in flight at once."""
+    try:
+        ensure_output_directory()
+        users = generate_random_users(num_users)
+        write_documents_bulk(generate_bulk_documents(users, layout=layout))
+
         print("Mock data successfully added to Firestore.")
     except Exception as e:
         print(f"Error adding mock data: {e}")
+    finally:
+        write_created_items()
+
+async def write_documents_async(documents, concurrency=DEFAULT_CONCURRENCY, max_rate=None):
+    """
+    Write (document reference, data) pairs one document per request, with up to
+    `concurrency` writes awaited at once under the 500/50/5 ramp-up limiter.
+    Returns the number of documents written.
+    """
+    def recorded(documents):
+        for doc_ref, data in documents:
+            record_created_item(collection_path(doc_ref), doc_ref.id)
+            yield doc_ref, data
+
+    async def write(item):
+        doc_ref, data = item
+        await doc_ref.set(data)
+        count("docs_written", collection=doc_ref.parent.id)
+
+    written, _ = await run_bounded(recorded(documents), write, concurrency, RampUpLimiter(max_rate=max_rate), "docs written", "set")
+    return written
+
+def add_mock_data_async(num_users=10, concurrency=DEFAULT_CONCURRENCY, max_rate=None, layout="arrays"):
+    """Seed mock data with concurrent AsyncClient writes."""
+    try:
+        ensure_output_directory()
+        users = generate_random_users(num_users)
+
+        async def seed():
+            # The async client must be created inside the running event loop
+            documents = generate_bulk_documents(users, get_async_firestore_client(), layout)
+            await write_documents_async(documents, concurrency, max_rate)
+
+        asyncio.run(seed())
+
+        print("Mock data successfully added to Firestore.")
+    except Exception as e:
+        print(f"Error adding mock data: {e}")
+    finally:
+        write_created_items()
 
 if __name__ == "__main__":
-    add_mock_data()
+    parser = argparse.ArgumentParser(description="Seed Firestore with mock users, dogs and events.")
+    parser.add_argument("--bulk", action="store_true", help="Write through concurrent 500-op batches")
+    parser.add_argument("--async", dest="run_async", action="store_true", help="Write documents concurrently with the asyncio client")
+    parser.add_argument("--users", type=int, default=10, help="Number of users to create in bulk or async mode")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Writes in flight at once in async mode")
+    parser.add_argument("--max-rate", type=float, help="Cap on writes/sec in async mode (default: ramp up without limit)")
+    parser.add_argument("--layout", choices=LAYOUTS, default="arrays", help="How dog -> event links are stored, in bulk or async mode")
+    args = parser.parse_args()
+    if args.layout != "arrays" and not (args.bulk or args.run_async):
+        parser.error("--layout requires --bulk or --async")
+
+    with span("seed"):
+        if args.run_async:
+            add_mock_data_async(args.users, args.concurrency, args.max_rate, args.layout)
+        elif args.bulk:
+            add_mock_data_bulk(args.users, args.layout)
+        else:
+            add_mock_data()
+    write_run_report("mock_data_to_firebase")
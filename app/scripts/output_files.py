@@ -0,0 +1,178 @@
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from metrics import count
+
+# Compression codec -> suffix of the compressed file
+COMPRESSION_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+# Hex digits of the SHA-256 content hash kept in output names
+DIGEST_LENGTH = 16
+# Per-directory map of logical output names (users.jsonl) to their current content-addressed file
+MANIFEST_NAME = "content_manifest.json"
+
+# Size of the buffer used when writing plain files
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+CONTENT_ADDRESSED_NAME = re.compile(rf"-[0-9a-f]{{{DIGEST_LENGTH}}}(\.[^./]+)?\.(zst|gz)$")
+
+manifest_lock = threading.Lock()
+
+class HashingWriter(io.RawIOBase):
+    """Binary stream that hashes every byte on its way to the file below."""
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+def compressing_stream(compression, file):
+    """
+    Binary stream compressing into file. Both codecs are deterministic (gzip
+    without a timestamp), so equal contents always give equal bytes.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(filename="", mode="wb", compresslevel=GZIP_LEVEL, fileobj=file, mtime=0)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=False)
+    raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSION_SUFFIXES)}")
+
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST_NAME)
+
+def load_manifest(directory):
+    path = manifest_path(directory)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+def record_output(path, final_path):
+    """Point the manifest entry of path at final_path and remove the versions it replaces."""
+    directory, name = os.path.split(path)
+    with manifest_lock:
+        manifest = load_manifest(directory)
+        previous = manifest.get(name)
+        manifest[name] = os.path.basename(final_path)
+        tmp_path = f"{manifest_path(directory)}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path(directory))
+
+    stale = [path]
+    if previous and previous != manifest[name]:
+        stale.append(os.path.join(directory, previous))
+    for stale_path in stale:
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+@contextmanager
+def open_output(path, compression=None, newline=None):
+    """
+    Open an output file for writing text.
+
+    Without compression this is the plain file at path. With "zstd" or "gzip"
+    the text is compressed as it is written, so no uncompressed copy ever hits
+    the disk, and the finished file is named after its contents:
+    users.jsonl -> users-<sha256 prefix>.jsonl.zst. The directory's manifest
+    then points users.jsonl at it and the previous version is removed; use
+    resolve_output or open_input to find it again.
+    """
+    if compression is None:
+        with open(path, "w", newline=newline, buffering=WRITE_BUFFER_SIZE) as file:
+            yield file
+        count("bytes_written", os.path.getsize(path), output=os.path.basename(path))
+        return
+
+    suffix = COMPRESSION_SUFFIXES.get(compression)
+    if suffix is None:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSION_SUFFIXES)}")
+    tmp_path = f"{path}.tmp{suffix}"
+    raw = open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE)
+    text = None
+    try:
+        hashing = HashingWriter(raw)
+        text = io.TextIOWrapper(compressing_stream(compression, hashing), encoding="utf-8", newline=newline)
+        yield text
+    except BaseException:
+        if text is not None:
+            text.close()
+        raw.close()
+        os.remove(tmp_path)
+        raise
+    text.close()
+    raw.close()
+
+    name, extension = os.path.splitext(os.path.basename(path))
+    digest = hashing.digest.hexdigest()[:DIGEST_LENGTH]
+    final_path = os.path.join(os.path.dirname(path), f"{name}-{digest}{extension}{suffix}")
+    os.replace(tmp_path, final_path)
+    record_output(path, final_path)
+    count("bytes_written", os.path.getsize(final_path), output=os.path.basename(path))
+
+def resolve_output(path):
+    """
+    The file currently holding the logical output path: its content-addressed
+    version from the manifest or the plain file, whichever was written last.
+    None if neither exists.
+    """
+    directory, name = os.path.split(path)
+    candidates = [path]
+    current = load_manifest(directory).get(name)
+    if current:
+        candidates.append(os.path.join(directory, current))
+    existing = [candidate for candidate in candidates if os.path.exists(candidate)]
+    return max(existing, key=os.path.getmtime) if existing else None
+
+def open_input(path, newline=None):
+    """Open the current version of an output for reading text, decompressing it if needed."""
+    path = resolve_output(path) or path
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline=newline)
+    if path.endswith(".zst"):
+        import zstandard
+
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8", newline=newline)
+    return open(path, "r", newline=newline)
+
+def compression_codec(compression):
+    """
+    argparse type for --compress: the codec name, once it is known and its
+    compressor can be imported, so a missing zstandard fails before any export starts.
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise argparse.ArgumentTypeError(f"expected one of: {', '.join(COMPRESSION_SUFFIXES)}")
+    if compression == "zstd" and importlib.util.find_spec("zstandard") is None:
+        raise argparse.ArgumentTypeError("zstd needs the zstandard package (pip install zstandard)")
+    return compression
+
+def is_content_addressed(name):
+    """True for names written by open_output with compression, whose contents never change."""
+    return CONTENT_ADDRESSED_NAME.search(name) is not None
+
+def content_versions(name):
+    """
+    Pattern matching every content-addressed version of the output a
+    content-addressed name belongs to: users-<hash>.jsonl.zst -> users-*.jsonl.zst.
+    """
+    start = CONTENT_ADDRESSED_NAME.search(name).start()
+    suffix = name[start + 1 + DIGEST_LENGTH:]
+    return re.compile(rf"{re.escape(name[:start])}-[0-9a-f]{{{DIGEST_LENGTH}}}{re.escape(suffix)}$")
@@ -0,0 +1,103 @@
+from serializers import EVENT_ID_FIELDS
+
+EVENT_COLLECTIONS = ["behaviorEvents", "dietEvents", "exerciseEvents", "healthEvents"]
+
+# Every dogs field except the unbounded *EventIds reference arrays
+DOG_FIELDS = ["name", "age", "breed", "sex", "weight", "birthday", "users", "createdAt", "updatedAt"]
+
+# Read the whole document
+ALL_FIELDS = None
+
+# Fields each export target reads, per collection. A collection a target does
+# not list is not read for it at all; ALL_FIELDS reads whole documents.
+TARGET_FIELDS = {
+    # Full copies of every collection
+    "jsonl": {name: ALL_FIELDS for name in ["users", "dogs"] + EVENT_COLLECTIONS},
+    "csv": {name: ALL_FIELDS for name in ["users", "dogs"] + EVENT_COLLECTIONS},
+    # Full copies, but dogs without their *EventIds arrays
+    "lean": {"users": ALL_FIELDS, "dogs": DOG_FIELDS, **{name: ALL_FIELDS for name in EVENT_COLLECTIONS}},
+    # jsonl_to_csv_to_gcs: user_index_entry, dog_index_entry and the whole event
+    "join": {
+        "users": ["email", "name"],
+        "dogs": ["users", "name", "age", "breed", "sex", "weight"],
+        **{name: ALL_FIELDS for name in EVENT_COLLECTIONS},
+    },
+    "parquet": {
+        "users": ["email", "name"],
+        "dogs": ["users", "name", "age", "breed", "sex", "weight"],
+        **{name: ALL_FIELDS for name in EVENT_COLLECTIONS},
+    },
+    # daily_rollups: the day and the rolled-up metrics of each event
+    "rollup": {
+        "behaviorEvents": ["dogId", "eventDate", "createdAt", "severity"],
+        "dietEvents": ["dogId", "eventDate", "createdAt", "quantity"],
+        "exerciseEvents": ["dogId", "eventDate", "createdAt", "distance", "duration"],
+        "healthEvents": ["dogId", "eventDate", "createdAt", "severity"],
+    },
+}
+
+def fields_for(targets, collection_name):
+    """
+    Fields the given targets need from a collection: a sorted list, ALL_FIELDS
+    if any of them reads whole documents, or [] if none of them reads it.
+    """
+    fields = set()
+    for target in targets:
+        target_fields = TARGET_FIELDS[target]
+        if collection_name not in target_fields:
+            continue
+        if target_fields[collection_name] is ALL_FIELDS:
+            return ALL_FIELDS
+        fields.update(target_fields[collection_name])
+    return sorted(fields)
+
+def project(query, fields):
+    """The query restricted to fields with a select() projection, unless whole documents are needed."""
+    return query if fields is ALL_FIELDS else query.select(fields)
+
+def event_id_field(collection_name):
+    """"healthEvents" -> "healthEventIds"."""
+    return f"{collection_name[:-len('Events')]}EventIds"
+
+class EventIdCollector:
+    """
+    Rebuilds the dogs' *EventIds arrays from the events' own dogId while the
+    events stream past, as {dog ID: {field: [event paths]}}.
+    """
+
+    def __init__(self):
+        self.event_ids = {}
+
+    def add(self, collection_name, event_id, dog_id):
+        if not dog_id:
+            return
+        dog_id = dog_id if isinstance(dog_id, str) else getattr(dog_id, "path", "")
+        dog_event_ids = self.event_ids.setdefault(dog_id.split("/")[-1], {field: [] for field in EVENT_ID_FIELDS})
+        dog_event_ids[event_id_field(collection_name)].append(f"{collection_name}/{event_id}")
+
+    def track(self, collection_name, docs):
+        """Pass document snapshots through, collecting each one's dogId."""
+        for doc in docs:
+            try:
+                dog_id = doc.get("dogId")
+            except KeyError:
+                dog_id = None
+            self.add(collection_name, doc.id, dog_id)
+            yield doc
+
+    def fields(self, dog_id):
+        """The rebuilt *EventIds fields of a dog; empty arrays if no event names it."""
+        return self.event_ids.get(dog_id) or {field: [] for field in EVENT_ID_FIELDS}
+
+class DocumentWithFields:
+    """A document snapshot with extra fields merged into to_dict(), e.g. rebuilt *EventIds arrays."""
+
+    __slots__ = ("id", "_doc", "_extra")
+
+    def __init__(self, doc, extra):
+        self.id = doc.id
+        self._doc = doc
+        self._extra = extra
+
+    def to_dict(self):
+        return {**self._doc.to_dict(), **self._extra}
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+
+def _select_dumps(backend):
+    """
+    (backend name, dumps function) for the fastest installed JSON backend
+    allowed by backend: "auto" tries orjson, then msgspec, then the stdlib.
+    """
+    if backend in ("auto", "orjson"):
+        try:
+            import orjson
+
+            return "orjson", lambda obj: orjson.dumps(obj).decode("utf-8")
+        except ImportError:
+            pass
+    if backend in ("auto", "msgspec"):
+        try:
+            import msgspec
+
+            encoder = msgspec.json.Encoder()
+            return "msgspec", lambda obj: encoder.encode(obj).decode("utf-8")
+        except ImportError:
+            pass
+    return "json", json.dumps
+
+# Optional fast JSON backends, in order of preference. SERIALIZER_BACKEND=json forces the stdlib.
+BACKEND, _dumps = _select_dumps(os.getenv("SERIALIZER_BACKEND", "auto"))
+
+EVENT_TIMESTAMP_FIELDS = ["createdAt", "updatedAt", "eventDate", "dateTime"]
+EVENT_ID_FIELDS = ["behaviorEventIds", "dietEventIds", "exerciseEventIds", "healthEventIds"]
+
+# Known field layout of each collection written by mock_data_to_firebase and the app
+COLLECTION_SCHEMAS = {
+    "users": {
+        "timestamps": ["createdAt", "updatedAt"],
+        "reference_lists": ["dogList"],
+        "nested": ["address"],
+    },
+    "dogs": {
+        "timestamps": ["birthday", "createdAt", "updatedAt"],
+        "reference_lists": ["users"] + EVENT_ID_FIELDS,
+    },
+    "behaviorEvents": {"timestamps": EVENT_TIMESTAMP_FIELDS, "references": ["dogId", "userId"]},
+    "dietEvents": {"timestamps": EVENT_TIMESTAMP_FIELDS, "references": ["dogId", "userId"]},
+    "exerciseEvents": {"timestamps": EVENT_TIMESTAMP_FIELDS, "references": ["dogId", "userId"]},
+    "healthEvents": {"timestamps": EVENT_TIMESTAMP_FIELDS, "references": ["dogId", "userId"]},
+}
+
+# Values of these types are emitted as-is
+PLAIN_TYPES = (str, int, float, bool, type(None))
+
+# Strings datetime.fromisoformat(...).isoformat() would return unchanged
+CANONICAL_ISO_TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d{6})?([+-]\d\d:\d\d)?")
+
+_warned_types = set()
+
+def to_plain(value):
+    """Generic conversion of any Firestore value to JSON-native types."""
+    if isinstance(value, PLAIN_TYPES):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "path"):  # DocumentReference
+        return value.path
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    if type(value) not in _warned_types:
+        _warned_types.add(type(value))
+        logging.warning(f"Unhandled data type during serialization: {type(value)}")
+    return str(value)
+
+def timestamp_value(value):
+    return value.isoformat() if isinstance(value, datetime) else to_plain(value)
+
+def reference_value(value):
+    return value if isinstance(value, str) else getattr(value, "path", None) or to_plain(value)
+
+def reference_list_value(values):
+    if not isinstance(values, list):
+        return to_plain(values)
+    return [value if isinstance(value, str) else getattr(value, "path", None) or to_plain(value) for value in values]
+
+@lru_cache(maxsize=None)
+def get_encoder(collection_name):
+    """
+    Build (once) a function converting a document of the collection to JSON-native types.
+
+    Known fields get a converter specialized for their type; any other field
+    falls back to to_plain only when its value is not already a plain type.
+    """
+    schema = COLLECTION_SCHEMAS.get(collection_name, {})
+    converters = {}
+    converters.update((field, timestamp_value) for field in schema.get("timestamps", []))
+    converters.update((field, reference_value) for field in schema.get("references", []))
+    converters.update((field, reference_list_value) for field in schema.get("reference_lists", []))
+    converters.update((field, to_plain) for field in schema.get("nested", []))
+    get_converter = converters.get
+
+    def encode(data):
+        encoded = {}
+        for key, value in data.items():
+            converter = get_converter(key)
+            if converter is not None:
+                encoded[key] = converter(value)
+            elif isinstance(value, PLAIN_TYPES):
+                encoded[key] = value
+            else:
+                encoded[key] = to_plain(value)
+        return encoded
+
+    return encode
+
+def encode_jsonl_line(collection_name, doc_id, data):
+    """One JSONL line (with trailing newline) for a document, with its ID added."""
+    encoded = get_encoder(collection_name)(data)
+    encoded["id"] = doc_id
+    return _dumps(encoded) + "\n"
+
+def join_reference_paths(values):
+    """Comma-joined paths of a list of DocumentReferences (or already-string paths)."""
+    return ",".join([value if isinstance(value, str) else getattr(value, "path", None) or str(value) for value in values])
+
+def format_timestamp(ts):
+    """Format Firestore timestamps and ISO 8601 strings, skipping the re-parse for canonical strings."""
+    if isinstance(ts, str):
+        if CANONICAL_ISO_TIMESTAMP.fullmatch(ts):
+            return ts
+        try:
+            return datetime.fromisoformat(ts).isoformat()
+        except ValueError:
+            return ""  # Leave blank for invalid strings
+    if hasattr(ts, "isoformat"):  # Firestore Timestamp
+        return ts.isoformat()
+    return ""  # Leave blank if the field is missing
@@ -0,0 +1,27 @@
+import argparse
+import json
+import pytest
+import benchmark_pipeline
+import mock_data_delete
+
+@pytest.mark.parametrize("deleted", [None, 1])
+def test_delete_stage_fails_when_not_everything_was_deleted(tmp_path, monkeypatch, deleted):
+    manifest = tmp_path / "created_items.jsonl"
+    manifest.write_text("".join(json.dumps({"collection": "users", "id": f"u{i}"}) + "\n" for i in range(3)))
+    monkeypatch.setattr(mock_data_delete, "delete_created_items_bulk", lambda path: deleted)
+
+    with pytest.raises(RuntimeError):
+        benchmark_pipeline.run_delete(argparse.Namespace(work_dir=str(tmp_path)))
+
+def test_delete_stage_counts_the_manifest(tmp_path, monkeypatch):
+    manifest = tmp_path / "created_items.jsonl"
+    manifest.write_text(json.dumps({"collection": "users", "id": "u1"}) + "\n")
+    monkeypatch.setattr(mock_data_delete, "delete_created_items_bulk", lambda path: 1)
+
+    assert benchmark_pipeline.run_delete(argparse.Namespace(work_dir=str(tmp_path))) == {"documents": 1}
+
+def test_summary_reports_only_what_a_few_runs_support():
+    runs = [(2.0, 100.0, {"documents": 10}), (1.0, 120.0, {"documents": 10}), (4.0, 90.0, {"documents": 10})]
+    summary = benchmark_pipeline.summarize(runs)
+    assert summary["seconds"] == {"min": 1.0, "median": 2.0, "max": 4.0}
+    assert summary["docs_per_sec"] == 5.0 and summary["peak_rss_mb"] == 120.0
@@ -0,0 +1,101 @@
+import json
+import operator
+from datetime import datetime, timedelta, timezone
+import connections
+import context_packs
+
+OPERATORS = {"==": operator.eq, ">": operator.gt, ">=": operator.ge, "<=": operator.le, "in": lambda value, values: value in values}
+
+class FakeReference:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeReference) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __lt__(self, other):
+        return self.path < other.path
+
+    def __le__(self, other):
+        return self.path <= other.path
+
+    def __gt__(self, other):
+        return self.path > other.path
+
+    def __ge__(self, other):
+        return self.path >= other.path
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+    def get(self, field):
+        return self.data.get(field)
+
+class FakeQuery:
+    """Equality, range and "in" filters over a list of (ID, document) pairs."""
+    def __init__(self, docs, filters=()):
+        self.docs = docs
+        self.filters = list(filters)
+
+    def where(self, filter):
+        return FakeQuery(self.docs, self.filters + [filter])
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        for doc_id, data in self.docs:
+            if all(f.field_path in data and OPERATORS[f.op_string](data[f.field_path], f.value) for f in self.filters):
+                yield FakeSnapshot(doc_id, data)
+
+class FakeClient:
+    def __init__(self, collections):
+        self.collections = collections
+
+    def collection(self, name):
+        return FakeQuery(self.collections.get(name, []))
+
+    def document(self, path):
+        return FakeReference(path)
+
+def event(dog_id, event_type, day, **data):
+    return {"dogId": FakeReference(f"dogs/{dog_id}"), "type": event_type,
+            "eventDate": datetime(2024, 1, day, tzinfo=timezone.utc), "updatedAt": datetime(2024, 1, day, tzinfo=timezone.utc),
+            "data": data}
+
+def test_pack_sections_match_the_chat_flow_queries(monkeypatch):
+    events = [event("dogA", "dietException", day, foodType=f"food{day}", amount=day, brandName="ignored")
+              for day in range(1, 6)]
+    events += [event("dogA", "wellness", 2, mentalState="calm", severity=1),
+               event("dogA", "diet", 3, foodType="legacy type, not queried by the flow"),
+               event("dogB", "weightChange", 4, weight=12),
+               event("dogC", "health", 4, eventType="outside the chunk")]
+    db = FakeClient({"events": [(f"e{i}", data) for i, data in enumerate(events)]})
+    monkeypatch.setattr(connections, "get_firestore_client", lambda: db)
+
+    profiles = {"dogA": {"name": "Rex"}, "dogB": {"name": "Bo"}}
+    for sparse in (False, True):
+        packs = {dog_id: json.loads(pack) for dog_id, pack in context_packs.build_pack_chunk(["dogA", "dogB"], profiles, 3, sparse)}
+
+        dog_a = packs["dogA"]
+        assert [summary["foodType"] for summary in dog_a["dietEvents"]] == ["food3", "food4", "food5"]
+        assert dog_a["dietEvents"][-1] == {"foodType": "food5", "amount": 5, "eventDate": "2024-01-05T00:00:00+00:00"}
+        assert dog_a["wellnessEvents"] == [{"mentalState": "calm", "severity": 1, "eventDate": "2024-01-02T00:00:00+00:00"}]
+        assert dog_a["eventCounts"] == {"dietEvents": 5, "wellnessEvents": 1}
+        assert dog_a["lastEventDate"] == "2024-01-05T00:00:00+00:00"
+        assert datetime.fromisoformat(dog_a["eventsReadAt"]) < datetime.now(timezone.utc) - timedelta(seconds=30)
+        assert packs["dogB"]["weightChangeEvents"] == [{"weight": 12, "eventDate": "2024-01-04T00:00:00+00:00"}]
+        assert packs["dogB"]["healthEvents"] == []
+
+def test_dogs_with_new_events():
+    db = FakeClient({"events": [("e1", event("dogA", "health", 1)), ("e2", event("dogB", "health", 9))]})
+    assert context_packs.dogs_with_new_events(db, datetime(2024, 1, 5, tzinfo=timezone.utc)) == {"dogB"}
@@ -0,0 +1,56 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta
+import pyarrow.parquet as pq
+import event_store
+
+def write_events(path, event_type, count, rng):
+    start = datetime(2024, 1, 1)
+    with open(path, "w") as file:
+        for i in range(count):
+            event = {"id": f"{event_type}{i}", "type": event_type, "userId": "users/u1",
+                     "createdAt": (start + timedelta(hours=rng.randrange(10_000))).isoformat()}
+            if rng.random() > 0.05:
+                event["dogId"] = f"dogs/dog{rng.randrange(40):03d}"
+            file.write(json.dumps(event) + "\n")
+
+def test_store_built_from_bounded_runs_is_sorted_and_indexed(tmp_path, monkeypatch):
+    rng = random.Random(0)
+    files = {}
+    for event_type in ["health", "diet"]:
+        files[event_type] = str(tmp_path / f"{event_type}Events.jsonl")
+        write_events(files[event_type], event_type, 700, rng)
+    monkeypatch.setattr(event_store, "EVENT_JSONL_FILES", files)
+    monkeypatch.setattr(event_store, "BUILD_CHUNK_SIZE", 90)
+    monkeypatch.setattr(event_store, "BUILD_RUN_ROWS", 200)
+    monkeypatch.setattr(event_store, "MIN_MERGE_BATCH_ROWS", 16)
+    monkeypatch.setattr(event_store, "STORE_ROW_GROUP_SIZE", 32)
+    monkeypatch.setattr(event_store, "STORE_FILE_ROWS", 500)
+    directory = str(tmp_path / "store")
+
+    index = event_store.build_event_store(directory=directory)
+
+    assert sorted(os.listdir(directory)) == ["index.json", "part-00000.parquet", "part-00001.parquet", "part-00002.parquet"]
+    table = event_store.EventStore(directory).scan_dogs("dog000", "dog999")
+    keys = list(zip(table["dog_id"].to_pylist(), table["event_date"].to_pylist()))
+    assert keys == sorted(keys)
+    assert index["rows"] == table.num_rows == 1400 - index["eventsWithoutDog"]
+    for entry in index["files"]:
+        metadata = pq.ParquetFile(os.path.join(directory, entry["file"])).metadata
+        assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [group["rows"] for group in entry["rowGroups"]]
+
+    store = event_store.EventStore(directory, cache_size=0)
+    for dog_id in ["dog000", "dog017", "dog039"]:
+        expected = sorted(event_id for event_id, dog in zip(table["event_id"].to_pylist(), table["dog_id"].to_pylist()) if dog == dog_id)
+        assert sorted(store.scan(dog_id)["event_id"].to_pylist()) == expected
+
+def test_store_without_any_dog_event_is_not_stale(tmp_path, monkeypatch):
+    path = str(tmp_path / "healthEvents.jsonl")
+    with open(path, "w") as file:
+        file.write(json.dumps({"id": "h1", "type": "health", "createdAt": "2024-01-01T00:00:00"}) + "\n")
+    monkeypatch.setattr(event_store, "EVENT_JSONL_FILES", {"health": path})
+    directory = str(tmp_path / "store")
+
+    assert event_store.build_event_store(directory=directory)["files"] == []
+    assert not event_store.store_is_stale(directory)
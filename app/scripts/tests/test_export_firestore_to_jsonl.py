@@ -0,0 +1,21 @@
+import json
+import os
+import export_firestore_to_jsonl
+from test_context_packs import FakeClient
+
+def read_jsonl(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+def test_projected_export_leaves_the_full_snapshot_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(export_firestore_to_jsonl.OUTPUT_DIRECTORY)
+    db = FakeClient({"dogs": [("dog1", {"name": "Rex", "breed": "Pug", "healthEventIds": ["healthEvents/e1"]})]})
+    monkeypatch.setattr(export_firestore_to_jsonl, "get_firestore_client", lambda: db)
+
+    full_path = export_firestore_to_jsonl.fetch_and_save_data("dogs")
+    join_path = export_firestore_to_jsonl.fetch_and_save_data("dogs", target="join")
+
+    assert os.path.basename(full_path) == "dogs.jsonl"
+    assert os.path.basename(join_path) == "dogs.join.jsonl"
+    assert read_jsonl(full_path)[0]["healthEventIds"] == ["healthEvents/e1"]
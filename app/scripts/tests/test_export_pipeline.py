@@ -0,0 +1,48 @@
+import threading
+import pytest
+import export_pipeline
+
+class FakeDocument:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+    def to_dict(self):
+        return {"email": f"{self.id}@example.com"}
+
+class FailingCollection:
+    """A collection whose stream raises after a few documents, like a dropped connection."""
+    def __init__(self, docs_before_error):
+        self.docs_before_error = docs_before_error
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        for i in range(self.docs_before_error):
+            yield FakeDocument(f"user{i}")
+        raise ConnectionError("stream dropped")
+
+class FakeClient:
+    def __init__(self, docs_before_error):
+        self.docs_before_error = docs_before_error
+
+    def collection(self, name):
+        return FailingCollection(self.docs_before_error)
+
+@pytest.mark.parametrize("docs_before_error", [0, 10, export_pipeline.CHUNK_SIZE + 10])
+def test_read_error_propagates_instead_of_hanging(tmp_path, monkeypatch, docs_before_error):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(export_pipeline, "get_firestore_client", lambda: FakeClient(docs_before_error))
+
+    errors = []
+    def run():
+        try:
+            export_pipeline.run_pipeline(["jsonl", "csv"], collections=["users"])
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "run_pipeline hung after the Firestore stream failed"
+    assert len(errors) == 1 and isinstance(errors[0], ConnectionError)
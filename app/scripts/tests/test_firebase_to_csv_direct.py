@@ -0,0 +1,9 @@
+from firebase_to_csv_direct import TYPED_CONVERTERS, TYPED_EVENT_FIELDS
+
+def test_integer_columns_never_truncate():
+    integer = TYPED_CONVERTERS["integer"]
+    assert [integer(value) for value in (3, 3.0, "4", 12.5, 0.5, "x", None)] == [3, 3, 4, "", "", "", ""]
+
+def test_fractional_event_fields_are_floats():
+    assert ("quantity", "float") in TYPED_EVENT_FIELDS["dietEvents"]
+    assert ("duration", "float") in TYPED_EVENT_FIELDS["exerciseEvents"]
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import pytest
+from google.api_core.exceptions import NotFound
+import gcs_upload
+import output_files
+from output_files import compression_codec, open_output, resolve_output
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self.bucket.blobs
+
+    def reload(self):
+        if not self.exists():
+            raise NotFound(self.name)
+        self.crc32c = "stale"
+
+    def upload_from_filename(self, path, checksum=None):
+        with open(path, "rb") as file:
+            self.bucket.blobs[self.name] = file.read()
+
+    def delete(self):
+        del self.bucket.blobs[self.name]
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        return [FakeBlob(self, name) for name in sorted(self.blobs) if name.startswith(prefix)]
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket())
+
+def write_csv(path, text):
+    with open_output(path, "gzip", newline="") as file:
+        file.write(text)
+    return resolve_output(path)
+
+def test_manifest_is_uploaded_and_superseded_versions_deleted(tmp_path, monkeypatch):
+    storage = FakeStorageClient()
+    monkeypatch.setattr(gcs_upload, "get_storage_client", lambda: storage)
+    monkeypatch.setattr(gcs_upload, "local_crc32c", lambda path: None)
+    directory = str(tmp_path)
+
+    def upload(text):
+        path = write_csv(os.path.join(directory, "users.csv"), text)
+        uploads = [(path, "bucket", f"mockData/{os.path.basename(path)}")]
+        gcs_upload.upload_files(uploads)
+        gcs_upload.publish_content_manifest(directory, uploads)
+        return uploads[0][2]
+
+    first = upload("id\nu1\n")
+    storage.bucket("bucket").blobs["mockData/users-00000-of-00002-0123456789abcdef.csv.gz"] = b"shard of another output"
+    second = upload("id\nu1\nu2\n")
+
+    blobs = storage.bucket("bucket").blobs
+    assert first != second and first not in blobs and second in blobs
+    assert "mockData/users-00000-of-00002-0123456789abcdef.csv.gz" in blobs
+    assert json.loads(blobs["mockData/content_manifest.json"])["users.csv"] == os.path.basename(second)
+
+def test_up_to_date_uploads_are_reported_as_skipped(tmp_path, monkeypatch):
+    storage = FakeStorageClient()
+    monkeypatch.setattr(gcs_upload, "get_storage_client", lambda: storage)
+    path = write_csv(os.path.join(str(tmp_path), "users.csv"), "id\nu1\n")
+    uploads = [(path, "bucket", f"mockData/{os.path.basename(path)}")]
+
+    skipped = []
+    assert gcs_upload.upload_files(uploads, skipped=skipped) == [] and skipped == []
+    assert gcs_upload.upload_files(uploads, skipped=skipped) == [] and skipped == [path]
+
+@pytest.mark.parametrize("codec", [None, "lz4"])
+def test_compress_requires_a_known_codec(codec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        compression_codec(codec)
+
+def test_compress_codec():
+    assert compression_codec("gzip") == "gzip"
+
+def test_missing_codec_is_rejected_up_front(monkeypatch):
+    monkeypatch.setattr(output_files.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(argparse.ArgumentTypeError):
+        output_files.compression_codec("zstd")
+    assert output_files.compression_codec("gzip") == "gzip"
+
+def test_failed_compressor_leaves_no_temp_file(tmp_path, monkeypatch):
+    def broken(compression, file):
+        raise ImportError("No module named 'zstandard'")
+
+    monkeypatch.setattr(output_files, "compressing_stream", broken)
+    with pytest.raises(ImportError):
+        with open_output(os.path.join(str(tmp_path), "users.jsonl"), "zstd"):
+            pass
+    assert os.listdir(str(tmp_path)) == []
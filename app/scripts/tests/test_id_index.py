@@ -0,0 +1,20 @@
+import json
+import os
+import id_index
+
+def write_ids(path, ids):
+    with open(path, "w") as file:
+        file.writelines(json.dumps({"id": doc_id}) + "\n" for doc_id in ids)
+
+def test_index_is_rebuilt_when_its_export_changes(tmp_path):
+    jsonl_directory = str(tmp_path)
+    index_directory = str(tmp_path / "id_index")
+    dogs_path = os.path.join(jsonl_directory, "dogs.jsonl")
+    write_ids(dogs_path, ["b", "a"])
+
+    assert id_index.load_id_indexes(["dogs"], jsonl_directory, index_directory) is None
+    id_index.build_id_indexes(["dogs"], jsonl_directory, index_directory)
+    assert id_index.load_id_indexes(["dogs"], jsonl_directory, index_directory)["dogs"].id_strings() == ["a", "b"]
+
+    write_ids(dogs_path, ["c", "b", "a"])
+    assert id_index.load_id_indexes(["dogs"], jsonl_directory, index_directory) is None
@@ -0,0 +1,19 @@
+import pyarrow.dataset as ds
+from jsonl_to_csv_to_gcs import ParquetDatasetWriter
+
+DOG = ("u1", "Rex", "3", "Beagle", "male", "12")
+USER = ("rex@example.com", "Ann")
+
+def test_parquet_buffers_stay_under_the_global_cap(tmp_path):
+    writer = ParquetDatasetWriter(str(tmp_path), max_buffered_rows=10)
+    peak = 0
+    for i in range(120):
+        event = {"id": f"e{i}", "eventDate": f"2024-{i % 12 + 1:02d}-01T00:00:00Z", "duration": 0.5}
+        writer.write("exercise", event, "u1", "d1", DOG, USER)
+        peak = max(peak, writer.buffered_rows)
+    writer.close()
+
+    assert peak < 10
+    table = ds.dataset(str(tmp_path), partitioning="hive").to_table()
+    assert table.num_rows == 120
+    assert set(table.column("duration").to_pylist()) == {0.5}
@@ -54,8 +54,24 @@ export async function generateDogResponse({ dogId, testQuestion }: { dogId: stri
     const dogRef = db.doc(`/dogs/${dogId}`);
     console.log("path to doggy", dogRef)
 
+    // Precomputed context pack (app/scripts/context_packs.py --firestore): built from the same
+    // "events" documents as the live queries below. It is used only when no event was written or
+    // edited after the pack read them; otherwise the live queries answer. The pack and its
+    // freshness check are read while the dog document is being fetched.
+    const packRead = db.collection("dogContext").doc(dogId).get().then(async (contextDoc) => {
+      const pack = contextDoc.data();
+      const newerEvents = pack?.eventsReadAt
+        ? await db.collection("events")
+          .where("dogId", "==", dogRef)
+          .where("updatedAt", ">", pack.eventsReadAt)
+          .limit(1)
+          .get()
+        : null;
+      return { pack, newerEvents };
+    });
+    const [dogDoc, { pack, newerEvents }] = await Promise.all([dogRef.get(), packRead]);
+
     // Fetch dog's data from Firestore.
-    const dogDoc = await dogRef.get();
     if (!dogDoc.exists) {
       console.error("No document found for dogId:", dogId);
     } else {
@@ -73,6 +89,25 @@ export async function generateDogResponse({ dogId, testQuestion }: { dogId: stri
     };
     console.log("Simplified Dog Data:", simplifiedDogData);
 
+    if (pack && newerEvents?.empty) {
+      const packOutput = await dogVetPrompt({
+        simplifiedDogData,
+        dietEvents: pack.dietEvents,
+        dietScheduleEvents: pack.dietScheduleEvents,
+        behaviorEvents: pack.behaviorEvents,
+        exerciseEvents: pack.exerciseEvents,
+        healthEvents: pack.healthEvents,
+        wellnessEvents: pack.wellnessEvents,
+        poopJournalEvents: pack.poopJournalEvents,
+        vetAppointmentEvents: pack.vetAppointmentEvents,
+        vaccinationAppointmentEvents: pack.vaccinationAppointmentEvents,
+        weightChangeEvents: pack.weightChangeEvents,
+        testQuestion,
+      });
+      console.log("LLM Response (context pack):", packOutput.text);
+      return packOutput.text;
+    }
+
     // Fetch raw events from Firestore from the root-level "events" collection.
     const dietExceptionRaw = (await db.collection("events")
       .where("dogId", "==", dogRef)